@@ -17,6 +17,14 @@ from mathutils import Vector
 import numpy as np
 import math
 import csv
+import hashlib
+import json
+import functools
+import itertools
+import logging
+import shutil
+import tempfile
+import time
 
 from bpy.props import (StringProperty,
                        BoolProperty,
@@ -27,6 +35,7 @@ from bpy.props import (StringProperty,
                        PointerProperty,
                        )
 
+from bpy.app.handlers import persistent
 from bpy.types import (Panel,
                        Menu,
                        Operator,
@@ -35,6 +44,45 @@ from bpy.types import (Panel,
 from numpy import arange, subtract
 
 
+### Instrumentation
+
+logger = logging.getLogger("BlenderSFFRTI")
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Wall time of every operator run, oldest first
+_operatorTimings = []
+
+# Phase timings and output size of every frame rendered in this session, keyed on frame
+_frameTimings = {}
+
+# Timestamps of the phases of the frame currently being rendered
+_frameMarks = {}
+
+# Set while RenderStill renders, so that render handlers don't mistake the still for a frame of the acquisition
+_renderingStill = False
+
+def TimeOperator(execute):
+    """
+    Decorator recording the wall time of an operator's execute method
+    """
+
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        start = time.perf_counter()
+        result = execute(self, context)
+        seconds = time.perf_counter() - start
+
+        _operatorTimings.append({"operator": self.bl_idname, "seconds": seconds, "result": sorted(result), "time": time.time()})
+        logger.debug("{0} took {1:.4f} s".format(self.bl_idname, seconds))
+
+        return result
+
+    return wrapper
+
+
 ### Scene Properties
 
 class light(bpy.types.PropertyGroup):
@@ -69,8 +117,57 @@ class lightSettings(PropertyGroup):
         default=1
     )
 
+    light_rig_type : EnumProperty(
+        name = "Light rig types",
+        description = "Select how lights from the .lp file are placed in the scene",
+        items = [
+            ('Dome', "Light dome", "Create one light object for every position in the .lp file"),
+            ('Moving', "Moving sun", "Create a single light that is animated through every position in the .lp file")
+                ]
+    )
+
+    use_light_subset : BoolProperty(
+        name="Use light subset",
+        description="Only create a subset of the .lp file's lights, chosen to keep the RTI fit well conditioned",
+        default=False
+    )
+
+    subset_size : IntProperty(
+        name="Subset size",
+        description="Number of lights to keep from the .lp file",
+        default=36,
+        min=1
+    )
+
+    subset_criterion : EnumProperty(
+        name = "Subset criterion",
+        description = "Select how lights are chosen for the subset",
+        items = [
+            ('Conditioning', "Fit conditioning", "Greedily add the light that most improves the conditioning of the fitting basis"),
+            ('Coverage', "Angular coverage", "Greedily add the light farthest from every light chosen so far")
+                ]
+    )
+
+    subset_basis : EnumProperty(
+        name = "Fitting basis",
+        description = "Select the RTI basis the subset is planned for",
+        items = [
+            ('PTM', "PTM", "Biquadratic polynomial texture map, 6 terms"),
+            ('HSH2', "HSH order 2", "Hemispherical harmonics, 4 terms"),
+            ('HSH3', "HSH order 3", "Hemispherical harmonics, 9 terms")
+                ]
+    )
+
     # light_object_list : bpy.props.CollectionProperty(type = light)
     light_list = []
+    light_positions = []
+
+    # 1-based .lp entry number of every stored light position
+    light_numbers = []
+
+    # .lp indices of the planned light subset, and (K, expected fit error) for subsets of every size
+    light_subset = []
+    subset_errors = []
 
 class cameraSettings(PropertyGroup):
 
@@ -80,7 +177,9 @@ class cameraSettings(PropertyGroup):
         items = [
             ('Auto', "Automatic focus limits", "Sets focus limits based on highest and lowest vertices of selected object."),
             ('Manual', "Manual focus limits", "Allows for setting of focus limits manually."),
-            ('Tasked', "Tasked SFF w/ CSV", "Reads a given CSV for depth levels to image at.")
+            ('Tasked', "Tasked SFF w/ CSV", "Reads a given CSV for depth levels to image at."),
+            ('DoF', "Depth of field planner", "Places the fewest focus levels whose depth of field covers the selected object with the given overlap."),
+            ('Density', "Surface density", "Places focus levels only at heights where the selected object has vertices, weighted by vertex density, keeping the Auto level spacing.")
                 ]
     )
 
@@ -135,6 +234,75 @@ class cameraSettings(PropertyGroup):
         description="Aperture size, measured in f-stops",
     )
 
+    lens : FloatProperty(
+        name="Focal length [mm]",
+        description="Focal length of the SFF camera lens",
+        default=50.0,
+        min=1.0,
+    )
+
+    sensor_width : FloatProperty(
+        name="Sensor width [mm]",
+        description="Width of the SFF camera sensor",
+        default=36.0,
+        min=1.0,
+    )
+
+    dof_overlap : FloatProperty(
+        name="Depth of field overlap",
+        description="Fraction of every focus level's depth of field shared with the next level",
+        default=0.2,
+        min=0.0,
+        max=0.9,
+        subtype='FACTOR',
+    )
+
+    circle_of_confusion : FloatProperty(
+        name="Circle of confusion [mm]",
+        description="Largest blur diameter on the sensor that still counts as in focus. 0 uses the sensor diagonal / 1500",
+        default=0.0,
+        min=0.0,
+        precision=4,
+    )
+
+    per_level_fstop : BoolProperty(
+        name="Per-level f-stop",
+        description="Spread the given number of focus levels over the object and pick every level's f-stop so that their depths of field overlap as set, instead of using a fixed aperture",
+        default=False,
+    )
+
+    density_threshold : FloatProperty(
+        name="Empty height threshold",
+        description="Height bins holding less than this fraction of the average bin's vertices are treated as empty. 0 only skips bins without any vertices",
+        default=0.0,
+        min=0.0,
+        max=1.0,
+        subtype='FACTOR',
+    )
+
+    sff_render_mode : EnumProperty(
+        name = "SFF render modes",
+        description = "Select how focus levels are rendered",
+        items = [
+            ('PathTraced', "Path traced depth of field", "Render every light at every focus level with Cycles depth of field"),
+            ('Synthetic', "Synthetic defocus", "Render every light once in focus with a depth pass, then blur it for every focus level. Requires a static camera")
+                ]
+    )
+
+    synthetic_blur_levels : IntProperty(
+        name="Blur levels",
+        description="Number of blur radii precomputed per light for synthetic defocus. Blur in between is interpolated",
+        default=16,
+        min=2,
+    )
+
+    comparison_frames : IntProperty(
+        name="Comparison frames",
+        description="Number of frames to path trace when comparing synthetic defocus against true depth of field",
+        default=4,
+        min=1,
+    )
+
     sff_parent : PointerProperty(
         name="SFF Parent",
         type=bpy.types.Object,
@@ -153,6 +321,9 @@ class cameraSettings(PropertyGroup):
     camera_list = []
     zPosList = []
 
+    # Per-level f-stops planned with zPosList, empty when every level uses aperture_size
+    fstopList = []
+
 class fileSettings(PropertyGroup):
 
     output_path : StringProperty(
@@ -167,6 +338,131 @@ class fileSettings(PropertyGroup):
         default=False
     )
 
+    log_level : EnumProperty(
+        name = "Log level",
+        description = "Select how much the add-on prints to the console",
+        items = [
+            ('WARNING', "Warnings", "Only print warnings and errors"),
+            ('INFO', "Info", "Print a summary line per operation"),
+            ('DEBUG', "Debug", "Print a line per frame and operator timings. Slow for large acquisitions")
+                ],
+        default = 'INFO',
+        update = lambda self, context: logger.setLevel(self.log_level)
+    )
+
+    output_profile : EnumProperty(
+        name = "Output profile",
+        description = "Select how beauty, depth, and normal images are written for each frame",
+        items = [
+            ('PNG', "PNG + Depth/Normal", "8-bit PNG beauty image plus separate Depth and Normal images written by compositor file nodes"),
+            ('EXR', "Multilayer EXR", "One float32 multilayer EXR per frame holding beauty, metric depth, and normal layers, without compositing")
+                ],
+        default = 'PNG'
+    )
+
+    pass_profile : EnumProperty(
+        name = "Passes",
+        description = "Select which render passes are computed for every frame",
+        items = [
+            ('Beauty', "Beauty", "Only the combined image"),
+            ('Geometry', "Beauty + Depth/Normal", "Combined image plus depth and normal passes"),
+            ('Full', "All light passes", "Combined, depth, and normal plus shadow, diffuse, and glossy passes")
+                ],
+        default = 'Geometry'
+    )
+
+    share_invariant_passes : BoolProperty(
+        name="Write depth/normal once per camera position",
+        description="Only write depth and normal outputs on the first frame of every camera position, and point the other frames' manifest records at the shared files. Multilayer EXR files always hold every pass",
+        default=True
+    )
+
+    exr_codec : EnumProperty(
+        name = "EXR compression",
+        description = "Compression of multilayer EXR files",
+        items = [
+            ('NONE', "None", "No compression. Fastest to write, largest files"),
+            ('ZIP', "ZIP", "Lossless, good for renders with little noise"),
+            ('PIZ', "PIZ", "Lossless, good for noisy renders"),
+            ('DWAA', "DWAA", "Lossy, smallest files")
+                ],
+        default = 'ZIP'
+    )
+
+    use_roi_border : BoolProperty(
+        name="Crop renders to the object",
+        description="Render every frame only within a border tightly fitting the main object as seen from the frame's camera state, and record the crop's offset in the render manifest",
+        default=False
+    )
+
+    roi_margin : IntProperty(
+        name="Border margin (px)",
+        description="Number of pixels added around the main object's projected bounds",
+        default=16,
+        min=0
+    )
+
+    roi_scope : EnumProperty(
+        name = "Border scope",
+        description = "Select how often the render border is fitted",
+        items = [
+            ('Level', "Per focus level", "Fit a border for every focus level, the tightest crop when the camera moves"),
+            ('Acquisition', "Whole acquisition", "Use one border covering every focus level, so that all frames have the same size")
+                ],
+        default = 'Level'
+    )
+
+    write_render_manifest : BoolProperty(
+        name="Write render manifest",
+        description="Append a record with parameters, output paths, render time, and checksums to the render manifest for every finished frame",
+        default=True
+    )
+
+    noise_target : FloatProperty(
+        name="Noise target (RMSE)",
+        description="Largest allowed root mean square error of tuned renders against the high-sample reference",
+        default=0.005,
+        min=0.0,
+        precision=4
+    )
+
+    reference_samples : IntProperty(
+        name="Reference samples",
+        description="Number of samples used for the reference renders when tuning samples",
+        default=4096,
+        min=32
+    )
+
+    use_frame_cache : BoolProperty(
+        name="Use frame cache",
+        description="Render frames with identical inputs only once, linking cached outputs into place for every other frame",
+        default=False
+    )
+
+    frame_cache_path : StringProperty(
+        name="Frame cache folder",
+        subtype="DIR_PATH",
+        description="Folder for cached frame outputs, which can be shared between acquisitions",
+        default="",
+        maxlen=1024
+    )
+
+    frame_cache_size : FloatProperty(
+        name="Frame cache size (GB)",
+        description="Least recently used frames are removed from the cache once it grows past this size",
+        default=50.0,
+        min=0.0
+    )
+
+    animation_mode : EnumProperty(
+        name = "Animation modes",
+        description = "Select how lights and cameras are changed between frames",
+        items = [
+            ('Keyframes', "Keyframed animation", "Bake light visibility and camera changes into keyframes"),
+            ('Driver', "Frame change driver", "Set the active light and camera on every frame change from a stored acquisition table, without keyframes")
+                ]
+    )
+
     # output_file_name : StringProperty(
     #     name="Output file name",
     #     description="File name to use when outputting image files for frames.",
@@ -174,20 +470,34 @@ class fileSettings(PropertyGroup):
     #     maxlen=1024
     # )
 
-    csvOutputLines = []
-
 ### Operators
 
 class CreateLights(Operator):
     bl_label = "Create RTI system"
     bl_idname = "rti.create_rti"
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
         rtitool = scene.rti_tool
 
-        if not os.path.isfile(rtitool.lp_file_path):
-            self.report({"ERROR"})
+        # Read in .lp data and re-project every light onto the dome before touching bpy
+        try:
+            positions = ProjectToDome(ReadLPFile(rtitool.lp_file_path), rtitool.dome_radius)
+        except (OSError, ValueError) as ex:
+            self.report({'ERROR'}, "Could not read .lp file: {0}".format(ex))
+            return {'CANCELLED'}
+
+        # Light numbers follow the .lp file, so subset lights keep the number of their .lp entry
+        lightNumbers = np.arange(1, len(positions) + 1)
+
+        if rtitool.use_light_subset and rtitool.subset_size < len(positions):
+            order, _ = SelectLightSubset(positions, rtitool.subset_size, rtitool.subset_basis, rtitool.subset_criterion)
+            subset = np.sort(order)
+
+            rtitool.light_subset[:] = subset.tolist()
+            positions = positions[subset]
+            lightNumbers = lightNumbers[subset]
 
         # Delete pre-existing lights
         # DeleteLights()
@@ -201,38 +511,43 @@ class CreateLights(Operator):
         # Link to properties
         rtitool.rti_parent = rti_parent
 
-        # Read in .lp data
-        try:
-            file = open(rtitool.lp_file_path)
-        except RuntimeError as ex:
-            error_report = "\n".join(ex.args)
-            print("Caught error:", error_report)
-            return {'ERROR'}
-
-        rows = file.readlines()
-        file.close()
-
-        # Parse for number of lights
-        numLights = int(rows[0].split()[0])
+        # Keep projected positions around so other operators don't need to re-read the .lp file
+        rtitool.light_positions.clear()
+        rtitool.light_positions.extend(positions.tolist())
+        rtitool.light_numbers[:] = lightNumbers.tolist()
 
         # Create default light data
         # NOTE: Using SUN light source for ease of lighting right now since it doesn't implement the Inverse-Square Law for falloff of light intensity
         lightData = bpy.data.lights.new(name="RTI_light", type="SUN")
 
-        # Run through .lp file and create all lights
-        for idx in range(1, numLights + 1):
-            cols = rows[idx].split()
-            x = float(cols[1])
-            y = float(cols[2])
-            z = float(cols[3])
+        # Record what the RTI system owns so that DeleteLights removes exactly that
+        TagRigIDs('RTI', rti_parent, lightData)
+
+        if rtitool.light_rig_type == 'Moving':
+            # Create a single light that SetAnimation moves through every stored position
+            current_light = bpy.data.objects.new(name="Light_rig", object_data=lightData)
+
+            x, y, z = positions[0]
+            current_light.location = (x, y, z)
+
+            scene.collection.objects.link(current_light)
+
+            current_light.rotation_mode = 'QUATERNION'
+            current_light.rotation_quaternion = Vector((x,y,z)).to_track_quat('Z','Y')
+
+            current_light.parent = rti_parent
+
+            TagRigIDs('RTI', current_light)
+
+            rtitool.light_list.append(current_light.name)
+
+            return {"FINISHED"}
 
-            r, long, lat = Cartesian2Polar3D(x,y,z)
-            r = rtitool.dome_radius
-            x, y, z = Polar2Cartesian3D(r,long,lat)
+        # Run through projected positions and create all lights
+        for idx, (x, y, z) in zip(lightNumbers.tolist(), positions.tolist()):
 
             # Create light
             current_light = bpy.data.objects.new(name="Light_{0}".format(idx), object_data=lightData)
-            # current_light = bpy.data.objects.new(name="Lamp_{0}".format(idx), object_data=bpy.data.lights.new(name="RTI_light", type="SUN"))
 
             # Re-position light
             current_light.location = (x, y, z)
@@ -246,17 +561,62 @@ class CreateLights(Operator):
             # Link light to rti_parent
             current_light.parent = rti_parent
 
+            TagRigIDs('RTI', current_light)
+
             # Add light name to stored list for easier file creation later
             rtitool.light_list.append(current_light.name)
 
         return {"FINISHED"}
 
 
+class PlanLightSubset(Operator):
+    bl_idname = "rti.plan_light_subset"
+    bl_label = "Plan light subset"
+
+    @TimeOperator
+    def execute(self, context):
+        rtitool = context.scene.rti_tool
+
+        try:
+            positions = ProjectToDome(ReadLPFile(rtitool.lp_file_path), rtitool.dome_radius)
+        except (OSError, ValueError) as ex:
+            self.report({'ERROR'}, "Could not read .lp file: {0}".format(ex))
+            return {'CANCELLED'}
+
+        numLights = min(rtitool.subset_size, len(positions))
+
+        # Plan past the requested size so the report shows what more lights would buy
+        order, errors = SelectLightSubset(positions, min(len(positions), 2 * numLights), rtitool.subset_basis, rtitool.subset_criterion)
+
+        rtitool.light_subset[:] = np.sort(order[:numLights]).tolist()
+        rtitool.subset_errors[:] = [(k, error) for k, error in enumerate(errors.tolist(), start=1) if np.isfinite(error)]
+
+        # Error of fitting with every light in the .lp file, for reference
+        fullError = ExpectedFitError(RTIBasis(positions, rtitool.subset_basis))
+        if len(positions) > len(order):
+            rtitool.subset_errors.append((len(positions), fullError))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for k, error in rtitool.subset_errors:
+                logger.debug("{0} lights: expected fit error {1:.3f} x image noise".format(k, error))
+
+        error = errors[numLights - 1]
+        if not np.isfinite(error):
+            self.report({'WARNING'}, "{0} lights can't determine every term of the {1} basis.".format(numLights, rtitool.subset_basis))
+            return {'FINISHED'}
+
+        self.report({'INFO'}, "{0} of {1} lights: expected fit error {2:.3f} x image noise (all lights: {3:.3f})".format(
+            numLights, len(positions), error, fullError))
+
+        return {'FINISHED'}
+
+
 class CreateSingleCamera(Operator):
     bl_idname = "rti.create_single_camera"
     bl_label = "Create single camera for RTI-only system"
 
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
 
@@ -275,6 +635,9 @@ class CreateSingleCamera(Operator):
         # Set parent to RTI parent
         camera_object.parent = scene.rti_tool.rti_parent
 
+        # The camera belongs to the RTI-only system, so it's deleted with the lights
+        TagRigIDs('RTI', camera_object, camera_data)
+
         # Move camera to default location at top of dome
         camera_object.location = (0,0,scene.rti_tool.dome_radius)
         # camera_object.location = (0,0,2)
@@ -284,6 +647,7 @@ class CreateSingleCamera(Operator):
 
         # NOTE: First clearing zPosList to make sure that previous SFF collections aren't being stored still. This would create a false understanding of the number of positions
         scene.sff_tool.zPosList.clear()
+        scene.sff_tool.fstopList.clear()
 
         # Add default Z-position to zPosList
         scene.sff_tool.zPosList.append(scene.rti_tool.dome_radius)
@@ -296,60 +660,34 @@ class DeleteLights(Operator):
     bl_label="Delete RTI system"
     bl_idname = "rti.delete_rti"
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
         rtitool = scene.rti_tool
 
-        # Iterate through all lights in bpy.data.lights and remove them
-        for current_light in bpy.data.lights:
-            bpy.data.lights.remove(current_light)
-
-        # Empty list of light IDs
-        rtitool.light_list.clear()
-
-        # Deselect any currently selected objects
-        try:
-            bpy.ops.object.select_all(action='DESELECT')
-            # bpy.context.active_object.select_set(False)
-        except:
-            pass
-
-        try:
-            # Source: https://blender.stackexchange.com/questions/44653/delete-parent-object-hierarchy-in-code
-            names = set()
-
-            def get_child_names(obj):
-
-                for child in obj.children:
-                    names.add(child.name)
-                    if child.children:
-                        get_child_names(child)
-
-            get_child_names(rtitool.rti_parent)
-
-            [bpy.data.objects[n].select_set(True) for n in names]
-            rtitool.rti_parent.select_set(True)
-
-            # Remove animation from child objects
-            # for child_name in names:
-            #     bpy.data.objects[child_name].animation.data.clear()
+        # Remove exactly the RTI system's objects and data in one go, without operators that depend on the selection
+        objects, data = GetRigIDs('RTI', rtitool.rti_parent)
+        removedNames = {obj.name for obj in objects}
 
-            # Delete rti_parent object
-            bpy.ops.object.delete()
+        bpy.data.batch_remove(objects + data)
 
-            # Remove rti_parent reference from properties
-            rtitool.rti_parent = None
-
-            # Remove single camera from list if present
-            if len(scene.sff_tool.zPosList) == 1:
-                scene.sff_tool.zPosList.clear()
-                scene.sff_tool.camera_list.clear()
+        # Remove rti_parent reference from properties
+        rtitool.rti_parent = None
 
+        # Empty list of light IDs, stored positions, and the subset planned for them
+        rtitool.light_list.clear()
+        rtitool.light_positions.clear()
+        rtitool.light_numbers.clear()
+        rtitool.light_subset.clear()
+        rtitool.subset_errors.clear()
 
-            # if len(scene.sff_tool.camera_list)
+        # Remove single camera of an RTI-only system from list if present
+        if any(name in removedNames for name in scene.sff_tool.camera_list):
+            scene.sff_tool.camera_list.clear()
+            scene.sff_tool.zPosList.clear()
+            scene.sff_tool.fstopList.clear()
 
-        except:
-            self.report({'ERROR'}, "Broke inside child name getting")
+        logger.info("Deleted {0} objects of the RTI system".format(len(objects)))
 
         return {'FINISHED'}
 
@@ -358,10 +696,23 @@ class CreateCameras(Operator):
     bl_idname = "sff.create_sff"
     bl_label = "Create SFF system"
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
         sfftool = scene.sff_tool
 
+        if sfftool.focus_limits_type in ("Auto", "DoF", "Density") and sfftool.main_object is None:
+            self.report({'ERROR'}, "No object selected for automatic focus limits.")
+            return {'CANCELLED'}
+
+        sfftool.fstopList.clear()
+
+        try:
+            f = DefineFocusLimits(context, sfftool.fstopList)
+        except ValueError as ex:
+            self.report({'ERROR'}, str(ex))
+            return {'CANCELLED'}
+
         # Create parent to hold the system
         sff_parent = bpy.data.objects.new(name = "sff_parent", object_data = None)
 
@@ -371,8 +722,6 @@ class CreateCameras(Operator):
         # Link to properties
         sfftool.sff_parent = sff_parent
 
-        f = DefineFocusLimits(context)
-
         # Add all zPos to sfftool.zPosList
         ## NOTE: Seems to require appending to persist outside of this method
         [sfftool.zPosList.append(i) for i in f]
@@ -387,7 +736,11 @@ class CreateCameras(Operator):
         #     camera_data.type = 'ORTHO'
 
         # Set aperture size
-        camera_data.dof.aperture_fstop = sfftool.aperture_size
+        camera_data.dof.aperture_fstop = sfftool.fstopList[0] if sfftool.fstopList else sfftool.aperture_size
+
+        # Set lens and sensor the focus levels were planned for
+        camera_data.lens = sfftool.lens
+        camera_data.sensor_width = sfftool.sensor_width
 
         if sfftool.camera_type == 'Moving':
             # Set static focus distance
@@ -406,6 +759,9 @@ class CreateCameras(Operator):
         # Set parent to sff_parent
         camera_object.parent = sff_parent
 
+        # Record what the SFF system owns so that DeleteCameras removes exactly that
+        TagRigIDs('SFF', sff_parent, camera_object, camera_data)
+
         # Move camera to desired location
         if sfftool.camera_type == 'Moving':
             # Set camera so that first sF[0])
@@ -425,6 +781,7 @@ class CreateSingleLight(Operator):
     bl_idname = "sff.create_single_light"
     bl_label = "Create single light for SFF-only system"
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
 
@@ -445,6 +802,9 @@ class CreateSingleLight(Operator):
         # Link light to sff_parent
         light.parent = scene.sff_tool.sff_parent
 
+        # The light belongs to the SFF-only system, so it's deleted with the cameras
+        TagRigIDs('SFF', light, lightData)
+
         # Add light ID to RTI light list for animation creation
         scene.rti_tool.light_list.append(light.name)
 
@@ -455,62 +815,30 @@ class DeleteCameras(Operator):
     bl_idname = "sff.delete_sff"
     bl_label = "Delete SFF system"
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
         sfftool = scene.sff_tool
 
-        # Iterate through all cameras in bpy.data.cameras and remove them
-        for cam in bpy.data.cameras:
-            cam.animation_data_clear()
-            bpy.data.cameras.remove(cam)
-
-        # Empty list of camera IDs
-        sfftool.camera_list.clear()
-
-        # Deselect any currently selected objects
-        try:
-            bpy.ops.object.select_all(action='DESELECT')
-            # bpy.context.active_object.select_set(False)
-        except:
-            pass
-
-        try:
-            # Source: https://blender.stackexchange.com/questions/44653/delete-parent-object-hierarchy-in-code
-            names = set()
-
-            def get_child_names(obj):
-
-                for child in obj.children:
-                    names.add(child.name)
-                    if child.children:
-                        get_child_names(child)
-
-                # return names
+        # Remove exactly the SFF system's objects and data in one go, without operators that depend on the selection
+        objects, data = GetRigIDs('SFF', sfftool.sff_parent)
+        removedNames = {obj.name for obj in objects}
 
-            get_child_names(sfftool.sff_parent)
+        bpy.data.batch_remove(objects + data)
 
-            [bpy.data.objects[n].select_set(True) for n in names]
-            sfftool.sff_parent.select_set(True)
+        # Remove sff_parent reference from properties
+        sfftool.sff_parent = None
 
-            # Remove animation from child objects
-            # for child_name in names:
-            #     bpy.data.objects[child_name].animation.data.clear()
-
-            # Delete sff_parent object
-            bpy.ops.object.delete()
-
-            # Remove sff_parent reference from properties
-            sfftool.sff_parent = None
-
-            # Clear zPosList
-            sfftool.zPosList.clear()
+        # Empty list of camera IDs and focus positions
+        sfftool.camera_list.clear()
+        sfftool.zPosList.clear()
+        sfftool.fstopList.clear()
 
-            # NOTE: IF single light exists, assume it's created for SFF and clear it from the stored light list
-            if len(scene.rti_tool.light_list) == 1:
-                scene.rti_tool.light_list.clear()
+        # Remove single light of an SFF-only system from the stored light list if present
+        if any(name in removedNames for name in scene.rti_tool.light_list):
+            scene.rti_tool.light_list.clear()
 
-        except:
-            self.report({'ERROR'}, "Broke inside child name getting")
+        logger.info("Deleted {0} objects of the SFF system".format(len(objects)))
 
         return {'FINISHED'}
 
@@ -519,6 +847,7 @@ class SetAnimation(Operator):
     bl_idname = "sffrti.set_animation"
     bl_label = "Create animation for data collection"
 
+    @TimeOperator
     def execute(self, context):
 
         scene = context.scene
@@ -527,9 +856,13 @@ class SetAnimation(Operator):
         scene.render.engine = 'CYCLES'
 
         # Get total numbers of frames
-        numLights = len(scene.rti_tool.light_list)
+        numLights = GetNumLights(scene)
         numCams = len(scene.sff_tool.camera_list)
 
+        # With a moving sun rig, a single light is keyed through every stored position
+        lightPositions = GetLightPositions(scene)
+        useLightRig = IsLightRig(scene)
+
         # Check to make sure lights and cameras both exist for the animation to be set.
         if numLights < 1:
             self.report({'ERROR'}, "There aren't any lights connected to the scene.")
@@ -537,14 +870,49 @@ class SetAnimation(Operator):
         if numCams < 1:
             self.report({'ERROR'}, "There aren't any cameras connected to the scene.")
             return {'CANCELLED'}
+        if len(scene.sff_tool.zPosList) < 1:
+            self.report({'ERROR'}, "There aren't any focus positions stored for the cameras.")
+            return {'CANCELLED'}
+        if IsSyntheticDefocus(scene) and scene.sff_tool.camera_type != 'Static':
+            self.report({'ERROR'}, "Synthetic defocus requires a static camera.")
+            return {'CANCELLED'}
 
-        #Clear previously stored CSV lines to start anew
-        # scene.file_tool.csvOutputLines = []
-        scene.file_tool.csvOutputLines.clear()
+        ## TODO: Change to just saving and selecting single camera instead of list
+        camera = scene.objects[scene.sff_tool.camera_list[0]]
 
-        # Create CSV header
-        csvHeader = "image,x_lamp,y_lamp,z_lamp,z_cam,aperture_fstop,lens"
-        scene.file_tool.csvOutputLines.append(csvHeader)
+        # Precompute every frame of the acquisition. Frames iterate over all lights for each Z position, based on SyntheticRTI
+        zPos = np.asarray(scene.sff_tool.zPosList, dtype=np.float64)
+        numFrames = len(zPos) * numLights
+
+        frames = np.arange(1, numFrames + 1, dtype=np.float64)
+        camIdx = np.repeat(np.arange(len(zPos)), numLights)
+        lightIdx = np.tile(np.arange(numLights), len(zPos))
+
+        if scene.sff_tool.camera_type == 'Moving':
+            # Move camera to current in zPosList
+            zLevels = scene.sff_tool.static_focus + zPos
+
+        elif scene.sff_tool.camera_type == 'Static':
+            # Change camera focus distance to current in zPosList
+            zLevels = scene.sff_tool.camera_height - zPos
+
+        zCam = zLevels[camIdx]
+
+        # Fit the render borders before clearing anything, so that a failed fit leaves the previous animation intact
+        borders = None
+        if scene.file_tool.use_roi_border:
+            if scene.sff_tool.main_object is None:
+                self.report({'ERROR'}, "No object selected to crop renders to.")
+                return {'CANCELLED'}
+
+            try:
+                borders = GetRenderBorders(scene, camera, zLevels)[camIdx]
+            except ValueError as ex:
+                self.report({'ERROR'}, str(ex))
+                return {'CANCELLED'}
+
+        # Clear previously stored acquisition plan to start anew
+        SetAcquisitionPlan(scene, None)
 
         # Clear previous animations
         scene.animation_data_clear()
@@ -566,106 +934,119 @@ class SetAnimation(Operator):
         # Clear timeline markers
         scene.timeline_markers.clear()
 
-        camCount = 0
-        lightCount = 0
-
+        # Camera data animation (focus distance) isn't cleared with the objects above
+        camera.data.animation_data_clear()
 
-        # Iterate through all permutations of cameras and lights and create keyframes for animation
-        for camIdx in range(0, len(scene.sff_tool.zPosList)):
-        # for camIdx in range(0, len(scene.sff_tool.camera_list)):
+        # Per-level f-stops from the depth of field planner, otherwise every frame uses the camera's aperture
+        fstopLevels = np.asarray(scene.sff_tool.fstopList, dtype=np.float64)
+        usePerLevelFStop = len(fstopLevels) == len(zPos)
+        fstops = fstopLevels[camIdx] if usePerLevelFStop else camera.data.dof.aperture_fstop
 
-            ## TODO: Change to just saving and selecting single camera instead of list
-            camera = scene.objects[scene.sff_tool.camera_list[0]]
-            # camera = scene.objects[scene.sff_tool.camera_list[camIdx]]
+        if scene.file_tool.animation_mode == 'Driver':
+            # Store the acquisition table on the scene and let the frame change handler set up every frame instead of keying it
+            StoreAcquisitionTable(scene, camera, zLevels, lightPositions, fstopLevels if usePerLevelFStop else None)
+            AcquisitionFrameHandler(scene)
 
-            # currentFrame based on SyntheticRTI
-            currentFrame = (camIdx * numLights) + 1
-            # currentFrame = (numCams * numLights) + (camIdx * numLights) + 1
-
-            # aperture_size = ComputeApertureSize(context)
-            # camera.data.dof.aperture_fstop = ComputeApertureSize(context)
+        else:
+            # Drop any stored acquisition table so the frame change handler leaves the keyframes alone
+            if ACQUISITION_TABLE_KEY in scene:
+                del scene[ACQUISITION_TABLE_KEY]
 
-            # Move camera to desired location
             if scene.sff_tool.camera_type == 'Moving':
-                # Move camera to current in zPosList
-                camera.location = (0, 0, (scene.sff_tool.static_focus + scene.sff_tool.zPosList[camIdx]) )
-
-            elif scene.sff_tool.camera_type == 'Static':
-                # Change camera focus distance to current in zPosList
-                camera.data.dof.focus_distance = (scene.sff_tool.camera_height - scene.sff_tool.zPosList[camIdx])
+                WriteKeyframes(camera, "location", frames, np.zeros(numFrames), index=0)
+                WriteKeyframes(camera, "location", frames, np.zeros(numFrames), index=1)
+                WriteKeyframes(camera, "location", frames, zCam, index=2)
 
-            # mark = scene.timeline_markers.new(camera.name, frame=currentFrame)
-            # mark.camera = camera
+                camera.location = (0, 0, zCam[0])
 
-            for lightIdx in range(0, len(scene.rti_tool.light_list)):
+            elif scene.sff_tool.camera_type == 'Static':
+                WriteKeyframes(camera.data, "dof.focus_distance", frames, zCam)
 
-                light = scene.objects[scene.rti_tool.light_list[lightIdx]]
+                camera.data.dof.focus_distance = zCam[0]
 
-                # currentFrame based on SyntheticRTI
-                currentFrame = (camIdx * numLights) + lightIdx + 1
-                # currentFrame = (numCams * numLights) + (camIdx * numLights) + lightIdx + 1
+            if usePerLevelFStop:
+                WriteKeyframes(camera.data, "dof.aperture_fstop", frames, fstops)
 
-                # Adapted from SyntheticRTI. Make sure light is hidden in previous and next frames.
+                camera.data.dof.aperture_fstop = fstops[0]
 
-                ## TEMP: Fix always hidden light in SFF by not hiding lights if only one exists. This might be an issue with how we're iterating across the lights...
-                if len(scene.rti_tool.light_list) > 1:
+            if useLightRig:
+                # Key the rig light through every stored position instead of toggling visibility
+                light = scene.objects[scene.rti_tool.light_list[0]]
 
-                    light.hide_viewport = True
-                    light.hide_render = True
-                    light.hide_set(True)
+                quats = np.array([Vector(pos).to_track_quat('Z','Y')[:] for pos in lightPositions.tolist()], dtype=np.float64)
 
-                    light.keyframe_insert(data_path="hide_render", frame=currentFrame-1)
-                    light.keyframe_insert(data_path="hide_viewport", frame = currentFrame-1)
-                    light.keyframe_insert(data_path="hide_render", frame=currentFrame+1)
-                    light.keyframe_insert(data_path="hide_viewport", frame=currentFrame+1)
+                for axis in range(3):
+                    WriteKeyframes(light, "location", frames, lightPositions[lightIdx, axis], index=axis)
+                for axis in range(4):
+                    WriteKeyframes(light, "rotation_quaternion", frames, quats[lightIdx, axis], index=axis)
 
-                # Make light visible in current frame.
+                light.location = lightPositions[0].tolist()
+                light.rotation_quaternion = quats[0].tolist()
 
-                light.hide_viewport = False
-                light.hide_render = False
-                light.hide_set(False)
+            else:
+                for idx, name in enumerate(scene.rti_tool.light_list):
+                    light = scene.objects[name]
 
-                light.keyframe_insert(data_path="hide_render", frame=currentFrame)
-                light.keyframe_insert(data_path="hide_viewport", frame=currentFrame)
+                    # Frames in which this light is visible
+                    visibleFrames = frames[lightIdx == idx]
 
-                # Insert keyframes to animate camera movement at current frame IF MOVING IS SELECTED
-                if scene.sff_tool.camera_type == 'Moving':
-                    camera.keyframe_insert(data_path="location", frame=currentFrame)
-                    camera.keyframe_insert(data_path="location", frame=currentFrame)
+                    ## TEMP: Fix always hidden light in SFF by not hiding lights if only one exists. This might be an issue with how we're iterating across the lights...
+                    if numLights > 1:
+                        # Adapted from SyntheticRTI. Make sure light is hidden in previous and next frames.
+                        keyFrames = np.concatenate((visibleFrames - 1, visibleFrames + 1, visibleFrames))
+                        keyValues = np.concatenate((np.ones(2 * len(visibleFrames)), np.zeros(len(visibleFrames))))
 
-                # Insert keyframes to animate camera focus length at current frame IF STATIC IS SELECTED
-                if scene.sff_tool.camera_type == 'Static':
-                    camera.data.dof.keyframe_insert(data_path="focus_distance", frame=currentFrame)
+                        # Sort keys by frame, dropping duplicate hidden keys shared between neighbouring frames
+                        keyFrames, unique = np.unique(keyFrames, return_index=True)
+                        keyValues = keyValues[unique]
+                    else:
+                        keyFrames = visibleFrames
+                        keyValues = np.zeros(len(visibleFrames))
 
+                    WriteKeyframes(light, "hide_render", keyFrames, keyValues)
+                    WriteKeyframes(light, "hide_viewport", keyFrames, keyValues)
 
-                outputFrameNumber = str(currentFrame).zfill(len(str(numCams*numLights)))
+                    # Leave light visible only if it's the one seen on the first frame
+                    isHidden = numLights > 1 and idx != 0
+                    light.hide_viewport = isHidden
+                    light.hide_render = isHidden
+                    light.hide_set(isHidden)
 
-                csvNewLine = ""
+        # 'z_cam' column is the camera focus distance for a static camera and the camera location for a moving camera
+        plan = BuildAcquisitionPlan(frames, lightPositions[lightIdx], zCam, fstops, camera.data.lens, borders, GetLightNumbers(scene)[lightIdx])
 
-                # Create line for output CSV
+        # Per-frame logging is only worth its cost when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for row in plan.tolist():
+                _, x_lamp, y_lamp, z_lamp, z = row[:5]
 
-                # If static camera, set 'z_cam' column to be camera focus distance
                 if scene.sff_tool.camera_type == "Static":
-                    csvNewLine = "-{0},{1},{2},{3},{4},{5},{6}".format(outputFrameNumber, light.location[0], light.location[1], light.location[2], camera.data.dof.focus_distance, camera.data.dof.aperture_fstop, camera.data.lens)
-                    print("Keyframe created for static camera focused at (0,0,{0}) and light at ({1}, {2}, {3})".format(camera.data.dof.focus_distance-scene.sff_tool.camera_height, light.location[0], light.location[1], light.location[2]))
-
-                # If moving camera, set 'z_cam' column to be new camera location
+                    logger.debug("Keyframe created for static camera focused at (0,0,{0}) and light at ({1}, {2}, {3})".format(z-scene.sff_tool.camera_height, x_lamp, y_lamp, z_lamp))
                 elif scene.sff_tool.camera_type == "Moving":
-                    csvNewLine = "-{0},{1},{2},{3},{4},{5},{6}".format(outputFrameNumber, light.location[0], light.location[1], light.location[2], camera.location[2], camera.data.dof.aperture_fstop, camera.data.lens)
-                    print("Keyframe created for dynamic camera at (0,0,{0}) and light at ({1}, {2}, {3})".format(camera.location[2], light.location[0], light.location[1], light.location[2]))
+                    logger.debug("Keyframe created for dynamic camera at (0,0,{0}) and light at ({1}, {2}, {3})".format(z, x_lamp, y_lamp, z_lamp))
 
+        logger.info("Animation created for {0} frames".format(len(plan)))
 
-                scene.file_tool.csvOutputLines.append(csvNewLine)
+        SetAcquisitionPlan(scene, plan)
 
+        if scene.file_tool.use_roi_border:
+            scene.render.use_border = True
+            scene.render.use_crop_to_border = True
+            RenderBorderFrameHandler(scene)
+        else:
+            # Don't keep rendering the border fitted by an earlier animation
+            scene.render.use_border = False
+            scene.render.border_min_x, scene.render.border_max_x, scene.render.border_min_y, scene.render.border_max_y = (0, 1, 0, 1)
 
-                lightCount += 1
-
-            camCount += 1
-            lightCount = 0
+        # Set range of frames to render, which PlanRender may have narrowed to stale frames
+        scene.frame_start = int(plan["frame"].min())
+        scene.frame_end = int(plan["frame"].max())
 
-        # Set maximum number of frames to render (-1 for the header)
-        scene.frame_end = len(scene.file_tool.csvOutputLines)-1
+        camera.data.dof.use_dof = not IsSyntheticDefocus(scene)
 
+        if IsSyntheticDefocus(scene):
+            # Only the first focus level is rendered, in focus, and the rest is synthesized from it
+            scene.frame_end = scene.frame_start + numLights - 1
 
         return {'FINISHED'}
 
@@ -674,9 +1055,14 @@ class SetRender(Operator):
     bl_idname = "files.set_render"
     bl_label = "Set render settings"
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
 
+        if IsSyntheticDefocus(scene) and (scene.file_tool.output_profile == "EXR" or scene.file_tool.pass_profile == 'Beauty'):
+            self.report({'ERROR'}, "Synthetic defocus needs the PNG output profile and the depth pass.")
+            return {'CANCELLED'}
+
         # Make sure compositing and nodes are enabled so that we can generate depth and normal images with render passes
         if not scene.render.use_compositing:
             scene.render.use_compositing = True
@@ -697,48 +1083,43 @@ class SetRender(Operator):
             self.report({'ERROR'}, "Output file path not set.")
             return {'CANCELLED'}
 
-        # Get total numbers of frames
-        numLights = len(scene.rti_tool.light_list)
-        numCams = len(scene.sff_tool.camera_list)
-
         # Get number of spaces with which to zero-pad
-        numSpaces = len(str(numCams*numLights))
+        numSpaces = GetFramePadding(scene)
 
         # Set filepath as well as format for iterated filenames
         ## NOTE: If preparing for a background render, use `//` to begin
         ## the filepath relative to the .blend file
+        ## NOTE: Synthetic defocus renders in-focus images to a separate folder
+        ## so that synthesized frames can use the usual file names
+        renderFolder = SYNTHETIC_SOURCE_FOLDER if IsSyntheticDefocus(scene) else "Renders"
         if scene.file_tool.prep_for_background_render == False:
-            scene.render.filepath = "{0}/Renders/Image-{1}".format(outputPath,"#"*numSpaces)
+            scene.render.filepath = "{0}/{1}/Image-{2}".format(outputPath,renderFolder,"#"*numSpaces)
         if scene.file_tool.prep_for_background_render == True:
-            scene.render.filepath = "//Renders/Image-{1}".format(outputPath,"#"*numSpaces)
+            scene.render.filepath = "//{1}/Image-{2}".format(outputPath,renderFolder,"#"*numSpaces)
 
         # Make sure Cycles is set as render engine
         scene.render.engine = 'CYCLES'
 
-        # Image output settings
-        scene.render.image_settings.file_format = "PNG"
-        scene.render.image_settings.color_mode = "RGB"
-        scene.render.image_settings.color_depth = "8"
-
         # Set color management to linear (?)
         scene.display_settings.display_device = 'None'
 
         # Disable overwriting of output images by default
         scene.render.use_overwrite = False
 
+        if scene.file_tool.output_profile == "EXR":
+            SetMultilayerEXROutput(scene)
+            return {'FINISHED'}
+
+        # Image output settings
+        scene.render.image_settings.file_format = "PNG"
+        scene.render.image_settings.color_mode = "RGB"
+        scene.render.image_settings.color_depth = "8"
+
         # Set render passes
-        current_render_layer = scene.view_layers['ViewLayer']
-        # current_render_layer = scene.view_layers.active
-        current_render_layer.use_pass_combined = True
-        current_render_layer.use_pass_z = True
-        current_render_layer.use_pass_normal = True
-        current_render_layer.use_pass_shadow = True
-        current_render_layer.use_pass_diffuse_direct = True
-        current_render_layer.use_pass_diffuse_indirect = True
-        current_render_layer.use_pass_diffuse_color = True
-        current_render_layer.use_pass_glossy_direct = True
-        current_render_layer.use_pass_glossy_indirect = True
-        current_render_layer.use_pass_glossy_color = True
+        ApplyPassProfile(scene)
+
+        if scene.file_tool.pass_profile == 'Beauty':
+            return {'FINISHED'}
 
         # Create nodes for Render Layers, map range, normalization, and output files
         ## NOTE: Positioning of nodes isn't considered as it's not important for background processes.
@@ -747,7 +1128,7 @@ class SetRender(Operator):
         output_node_z = scene.node_tree.nodes.new(type="CompositorNodeOutputFile")
         output_node_normal = scene.node_tree.nodes.new(type="CompositorNodeOutputFile")
 
-        if scene.sff_tool.focus_limits_type != "Auto":
+        if scene.sff_tool.focus_limits_type in ("Manual", "Tasked"):
             # Set map range node settings
             map_range_node = scene.node_tree.nodes.new(type="CompositorNodeMapRange")
             map_range_node.use_clamp = True
@@ -759,7 +1140,7 @@ class SetRender(Operator):
             scene.node_tree.links.new(render_layers_node.outputs['Depth'], map_range_node.inputs['Value'])
             scene.node_tree.links.new(map_range_node.outputs['Value'], output_node_z.inputs['Image'])
 
-        elif scene.sff_tool.focus_limits_type == "Auto":
+        else:
             normalize_node = scene.node_tree.nodes.new(type="CompositorNodeNormalize")
 
             # Link nodes together
@@ -780,66 +1161,409 @@ class SetRender(Operator):
             output_node_z.base_path = "//Depth/"
             output_node_normal.base_path = "//Normal/"
 
+        if IsSyntheticDefocus(scene):
+            # Write metric depth as float EXR for synthesizing defocus
+            output_node_depth_raw = scene.node_tree.nodes.new(type="CompositorNodeOutputFile")
+            output_node_depth_raw.format.file_format = "OPEN_EXR"
+            output_node_depth_raw.format.color_depth = "32"
+            output_node_depth_raw.base_path = output_node_z.base_path.replace("Depth/", SYNTHETIC_SOURCE_FOLDER + "/DepthRaw/")
+            scene.node_tree.links.new(render_layers_node.outputs['Depth'], output_node_depth_raw.inputs['Image'])
+            output_node_depth_raw[SHARED_PASS_KEY] = True
+
+            # Write the render in linear light as float EXR too, as defocus is synthesized from linear pixels
+            output_node_image_raw = scene.node_tree.nodes.new(type="CompositorNodeOutputFile")
+            output_node_image_raw.format.file_format = "OPEN_EXR"
+            output_node_image_raw.format.color_depth = "32"
+            output_node_image_raw.base_path = output_node_z.base_path.replace("Depth/", SYNTHETIC_SOURCE_FOLDER + "/ImageRaw/")
+            scene.node_tree.links.new(render_layers_node.outputs['Image'], output_node_image_raw.inputs['Image'])
+
+        # Depth and normal outputs are only written by the first frame of each camera position
+        output_node_z[SHARED_PASS_KEY] = True
+        output_node_normal[SHARED_PASS_KEY] = True
+
         return {'FINISHED'}
 
 
-class CreateCSV(Operator):
-    bl_idname = "files.create_csv"
-    # bl_label = "Create CSV file"
-    bl_label = "Create CSV and text files"
+class SynthesizeFocusStack(Operator):
+    bl_idname = "files.synthesize_focus_stack"
+    bl_label = "Synthesize focus stack"
 
     @classmethod
     def poll(cls, context):
-        return len(context.scene.file_tool.csvOutputLines) != 0
+        plan = GetAcquisitionPlan(context.scene)
+        return IsSyntheticDefocus(context.scene) and plan is not None and len(plan) != 0
 
+    @TimeOperator
     def execute(self, context):
         scene = context.scene
+        sfftool = scene.sff_tool
 
-        outputPath = scene.file_tool.output_path
+        plan = GetAcquisitionPlan(scene)
+        numLights = GetNumLights(scene)
+        cameraData = scene.objects[sfftool.camera_list[0]].data
 
-        # Error handling
-        if outputPath == "":
-            self.report({'ERROR'}, "Output file path not set.")
-            return {'CANCELLED'}
+        pixelPitch = GetPixelPitch(scene, cameraData)
+        manifestPath = os.path.join(GetOutputFolder(scene), RENDER_MANIFEST_NAME)
 
-        # Create file
-        filePath = bpy.path.abspath(outputPath + "/Image" + ".csv")
-        file = open(filePath, 'w')
+        # Depth and normals don't change with focus for a static camera, so every frame shares the first frame's
+        sharedPasses = {key: path for key, path in GetOutputFilePaths(scene, int(plan["frame"][0])).items() if key != "image" and key not in SYNTHETIC_SOURCE_KEYS}
 
-        # Write header
-        file.write(scene.file_tool.csvOutputLines[0])
-        file.write('\n')
+        for lightIdx in range(numLights):
+            sourceFrame = int(plan["frame"][lightIdx])
+            sourcePaths = GetOutputFilePaths(scene, sourceFrame)
 
-        # Iterate through the remaining lines, writing desired filename and respective line
-        for line in scene.file_tool.csvOutputLines[1:]:
-            file.write("Image" + line)
-            file.write('\n')
-        file.close()
+            if any(not os.path.isfile(sourcePaths.get(key, "")) for key in SYNTHETIC_SOURCE_KEYS):
+                self.report({'ERROR'}, "Linear in-focus render or depth of frame {0} is missing, set the render settings again.".format(sourceFrame))
+                return {'CANCELLED'}
 
-        # Get selected object reference
-        obj = context.scene.sff_tool.main_object # Selected object for SFF
+            image = LoadImagePixels(sourcePaths["ImageRaw"])
+            depth = LoadImagePixels(sourcePaths["DepthRaw"])[..., 0]
 
-        # Write out scene settings into CSV file for computer readability
-        filePath = bpy.path.abspath(outputPath + "/Scene Settings" + ".csv")
-        file = open(filePath, 'w')
-        file.write("distance,aperture,object_name,location_x,location_y,location_z,rotation_x,rotation_y,rotation_z,scale_x,scale_y,scale_z\n")
-        file.write(str(context.scene.sff_tool.camera_height))
-        file.write(",")
-        file.write(str(context.scene.sff_tool.aperture_size))
-        file.write(",")
-        file.write(obj.name)
-        file.write(",")
-        file.write(str(obj.location[0]))
-        file.write(",")
-        file.write(str(obj.location[1]))
-        file.write(",")
-        file.write(str(obj.location[2]))
-        file.write(",")
-        file.write(str(obj.rotation_euler[0]))
-        file.write(",")
-        file.write(str(obj.rotation_euler[1]))
-        file.write(",")
-        file.write(str(obj.rotation_euler[2]))
+            rows = plan[lightIdx::numLights]
+            stack = SynthesizeDefocus(image, depth, rows["z_cam"], rows["aperture_fstop"], rows["lens"], pixelPitch, sfftool.synthetic_blur_levels)
+
+            # Focus levels are synthesized one at a time, so each is written before the next is computed
+            for row, synthesized in zip(rows, stack):
+                frame = int(row["frame"])
+                paths = GetSyntheticFilePaths(scene, frame)
+
+                SaveImagePixels(synthesized, paths["image"], scene)
+
+                for key, path in sharedPasses.items():
+                    if path != paths[key] and os.path.isfile(path):
+                        LinkOrCopy(path, paths[key])
+
+                if scene.file_tool.write_render_manifest:
+                    AppendManifestRecord(manifestPath, BuildManifestRecord(scene, frame, None, paths))
+
+        self.report({'INFO'}, "Synthesized {0} frames from {1} in-focus renders.".format(len(plan), numLights))
+
+        return {'FINISHED'}
+
+
+class CompareSyntheticDefocus(Operator):
+    bl_idname = "files.compare_synthetic_defocus"
+    bl_label = "Compare synthetic defocus with depth of field renders"
+
+    @classmethod
+    def poll(cls, context):
+        plan = GetAcquisitionPlan(context.scene)
+        return IsSyntheticDefocus(context.scene) and plan is not None and len(plan) != 0
+
+    @TimeOperator
+    def execute(self, context):
+        scene = context.scene
+        sfftool = scene.sff_tool
+
+        plan = GetAcquisitionPlan(scene)
+        camera = scene.objects[sfftool.camera_list[0]]
+        outputFolder = GetOutputFolder(scene)
+
+        # Compare frames spread evenly over the plan, which includes the nearest and farthest focus levels
+        indices = np.unique(np.linspace(0, len(plan) - 1, num=min(sfftool.comparison_frames, len(plan))).round().astype(int))
+
+        previousFrame = scene.frame_current
+
+        results = []
+        try:
+            camera.data.dof.use_dof = True
+
+            for idx in indices.tolist():
+                frame = int(plan["frame"][idx])
+                synthesizedPath = GetSyntheticFilePaths(scene, frame)["image"]
+                if not os.path.isfile(synthesizedPath):
+                    continue
+
+                scene.frame_set(frame)
+                reference = RenderStill(scene, os.path.join(outputFolder, "Comparison", os.path.basename(synthesizedPath)))
+                synthesized = LoadImagePixels(synthesizedPath)
+
+                error = synthesized[..., :3] - reference[..., :3]
+                rmse = ImageRMSE(synthesized, reference)
+                psnr = float("inf") if rmse == 0 else float(20 * np.log10(1.0 / rmse))
+                results.append((frame, float(plan["z_cam"][idx]), rmse, float(np.abs(error).max()), psnr))
+        finally:
+            camera.data.dof.use_dof = False
+            scene.frame_set(previousFrame)
+
+        if not results:
+            self.report({'ERROR'}, "No synthesized frames found to compare.")
+            return {'CANCELLED'}
+
+        with open(os.path.join(outputFolder, "Synthetic Defocus Comparison.csv"), 'w', newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("frame", "z_cam", "rmse", "max_abs_error", "psnr"))
+            writer.writerows(results)
+
+        meanRMSE = np.mean([result[2] for result in results])
+        self.report({'INFO'}, "Mean RMSE over {0} frames: {1:.5f}".format(len(results), meanRMSE))
+
+        return {'FINISHED'}
+
+
+class TuneSamples(Operator):
+    bl_idname = "files.tune_samples"
+    bl_label = "Tune render samples"
+
+    @classmethod
+    def poll(cls, context):
+        plan = GetAcquisitionPlan(context.scene)
+        return plan is not None and len(plan) != 0
+
+    @TimeOperator
+    def execute(self, context):
+        scene = context.scene
+        filetool = scene.file_tool
+
+        if not hasattr(scene, "cycles"):
+            self.report({'ERROR'}, "Cycles isn't available.")
+            return {'CANCELLED'}
+
+        plan = GetAcquisitionPlan(scene)
+        cycles = scene.cycles
+        tuningFolder = os.path.join(GetOutputFolder(scene), "Tuning")
+
+        frames = PilotFrames(plan)
+        sampleCounts = [count for count in SAMPLE_LADDER if count < filetool.reference_samples]
+        thresholds = sorted(ADAPTIVE_THRESHOLDS, reverse=True)
+
+        previous = (cycles.samples, cycles.use_adaptive_sampling, cycles.adaptive_threshold, cycles.seed, scene.frame_current)
+
+        chosen = None
+        try:
+            # A fixed seed makes pilot renders comparable between settings
+            cycles.seed = 0
+
+            references = {}
+            cycles.samples = filetool.reference_samples
+            cycles.use_adaptive_sampling = False
+            for frame in frames:
+                scene.frame_set(frame)
+                references[frame] = RenderStill(scene, os.path.join(tuningFolder, "Reference-{0}.exr".format(frame)), 'OPEN_EXR')
+
+            cycles.use_adaptive_sampling = True
+
+            # Walk settings from cheapest to most expensive and stop at the first one meeting the target on every pilot frame
+            for samples in sampleCounts:
+                for threshold in thresholds:
+                    cycles.samples = samples
+                    cycles.adaptive_threshold = threshold
+
+                    worst = 0.0
+                    for frame in frames:
+                        scene.frame_set(frame)
+                        pilot = RenderStill(scene, os.path.join(tuningFolder, "Pilot-{0}.exr".format(frame)), 'OPEN_EXR')
+                        worst = max(worst, ImageRMSE(pilot, references[frame]))
+                        if worst > filetool.noise_target:
+                            break
+
+                    logger.info("Pilot renders with {0} samples and adaptive threshold {1}: worst RMSE {2:.5f}".format(samples, threshold, worst))
+
+                    if worst <= filetool.noise_target:
+                        chosen = (samples, threshold, worst)
+                        break
+
+                if chosen is not None:
+                    break
+        finally:
+            cycles.samples, cycles.use_adaptive_sampling, cycles.adaptive_threshold, cycles.seed, frame = previous
+            scene.frame_set(frame)
+
+        if chosen is None:
+            self.report({'WARNING'}, "No sample count below {0} meets the noise target, keeping current settings.".format(filetool.reference_samples))
+            return {'CANCELLED'}
+
+        cycles.samples, cycles.adaptive_threshold, worst = chosen
+        cycles.use_adaptive_sampling = True
+
+        self.report({'INFO'}, "Using {0} samples with adaptive threshold {1} (worst RMSE {2:.5f}).".format(chosen[0], chosen[1], worst))
+
+        return {'FINISHED'}
+
+
+class PlanRender(Operator):
+    bl_idname = "files.plan_render"
+    bl_label = "Plan render of new and changed frames"
+
+    @classmethod
+    def poll(cls, context):
+        plan = GetAcquisitionPlan(context.scene)
+        return plan is not None and len(plan) != 0
+
+    @TimeOperator
+    def execute(self, context):
+        scene = context.scene
+
+        if scene.file_tool.output_path == "" and not scene.file_tool.prep_for_background_render:
+            self.report({'ERROR'}, "Output file path not set.")
+            return {'CANCELLED'}
+
+        plan = GetAcquisitionPlan(scene)
+        frameHashes = HashFrameInputs(plan, HashSceneInputs(scene))
+
+        indexPath = os.path.join(GetOutputFolder(scene), RENDER_INDEX_NAME)
+        index = ReadRenderIndex(indexPath)
+        manifestPath = GetManifestPath(scene)
+
+        os.makedirs(os.path.dirname(indexPath), exist_ok=True)
+
+        useCache = scene.file_tool.use_frame_cache and scene.file_tool.frame_cache_path != ""
+        cacheDir = bpy.path.abspath(scene.file_tool.frame_cache_path)
+
+        # Keep the frame hashes with the scene so the render_write handler can fill in the cache
+        scene[FRAME_HASHES_KEY] = {"frames": plan["frame"].tolist(), "hashes": frameHashes}
+        IndexFrameHashes(scene)
+
+        # A frame is stale when its inputs changed since it was planned or one of its outputs is missing
+        staleFrames = []
+        numCached = 0
+        for frame, frameHash in zip(plan["frame"].tolist(), frameHashes):
+            # Shared passes belong to the frame that writes them, which is re-rendered if they're missing
+            paths = GetOutputFilePaths(scene, frame, ownOnly=True)
+
+            if index.get(frame) == frameHash and all(os.path.isfile(path) for path in paths.values()):
+                continue
+
+            staleFrames.append(frame)
+            index[frame] = frameHash
+
+            # Remove outdated outputs so that rendering without overwriting picks the frame up again
+            for path in paths.values():
+                if os.path.isfile(path):
+                    os.remove(path)
+
+            AppendManifestRecord(manifestPath, {"frame": frame, "invalidated": True})
+
+            # Frames rendered before with identical inputs are taken from the cache instead
+            if useCache and CacheRestore(cacheDir, frameHash, paths):
+                record = BuildManifestRecord(scene, frame, 0.0)
+                record["cached_from"] = frameHash
+                AppendManifestRecord(manifestPath, record)
+                staleFrames.pop()
+                numCached += 1
+
+        WriteRenderIndex(indexPath, index)
+
+        scene.render.use_overwrite = False
+
+        if staleFrames:
+            # Only render the span of frames that need it, everything else in it is skipped
+            scene.frame_start = min(staleFrames)
+            scene.frame_end = max(staleFrames)
+
+        if useCache:
+            CacheEvict(cacheDir, scene.file_tool.frame_cache_size * 1e9)
+
+        self.report({'INFO'}, "{0} of {1} frames need rendering, {2} restored from the frame cache.".format(len(staleFrames), len(plan), numCached))
+
+        return {'FINISHED'}
+
+
+class ResumeRender(Operator):
+    bl_idname = "files.resume_render"
+    bl_label = "Resume render from manifest"
+
+    @TimeOperator
+    def execute(self, context):
+        scene = context.scene
+
+        if scene.file_tool.output_path == "" and not scene.file_tool.prep_for_background_render:
+            self.report({'ERROR'}, "Output file path not set.")
+            return {'CANCELLED'}
+
+        # Only in-focus frames are rendered for synthetic defocus, the rest of the frames are synthesized
+        records = ReadRenderManifest(GetManifestPath(scene), IsSyntheticDefocus(scene))
+
+        # Existing outputs are skipped when rendering without overwriting, so remove any
+        # outputs of frames that aren't recorded as complete, e.g. partially written files
+        numRemoved = 0
+        numComplete = 0
+        for frame in range(scene.frame_start, scene.frame_end + 1):
+            record = records.get(frame)
+            if record is not None and IsFrameComplete(scene, record):
+                numComplete += 1
+                continue
+
+            # Shared passes of other frames are only removed with the frame that writes them
+            for path in GetOutputFilePaths(scene, frame, ownOnly=True).values():
+                if os.path.isfile(path):
+                    os.remove(path)
+                    numRemoved += 1
+
+        scene.render.use_overwrite = False
+
+        self.report({'INFO'}, "{0} frames complete, removed {1} incomplete output files.".format(numComplete, numRemoved))
+
+        return {'FINISHED'}
+
+
+class WriteTimings(Operator):
+    bl_idname = "files.export_timings"
+    bl_label = "Export timings"
+
+    @TimeOperator
+    def execute(self, context):
+        scene = context.scene
+
+        if scene.file_tool.output_path == "" and not scene.file_tool.prep_for_background_render:
+            self.report({'ERROR'}, "Output file path not set.")
+            return {'CANCELLED'}
+
+        self.report({'INFO'}, "Timings written to {0}".format(ExportTimings(scene)))
+
+        return {'FINISHED'}
+
+
+class CreateCSV(Operator):
+    bl_idname = "files.create_csv"
+    # bl_label = "Create CSV file"
+    bl_label = "Create CSV and text files"
+
+    @classmethod
+    def poll(cls, context):
+        plan = GetAcquisitionPlan(context.scene)
+        return plan is not None and len(plan) != 0
+
+    @TimeOperator
+    def execute(self, context):
+        scene = context.scene
+
+        outputPath = scene.file_tool.output_path
+
+        # Error handling
+        if outputPath == "":
+            self.report({'ERROR'}, "Output file path not set.")
+            return {'CANCELLED'}
+
+        # Write image table as CSV for readability and as .npy for fast loading by downstream tools
+        plan = GetAcquisitionPlan(scene)
+        WritePlanCSV(bpy.path.abspath(outputPath + "/Image" + ".csv"), plan, GetFramePadding(scene))
+        np.save(bpy.path.abspath(outputPath + "/Image" + ".npy"), plan)
+
+        # Get selected object reference
+        obj = context.scene.sff_tool.main_object # Selected object for SFF
+
+        # Write out scene settings into CSV file for computer readability
+        filePath = bpy.path.abspath(outputPath + "/Scene Settings" + ".csv")
+        file = open(filePath, 'w')
+        file.write("distance,aperture,object_name,location_x,location_y,location_z,rotation_x,rotation_y,rotation_z,scale_x,scale_y,scale_z\n")
+        file.write(str(context.scene.sff_tool.camera_height))
+        file.write(",")
+        file.write(str(context.scene.sff_tool.aperture_size))
+        file.write(",")
+        file.write(obj.name)
+        file.write(",")
+        file.write(str(obj.location[0]))
+        file.write(",")
+        file.write(str(obj.location[1]))
+        file.write(",")
+        file.write(str(obj.location[2]))
+        file.write(",")
+        file.write(str(obj.rotation_euler[0]))
+        file.write(",")
+        file.write(str(obj.rotation_euler[1]))
+        file.write(",")
+        file.write(str(obj.rotation_euler[2]))
         file.write(",")
         file.write(str(obj.scale[0]))
         file.write(",")
@@ -847,192 +1571,2434 @@ class CreateCSV(Operator):
         file.write(",")
         file.write(str(obj.scale[2]))
 
-        file.close()
+        file.close()
+
+        # Write out camera distance and aperture size from sff_tool into
+        # space-delimited text file for human readability
+        filePath = bpy.path.abspath(outputPath + "/Scene Settings" + ".txt")
+        file = open(filePath, 'w')
+        file.write("---Camera Settings---")
+        file.write("\ndistance ")
+        file.write(str(context.scene.sff_tool.camera_height))
+        file.write("\naperture ")
+        file.write(str(context.scene.sff_tool.aperture_size))
+        file.write("\n\n---Object Info---")
+        file.write("\nname ")
+        file.write(obj.name)
+        file.write("\nlocation ")
+        file.write(str(obj.location))
+        file.write("\nrotation ")
+        file.write(str(obj.rotation_euler))
+        file.write("\nscale ")
+        file.write(str(obj.scale))
+
+        file.close()
+
+        return {'FINISHED'}
+
+
+### Helper functions
+
+# Column layout of the acquisition plan shared by all operators, one row per frame
+ACQUISITION_PLAN_DTYPE = np.dtype([
+    ("frame", np.int32),
+    ("x_lamp", np.float64),
+    ("y_lamp", np.float64),
+    ("z_lamp", np.float64),
+    ("z_cam", np.float64),
+    ("aperture_fstop", np.float64),
+    ("lens", np.float64),
+    ("border_min_x", np.float64),
+    ("border_max_x", np.float64),
+    ("border_min_y", np.float64),
+    ("border_max_y", np.float64),
+    ("light", np.int32),
+])
+
+# Plan values of columns missing from plans stored by older versions
+ACQUISITION_PLAN_DEFAULTS = {"border_max_x": 1.0, "border_max_y": 1.0}
+
+def BuildAcquisitionPlan(frames, lightPositions, zCam, aperture_fstop, lens, borders=None, lightNumbers=None):
+    """
+    Builds a structured acquisition plan from per-frame arrays of frame
+    numbers, (N, 3) light positions, and camera Z values, optionally with
+    (N, 4) render borders that default to the full frame and the .lp entry
+    number of every frame's light, which is 0 for lights not from an .lp file
+    """
+
+    plan = np.zeros(len(frames), dtype=ACQUISITION_PLAN_DTYPE)
+
+    if borders is None:
+        borders = np.array([[0.0, 1.0, 0.0, 1.0]])
+
+    plan["frame"] = frames
+    plan["x_lamp"] = lightPositions[:, 0]
+    plan["y_lamp"] = lightPositions[:, 1]
+    plan["z_lamp"] = lightPositions[:, 2]
+    plan["z_cam"] = zCam
+    plan["aperture_fstop"] = aperture_fstop
+    plan["lens"] = lens
+
+    for axis, name in enumerate(BORDER_COLUMNS):
+        plan[name] = borders[:, axis]
+
+    if lightNumbers is not None:
+        plan["light"] = lightNumbers
+
+    return plan
+
+
+# Scene ID property holding a copy of the acquisition plan that's saved with the .blend file
+ACQUISITION_PLAN_KEY = "sffrti_plan"
+
+# Structured arrays of ACQUISITION_PLAN_DTYPE, one row per frame, keyed on scene pointer.
+# Set through SetAcquisitionPlan and cleared whenever a file is loaded.
+_acquisitionPlans = {}
+
+def SetAcquisitionPlan(scene, plan):
+    """
+    Stores the acquisition plan shared by all operators, keeping a copy on the
+    scene so that handlers can still find it in background renders
+    """
+
+    if plan is None:
+        _acquisitionPlans.pop(scene.as_pointer(), None)
+    else:
+        _acquisitionPlans[scene.as_pointer()] = plan
+
+    if plan is None:
+        if ACQUISITION_PLAN_KEY in scene:
+            del scene[ACQUISITION_PLAN_KEY]
+    else:
+        scene[ACQUISITION_PLAN_KEY] = {name: plan[name].tolist() for name in ACQUISITION_PLAN_DTYPE.names}
+
+
+def GetAcquisitionPlan(scene):
+    """
+    Returns the stored acquisition plan, or None if SetAnimation hasn't been run
+    """
+
+    plan = _acquisitionPlans.get(scene.as_pointer())
+
+    if plan is None and ACQUISITION_PLAN_KEY in scene:
+        # Rebuild the plan from the copy saved with the .blend file
+        stored = scene[ACQUISITION_PLAN_KEY]
+        plan = np.zeros(len(stored["frame"]), dtype=ACQUISITION_PLAN_DTYPE)
+        for name in ACQUISITION_PLAN_DTYPE.names:
+            plan[name] = np.asarray(stored[name]) if name in stored else ACQUISITION_PLAN_DEFAULTS.get(name, 0)
+        _acquisitionPlans[scene.as_pointer()] = plan
+
+    return plan
+
+
+def GetPlanIndex(plan, frame):
+    """
+    Returns the index of a frame's row in the acquisition plan, or None if
+    the frame isn't part of the plan
+    """
+
+    if plan is None or len(plan) == 0:
+        return None
+
+    # Frames are normally consecutive from 1, fall back to a search otherwise
+    idx = frame - int(plan["frame"][0])
+    if not 0 <= idx < len(plan) or plan["frame"][idx] != frame:
+        idx = int(np.searchsorted(plan["frame"], frame))
+        if idx >= len(plan) or plan["frame"][idx] != frame:
+            return None
+
+    return idx
+
+
+def GetPlanRow(plan, frame):
+    """
+    Returns the acquisition plan row for a frame, or None if the frame isn't
+    part of the plan
+    """
+
+    idx = GetPlanIndex(plan, frame)
+
+    return None if idx is None else plan[idx]
+
+
+def GetFramePadding(scene):
+    """
+    Returns the number of digits frame numbers are zero-padded to in output
+    file names
+    """
+
+    return len(str(len(scene.sff_tool.camera_list) * GetNumLights(scene)))
+
+
+def PlanImageNames(plan, numSpaces, prefix="Image"):
+    """
+    Returns an array of output image names, without extension, for every
+    frame in the acquisition plan
+    """
+
+    frames = np.char.zfill(plan["frame"].astype(str), numSpaces)
+
+    return np.char.add(prefix + "-", frames)
+
+
+def WritePlanCSV(filepath, plan, numSpaces, prefix="Image"):
+    """
+    Writes the acquisition plan to a CSV file with one row per output image
+    """
+
+    columns = [PlanImageNames(plan, numSpaces, prefix).astype(object)]
+    columns += [plan[name].astype(object) for name in ACQUISITION_PLAN_DTYPE.names[1:]]
+
+    # NOTE: Formatting Python floats with %s keeps full precision without trailing zero padding
+    np.savetxt(filepath, np.column_stack(columns), fmt="%s", delimiter=",",
+               header="image," + ",".join(ACQUISITION_PLAN_DTYPE.names[1:]), comments="")
+
+
+# Scene ID property holding the acquisition table read by AcquisitionFrameHandler
+ACQUISITION_TABLE_KEY = "sffrti_acquisition"
+
+# Name of the light made visible by the last call to AcquisitionFrameHandler
+_driverActiveLight = None
+
+def StoreAcquisitionTable(scene, camera, zLevels, lightPositions, fstopLevels=None):
+    """
+    Stores everything AcquisitionFrameHandler needs to set up a frame as an ID
+    property on the scene so that it's saved with the .blend file, optionally
+    with an f-stop for every focus level
+    """
+
+    global _driverActiveLight
+    _driverActiveLight = None
+
+    rtitool = scene.rti_tool
+
+    scene[ACQUISITION_TABLE_KEY] = {
+        "camera": camera.name,
+        "camera_type": scene.sff_tool.camera_type,
+        "z_cam": np.asarray(zLevels, dtype=np.float64).tolist(),
+        "rig": int(IsLightRig(scene)),
+        "lights": list(rtitool.light_list),
+        "light_positions": np.asarray(lightPositions, dtype=np.float64).ravel().tolist(),
+        "aperture_fstop": [] if fstopLevels is None else np.asarray(fstopLevels, dtype=np.float64).tolist(),
+    }
+
+
+@persistent
+def AcquisitionFrameHandler(scene, depsgraph=None):
+    """
+    frame_change_pre handler that sets the active light, camera location, and
+    focus distance for the current frame from the stored acquisition table
+    """
+
+    global _driverActiveLight
+
+    table = scene.get(ACQUISITION_TABLE_KEY)
+    if table is None or scene.file_tool.animation_mode != 'Driver':
+        return
+
+    zCam = table["z_cam"]
+    lightNames = table["lights"]
+    lightPositions = table["light_positions"]
+    numLights = len(lightPositions) // 3
+
+    if numLights < 1 or len(zCam) < 1:
+        return
+
+    # Frames iterate over all lights for each Z position, clamped to the acquisition
+    frameIdx = min(max(scene.frame_current - 1, 0), numLights * len(zCam) - 1)
+    camIdx, lightIdx = divmod(frameIdx, numLights)
+
+    camera = scene.objects.get(table["camera"])
+    if camera is not None:
+        if table["camera_type"] == 'Moving':
+            camera.location = (0, 0, zCam[camIdx])
+        elif table["camera_type"] == 'Static':
+            camera.data.dof.focus_distance = zCam[camIdx]
+
+        fstops = table.get("aperture_fstop", [])
+        if len(fstops) == len(zCam):
+            camera.data.dof.aperture_fstop = fstops[camIdx]
+
+    if table["rig"]:
+        light = scene.objects.get(lightNames[0])
+        if light is not None:
+            position = Vector(lightPositions[3*lightIdx:3*lightIdx + 3])
+            light.location = position
+            light.rotation_quaternion = position.to_track_quat('Z','Y')
+        return
+
+    # Only a single light exists (SFF-only), so it always stays visible
+    if len(lightNames) < 2:
+        return
+
+    activeName = lightNames[lightIdx]
+    if activeName == _driverActiveLight:
+        return
+
+    # Hide every light on the first call, afterwards only the previously active one
+    if _driverActiveLight is None:
+        toHide = lightNames
+    else:
+        toHide = [_driverActiveLight]
+
+    for name in toHide:
+        light = scene.objects.get(name)
+        if light is not None:
+            light.hide_render = True
+            light.hide_viewport = True
+
+    light = scene.objects.get(activeName)
+    if light is not None:
+        light.hide_render = False
+        light.hide_viewport = False
+
+    _driverActiveLight = activeName
+
+
+@persistent
+def AcquisitionLoadHandler(*args):
+    """
+    load_post handler forgetting the light made active, the acquisition
+    plans, and the frame hashes of the previously loaded file, so they're
+    rebuilt from the new one
+    """
+
+    global _driverActiveLight
+    _driverActiveLight = None
+    _acquisitionPlans.clear()
+    _frameHashes.clear()
+    _hashFrames.clear()
+
+
+def WriteKeyframes(id_data, data_path, frames, values, index=0):
+    """
+    Writes a full F-curve in one pass, replacing any existing F-curve for the
+    same data path and index. All keyframes use constant interpolation.
+    """
+
+    frames = np.asarray(frames, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32)
+
+    if id_data.animation_data is None:
+        id_data.animation_data_create()
+
+    if id_data.animation_data.action is None:
+        id_data.animation_data.action = bpy.data.actions.new(name="{0}Action".format(id_data.name))
+
+    fcurves = id_data.animation_data.action.fcurves
+
+    fcurve = fcurves.find(data_path, index=index)
+    if fcurve is not None:
+        fcurves.remove(fcurve)
+
+    fcurve = fcurves.new(data_path, index=index)
+
+    if len(frames) == 0:
+        return fcurve
+
+    fcurve.keyframe_points.add(len(frames))
+
+    co = np.empty(2 * len(frames), dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = values
+    fcurve.keyframe_points.foreach_set("co", co)
+
+    # NOTE: 0 is the enum value for 'CONSTANT' interpolation
+    fcurve.keyframe_points.foreach_set("interpolation", np.zeros(len(frames), dtype=np.int32))
+
+    fcurve.update()
+
+    return fcurve
+
+
+def DefineFocusLimits(context, fstops=None):
+    """
+    Function to compute list of Z-axis positions for SFF camera. If a list is
+    given for fstops, it's filled with a per-level f-stop when the depth of
+    field planner picks one for every level.
+    """
+
+    scene = context.scene
+    sfftool = scene.sff_tool
+
+    f = []
+    if sfftool.focus_limits_type == "DoF":
+        minZ, maxZ = GetWorldZBounds(sfftool.main_object)
+
+        levels, levelFStops = PlanFocusLevelsForScene(scene, minZ, maxZ)
+        f = levels.tolist()
+
+        if fstops is not None and sfftool.per_level_fstop:
+            fstops.extend(levelFStops.tolist())
+
+    elif sfftool.focus_limits_type == "Auto":
+        # Get min and max world-space vertex Z positions of the selected object's hierarchy and use to create f
+        minZ, maxZ = GetWorldZBounds(sfftool.main_object)
+
+        f = np.linspace(start=minZ, stop=maxZ, num=sfftool.num_z_pos, endpoint=True)
+
+    elif sfftool.focus_limits_type == "Density":
+        minZ, maxZ = GetWorldZBounds(sfftool.main_object)
+
+        if sfftool.num_z_pos < 2 or maxZ <= minZ:
+            f = np.linspace(start=minZ, stop=maxZ, num=sfftool.num_z_pos, endpoint=True)
+        else:
+            # Keep the spacing Auto would use, so that every surface ends up as close to a level as with uniform levels
+            spacing = (maxZ - minZ) / (sfftool.num_z_pos - 1)
+
+            edges, counts = GetWorldZHistogram(sfftool.main_object, minZ, maxZ, DENSITY_BINS_PER_LEVEL * (sfftool.num_z_pos - 1))
+            f = PlaceDensityFocusLevels(edges, counts, spacing, sfftool.density_threshold)
+
+            logger.info("Placed {0} of {1} focus levels at occupied heights".format(len(f), sfftool.num_z_pos))
+
+    elif sfftool.focus_limits_type == "Tasked":
+
+        # Check to make sure that CSV exists
+        if not os.path.isfile(sfftool.tasked_file_path):
+            self.report({"ERROR"})
+
+        # Read in .csv data
+        filename = open(sfftool.tasked_file_path, 'r')
+        depthData = csv.DictReader(filename)
+
+        ## NOTE: Subtracting camera height from distances
+
+        # Iterate through CSV file and get desired depth levels
+        for col in depthData:
+            # f.append(sfftool.camera_height - float(col["Depth"]))
+            f.append(float(col["Depth"]))
+
+        # Sort stored depth levels
+        f = sorted(f)
+
+    elif sfftool.focus_limits_type == "Manual":
+        f = np.linspace(start=sfftool.min_z_pos, stop=sfftool.max_z_pos, num=sfftool.num_z_pos, endpoint=True)
+
+    return f
+
+
+def GetWorldZBounds(obj):
+    """
+    Returns the lowest and highest world-space vertex Z positions across an
+    object and all of its descendants
+    """
+
+    minZ = math.inf
+    maxZ = -math.inf
+
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        stack.extend(current.children)
+
+        if current.type != 'MESH' or len(current.data.vertices) == 0:
+            continue
+
+        meshMinZ, meshMaxZ = GetMeshWorldZBounds(current)
+
+        minZ = min(minZ, meshMinZ)
+        maxZ = max(maxZ, meshMaxZ)
+
+    if minZ > maxZ:
+        raise ValueError("'{0}' has no mesh vertices to compute focus limits from".format(obj.name))
+
+    return minZ, maxZ
+
+
+# Cached (minZ, maxZ) per mesh, keyed on mesh data and world matrix
+_zBoundsCache = {}
+_Z_BOUNDS_CACHE_SIZE = 256
+
+def GetMeshWorldZBounds(obj):
+    """
+    Returns the lowest and highest world-space vertex Z positions of a single
+    mesh object, reading its vertices in bulk
+
+    NOTE: Results are cached on the mesh datablock, its vertex count, and the
+    object's world matrix, so edits that only move vertices in place aren't
+    detected until the object is moved or the cache is cleared.
+    """
+
+    mesh = obj.data
+    mw = obj.matrix_world
+    numVerts = len(mesh.vertices)
+
+    key = (mesh.as_pointer(), numVerts, tuple(tuple(row) for row in mw))
+    bounds = _zBoundsCache.get(key)
+    if bounds is not None:
+        return bounds
+
+    worldZ = GetMeshWorldZ(obj)
+
+    bounds = (float(worldZ.min()), float(worldZ.max()))
+
+    if len(_zBoundsCache) >= _Z_BOUNDS_CACHE_SIZE:
+        _zBoundsCache.clear()
+    _zBoundsCache[key] = bounds
+
+    return bounds
+
+
+def GetMeshWorldZ(obj):
+    """
+    Returns the world-space Z position of every vertex of a single mesh
+    object, reading its vertices in bulk
+    """
+
+    mesh = obj.data
+
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+
+    # Only the world Z row of the matrix is needed
+    zRow = np.array(obj.matrix_world, dtype=np.float64)[2]
+
+    return co.reshape(-1, 3) @ zRow[:3] + zRow[3]
+
+
+# Number of height histogram bins per Auto level spacing used by the surface density mode
+DENSITY_BINS_PER_LEVEL = 8
+
+def GetWorldZHistogram(obj, minZ, maxZ, numBins):
+    """
+    Returns the bin edges and vertex counts of a histogram of world-space
+    vertex Z positions from minZ to maxZ across an object and all of its
+    descendants
+    """
+
+    edges = np.linspace(minZ, maxZ, numBins + 1)
+    counts = np.zeros(numBins, dtype=np.int64)
+
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        stack.extend(current.children)
+
+        if current.type != 'MESH' or len(current.data.vertices) == 0:
+            continue
+
+        # Binning by index is much faster than np.histogram's search over the edges
+        binIdx = ((GetMeshWorldZ(current) - minZ) * (numBins / (maxZ - minZ))).astype(np.int64)
+        counts += np.bincount(np.clip(binIdx, 0, numBins - 1), minlength=numBins)
+
+    return edges, counts
+
+
+def PlaceDensityFocusLevels(edges, counts, spacing, threshold=0.0):
+    """
+    Places focus levels over the occupied bins of a height histogram so that
+    every occupied height is within half a spacing of a level. Empty height
+    ranges get no levels, and within every run of occupied bins the levels are
+    pulled toward the densest heights as far as that coverage allows.
+
+    NOTE: Density is measured in vertices, so densely tessellated surfaces
+    weigh more than their area alone would.
+    """
+
+    counts = np.asarray(counts, dtype=np.float64)
+
+    # Bins holding less than threshold times the mean count are empty, so the densest bin is always occupied
+    occupied = (counts >= threshold * counts.mean()) & (counts > 0)
+
+    occupiedIdx = np.flatnonzero(occupied)
+    if len(occupiedIdx) == 0:
+        raise ValueError("No vertices were found to place focus levels at")
+
+    counts = counts * occupied
+
+    # Split occupied bins into runs wherever there's an empty gap
+    breaks = np.flatnonzero(np.diff(occupiedIdx) > 1)
+    starts = np.concatenate(([occupiedIdx[0]], occupiedIdx[breaks + 1])).tolist()
+    ends = np.concatenate((occupiedIdx[breaks], [occupiedIdx[-1]])).tolist()
+
+    def NumLevels(start, end):
+        return max(int(math.ceil((edges[end + 1] - edges[start]) / spacing - 1e-9)), 1)
+
+    # Join neighbouring runs when covering them together, gap included, takes no more levels
+    runs = []
+    for start, end in zip(starts, ends):
+        if runs and NumLevels(runs[-1][0], end) <= NumLevels(*runs[-1]) + NumLevels(start, end):
+            runs[-1] = (runs[-1][0], end)
+        else:
+            runs.append((start, end))
+
+    levels = []
+    for start, end in runs:
+        runMin, runMax = edges[start], edges[end + 1]
+        numLevels = NumLevels(start, end)
+
+        # Density-weighted heights from the inverse cumulative vertex count of the run
+        cumulative = np.concatenate(([0], np.cumsum(counts[start:end + 1])))
+        weighted = np.interp((np.arange(numLevels) + 0.5) / numLevels * cumulative[-1], cumulative, edges[start:end + 2])
+
+        # Move every level as little as needed to keep each height of the run within half a spacing of a level
+        previous = runMin - spacing / 2
+        for idx, z in enumerate(weighted.tolist()):
+            lower = runMax - spacing / 2 - (numLevels - 1 - idx) * spacing
+            upper = min(runMin + spacing / 2 + idx * spacing, previous + spacing)
+
+            previous = min(max(z, lower), upper)
+            levels.append(float(previous))
+
+    return levels
+
+
+def GetCircleOfConfusion(scene, sensorWidth):
+    """
+    Returns the circle of confusion in millimeters, defaulting to the sensor
+    diagonal / 1500 with the sensor height following the render's aspect
+    """
+
+    if scene.sff_tool.circle_of_confusion > 0:
+        return scene.sff_tool.circle_of_confusion
+
+    sensorHeight = sensorWidth * scene.render.resolution_y / scene.render.resolution_x
+
+    # https://en.wikipedia.org/wiki/Circle_of_confusion#Circle_of_confusion_diameter_limit_based_on_d.2F1500
+    return math.sqrt(sensorWidth**2 + sensorHeight**2) / 1500
+
+
+def PlanFocusDistances(near, far, lens, coc, overlap, fstop=None, numLevels=None):
+    """
+    Plans focus distances whose depths of field cover the distances from near
+    to far in front of a camera, with each level sharing the given fraction
+    of its depth of field with the next. With a fixed fstop, the fewest
+    levels that cover the range are returned. Otherwise numLevels levels are
+    spread over the range, each with the f-stop that gives it just enough
+    depth of field. Lengths are in meters. Returns the focus distances,
+    nearest first, and the f-stop of every level.
+
+    With u = 1/s and k = N*c/f, the thin lens depth of field limits are
+    1/near = u + k*(1/f - u) and 1/far = u - k*(1/f - u), so all levels can be
+    computed in closed form in reciprocal distance.
+    """
+
+    if not 0 < lens < near <= far:
+        raise ValueError("The object must be farther from the camera than the focal length")
+
+    uNear, uFar = 1 / near, 1 / far
+
+    if numLevels is None:
+        k = fstop * coc / lens
+        if k >= 1:
+            raise ValueError("The circle of confusion is too large for f/{0}".format(fstop))
+
+        # First level's near limit sits at the near end of the range
+        u0 = (uNear - k / lens) / (1 - k)
+
+        # Chaining the overlap condition gives u_i - 1/f = r^i (u_0 - 1/f)
+        r = (1 + k - 2 * overlap * k) / (1 - k)
+
+        # The last level is the first one whose far limit reaches the far end of the range
+        uStop = (uFar + k / lens) / (1 + k)
+        ratio = (1 / lens - uStop) / (1 / lens - u0)
+        numLevels = 1 if ratio <= 1 else int(math.ceil(math.log(ratio) / math.log(r) - 1e-9)) + 1
+
+        u = 1 / lens + r ** np.arange(numLevels) * (u0 - 1 / lens)
+
+        # Levels past the hyperfocal distance already reach infinity
+        u = np.maximum(u, k / (lens * (1 + k)))
+
+        return 1 / u, np.full(numLevels, fstop)
+
+    # Split the range into equal, overlapping depths of field in reciprocal distance
+    width = (uNear - uFar) / (numLevels - (numLevels - 1) * overlap)
+    upper = uNear - np.arange(numLevels) * width * (1 - overlap)
+
+    u = upper - width / 2
+    k = width / (2 * (1 / lens - u))
+
+    return 1 / u, k * lens / coc
+
+
+def PlanFocusPlanes(minZ, maxZ, focusDistance, lens, coc, overlap, fstop=None, numLevels=None):
+    """
+    Plans the heights of the focus plane for a camera that moves with a fixed
+    focus distance, covering heights from minZ to maxZ. Arguments and return
+    values are as for PlanFocusDistances, with focus plane heights returned
+    from the top down.
+    """
+
+    if not 0 < lens < focusDistance:
+        raise ValueError("The focus distance must be larger than the focal length")
+
+    u = 1 / focusDistance
+    g = 1 / lens - u
+
+    if numLevels is None:
+        k = fstop * coc / lens
+        near, far = 1 / (u + k * g), (1 / (u - k * g) if u > k * g else math.inf)
+        width = far - near
+
+        numLevels = 1 if width >= maxZ - minZ else int(math.ceil((maxZ - minZ - width) / (width * (1 - overlap)) - 1e-9)) + 1
+    else:
+        width = (maxZ - minZ) / (numLevels - (numLevels - 1) * overlap)
+
+        # Solve far - near = width for k, with near = 1/(u + k*g) and far = 1/(u - k*g)
+        k = (math.sqrt(1 + width**2 * u**2) - 1) / (width * g)
+        near = 1 / (u + k * g)
+        fstop = k * lens / coc
+
+    # Every level's near limit, the top of its depth of field, steps down from maxZ
+    step = width * (1 - overlap) if math.isfinite(width) else 0
+    planes = maxZ - (focusDistance - near) - np.arange(numLevels) * step
+
+    return planes, np.full(numLevels, fstop)
+
+
+def PlanFocusLevelsForScene(scene, minZ, maxZ):
+    """
+    Plans focus levels covering heights from minZ to maxZ with the SFF
+    settings' camera, lens, and depth of field overlap. Returns the focus
+    plane heights in ascending order and the f-stop of every level.
+    """
+
+    sfftool = scene.sff_tool
+
+    # Blender lengths are in meters, lens and sensor settings in millimeters
+    lens = sfftool.lens / 1000
+    coc = GetCircleOfConfusion(scene, sfftool.sensor_width) / 1000
+
+    fstop = None if sfftool.per_level_fstop else sfftool.aperture_size
+    numLevels = max(sfftool.num_z_pos, 1) if sfftool.per_level_fstop else None
+
+    if fstop is not None and fstop <= 0:
+        raise ValueError("Set an aperture size to plan focus levels with")
+
+    if sfftool.camera_type == 'Static':
+        distances, fstops = PlanFocusDistances(sfftool.camera_height - maxZ, sfftool.camera_height - minZ, lens, coc,
+                                               sfftool.dof_overlap, fstop, numLevels)
+        planes = sfftool.camera_height - distances
+    else:
+        planes, fstops = PlanFocusPlanes(minZ, maxZ, sfftool.static_focus, lens, coc, sfftool.dof_overlap, fstop, numLevels)
+
+    order = np.argsort(planes)
+
+    return planes[order], fstops[order]
+
+
+# Plan columns holding every frame's render border, in the order of GetRenderBorders
+BORDER_COLUMNS = ("border_min_x", "border_max_x", "border_min_y", "border_max_y")
+
+def GetWorldBoundsCorners(obj):
+    """
+    Returns the world-space bounding box corners of every mesh in an object's
+    hierarchy as an (N, 3) array
+    """
+
+    corners = []
+
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        stack.extend(current.children)
+
+        if current.type != 'MESH' or len(current.data.vertices) == 0:
+            continue
+
+        mw = np.array(current.matrix_world, dtype=np.float64)
+        box = np.array([tuple(corner) for corner in current.bound_box], dtype=np.float64)
+        corners.append(box @ mw[:3, :3].T + mw[:3, 3])
+
+    if not corners:
+        raise ValueError("'{0}' has no mesh vertices to fit a render border to".format(obj.name))
+
+    return np.concatenate(corners)
+
+
+def ProjectToCameraFrame(scene, camera, points, matrix=None):
+    """
+    Returns the frame coordinates of world-space points seen by a camera,
+    from 0 to 1 with the origin at the bottom left like render borders,
+    optionally placing the camera with another world matrix. Points behind a
+    perspective camera are NaN.
+    """
+
+    if matrix is None:
+        matrix = camera.matrix_world
+
+    worldToCamera = np.linalg.inv(np.array(matrix, dtype=np.float64))
+    local = points @ worldToCamera[:3, :3].T + worldToCamera[:3, 3]
+
+    # Frame corners in camera space, including sensor fit and lens shift
+    frame = np.array([tuple(corner) for corner in camera.data.view_frame(scene=scene)], dtype=np.float64)
+
+    xy = local[:, :2]
+    if camera.data.type != 'ORTHO':
+        # Scale every point onto the plane of the frame corners, cameras look down their local -Z axis
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xy = xy * (frame[0, 2] / local[:, 2:3])
+        xy[local[:, 2] >= 0] = np.nan
+
+    frameMin = frame[:, :2].min(axis=0)
+    frameMax = frame[:, :2].max(axis=0)
+
+    return (xy - frameMin) / (frameMax - frameMin)
+
+
+def GetRenderBorders(scene, camera, zLevels):
+    """
+    Returns a (min x, max x, min y, max y) render border for every focus level
+    that fits the main object's bounds as seen from the level's camera state,
+    grown by the ROI margin. Levels that see part of the object behind the
+    camera get the full frame.
+    """
+
+    filetool = scene.file_tool
+    render = scene.render
+
+    corners = GetWorldBoundsCorners(scene.sff_tool.main_object)
+
+    size = np.array([render.resolution_x, render.resolution_y], dtype=np.float64) * render.resolution_percentage / 100
+    margin = filetool.roi_margin / size
+
+    # Only a moving camera changes what it sees between focus levels
+    if scene.sff_tool.camera_type == 'Moving':
+        # Focus levels are locations relative to the camera's parent, like the keyframes written for them
+        parentMatrix = np.identity(4)
+        if camera.parent is not None:
+            parentMatrix = np.array(camera.parent.matrix_world, dtype=np.float64) @ np.array(camera.matrix_parent_inverse, dtype=np.float64)
+
+        basis = np.array(camera.matrix_basis, dtype=np.float64)
+        states = []
+        for z in np.asarray(zLevels).tolist():
+            basis[:3, 3] = (0, 0, z)
+            states.append(parentMatrix @ basis)
+    else:
+        states = [np.array(camera.matrix_world, dtype=np.float64)]
+
+    borders = np.tile([0.0, 1.0, 0.0, 1.0], (len(states), 1))
+
+    for idx, state in enumerate(states):
+        xy = ProjectToCameraFrame(scene, camera, corners, state)
+        if np.isnan(xy).any():
+            continue
+
+        low = np.clip(xy.min(axis=0) - margin, 0, 1)
+        high = np.clip(xy.max(axis=0) + margin, 0, 1)
+        if (high <= low).any():
+            continue
+
+        # Snap outwards to whole pixels, a quarter pixel in so that truncating and rounding to pixels agree
+        low = (np.floor(low * size) + 0.25) / size
+        high = np.minimum((np.ceil(high * size) + 0.25) / size, 1)
+
+        borders[idx] = (low[0], high[0], low[1], high[1])
+
+    if filetool.roi_scope == 'Acquisition':
+        borders = np.array([[borders[:, 0].min(), borders[:, 1].max(), borders[:, 2].min(), borders[:, 3].max()]])
+
+    if len(borders) < len(zLevels):
+        borders = np.repeat(borders, len(zLevels), axis=0)
+
+    return borders
+
+
+def GetRenderBorderPixels(scene, row):
+    """
+    Returns the pixel rectangle a plan row's render border crops the full
+    canvas to, with x and y measured from the canvas' top left like image
+    arrays
+    """
+
+    render = scene.render
+    width = int(render.resolution_x * render.resolution_percentage / 100)
+    height = int(render.resolution_y * render.resolution_percentage / 100)
+
+    # Blender truncates borders to whole pixels from the bottom left
+    xMin, xMax = int(row["border_min_x"] * width), int(row["border_max_x"] * width)
+    yMin, yMax = int(row["border_min_y"] * height), int(row["border_max_y"] * height)
+
+    return {"x": xMin, "y": height - yMax, "width": xMax - xMin, "height": yMax - yMin,
+            "canvas_width": width, "canvas_height": height}
+
+
+@persistent
+def RenderBorderFrameHandler(scene, depsgraph=None):
+    """
+    frame_change_pre handler that sets the render border of the current frame
+    from the acquisition plan
+    """
+
+    if not scene.file_tool.use_roi_border:
+        return
+
+    row = GetPlanRow(GetAcquisitionPlan(scene), scene.frame_current)
+    if row is None:
+        return
+
+    # Only touch properties that change, as every change tags the scene for an update
+    render = scene.render
+    for name in BORDER_COLUMNS:
+        value = float(row[name])
+        if getattr(render, name) != value:
+            setattr(render, name, value)
+
+
+def GetDepthRange(scene):
+    """
+    Returns the nearest and farthest distances of the main object from the
+    camera over all frames of the acquisition
+    """
+
+    sfftool = scene.sff_tool
+    minZ, maxZ = GetWorldZBounds(sfftool.main_object)
+
+    if sfftool.camera_type == 'Moving':
+        zCam = GetAcquisitionPlan(scene)["z_cam"]
+        return float(zCam.min()) - maxZ, float(zCam.max()) - minZ
+
+    return sfftool.camera_height - maxZ, sfftool.camera_height - minZ
+
+
+def RedirectOutputPaths(scene, fromFolder, toFolder):
+    """
+    Moves the render output and every compositor file output under fromFolder
+    to the same relative path under toFolder
+    """
+
+    def Redirect(path):
+        relPath = os.path.relpath(bpy.path.abspath(path), fromFolder)
+        if relPath.startswith(os.pardir):
+            raise ValueError("'{0}' isn't inside the output folder '{1}'".format(path, fromFolder))
+
+        # Keep the trailing separator of file output base paths
+        return os.path.join(toFolder, relPath) + (os.sep if path.endswith(("/", "\\")) else "")
+
+    scene.render.filepath = Redirect(scene.render.filepath)
+
+    if not scene.use_nodes or scene.node_tree is None:
+        return
+
+    for node in scene.node_tree.nodes:
+        if node.type == 'OUTPUT_FILE':
+            node.base_path = Redirect(node.base_path)
+
+
+def SetOutputFolder(scene, outputFolder):
+    """
+    Points a prepared scene at another output folder, e.g. when a .blend file
+    is rendered somewhere other than where it was set up, so that outputs,
+    manifests, and indices are all resolved against outputFolder
+    """
+
+    outputFolder = os.path.abspath(outputFolder)
+    RedirectOutputPaths(scene, GetOutputFolder(scene), outputFolder)
+
+    scene.file_tool.prep_for_background_render = False
+    scene.file_tool.output_path = outputFolder
+
+
+def PrepareTileRender(scene, tileFolder, border):
+    """
+    Sets up a background Blender process to render one (min x, max x, min y,
+    max y) border of every frame for tools/render_tiles.py. Every output under
+    the output folder is redirected to the same relative path under
+    tileFolder, so that tiles can be stitched back into the output folder.
+    """
+
+    filetool = scene.file_tool
+    render = scene.render
+    outputFolder = GetOutputFolder(scene)
+
+    if GetAcquisitionPlan(scene) is None:
+        raise ValueError("Set the animation before rendering tiles")
+
+    # Tiles cover the full canvas, and only stitched frames are worth caching
+    filetool.use_roi_border = False
+    filetool.use_frame_cache = False
+
+    render.use_border = True
+    render.use_crop_to_border = True
+    render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y = border
+
+    # Tile folders start out empty and are only written by this process
+    render.use_overwrite = True
+    render.use_placeholder = False
+
+    RedirectOutputPaths(scene, outputFolder, tileFolder)
+
+    if not scene.use_nodes or scene.node_tree is None:
+        return
+
+    nodes = scene.node_tree.nodes
+    links = scene.node_tree.links
+
+    for node in list(nodes):
+        if node.type == 'NORMALIZE':
+            ## NOTE: Normalizing each tile on its own range would leave seams, so map the object's depth range instead
+            if scene.sff_tool.main_object is None:
+                raise ValueError("Normalized depth can only be rendered in tiles with an object selected")
+
+            near, far = GetDepthRange(scene)
+
+            map_range_node = nodes.new(type="CompositorNodeMapRange")
+            map_range_node.use_clamp = True
+            map_range_node.inputs[1].default_value = near
+            map_range_node.inputs[2].default_value = far
+
+            for link in list(node.inputs[0].links):
+                links.new(link.from_socket, map_range_node.inputs['Value'])
+            for link in list(node.outputs[0].links):
+                links.new(map_range_node.outputs['Value'], link.to_socket)
+
+            nodes.remove(node)
+
+
+# Name of the manifest that render_write appends a record to for every finished frame
+RENDER_MANIFEST_NAME = "Render Manifest.jsonl"
+
+# File extensions written for each image format
+IMAGE_EXTENSIONS = {
+    'PNG': ".png",
+    'JPEG': ".jpg",
+    'BMP': ".bmp",
+    'TIFF': ".tif",
+    'OPEN_EXR': ".exr",
+    'OPEN_EXR_MULTILAYER': ".exr",
+}
+
+# Name of the sidecar index holding the input hash every frame was last planned with
+RENDER_INDEX_NAME = "Render Index.json"
+
+# Node settings that only change how a node is drawn or where its outputs are written
+NODE_HASH_SKIPPED = frozenset(("name", "label", "location", "width", "width_hidden", "height", "dimensions",
+                               "select", "hide", "show_options", "show_preview", "show_texture",
+                               "use_custom_color", "color", "parent", "mute", "base_path", "active_input_index"))
+
+# RNA property types of node settings that are hashed
+NODE_HASH_TYPES = ('BOOLEAN', 'INT', 'FLOAT', 'STRING', 'ENUM', 'POINTER')
+
+def HashableValue(value):
+    """
+    Returns a value whose repr only depends on an RNA value's contents, using
+    the name of datablocks and tuples for arrays
+    """
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if hasattr(value, "name"):
+        return value.name
+
+    try:
+        return tuple(HashableValue(item) for item in value)
+    except TypeError:
+        # Structs without a name, e.g. curve mappings
+        return type(value).__name__
+
+
+def HashNodeTree(add, tree, groups=None):
+    """
+    Adds the settings, unlinked input values, and links of every node in a
+    node tree to a digest, along with every node group the tree uses
+    """
+
+    if groups is None:
+        groups = set()
+
+    for node in sorted(tree.nodes, key=lambda node: node.name):
+        # Shared pass outputs are muted on frames that don't write them, which doesn't change their inputs
+        mute = node.mute and not node.get(SHARED_PASS_KEY, False)
+
+        settings = tuple((prop.identifier, HashableValue(getattr(node, prop.identifier, None)))
+                         for prop in node.bl_rna.properties
+                         if prop.type in NODE_HASH_TYPES and not prop.is_readonly and prop.identifier not in NODE_HASH_SKIPPED)
+
+        add(node.bl_idname, node.name, mute, settings,
+            tuple(HashableValue(getattr(socket, "default_value", None)) for socket in node.inputs))
+
+        if node.type == 'OUTPUT_FILE':
+            # Only hash which outputs are written, not where, so that caches are shared between output folders
+            add(os.path.basename(os.path.normpath(node.base_path)), node.format.file_format, node.format.color_depth,
+                tuple(slot.path for slot in node.file_slots))
+
+        image = getattr(node, "image", None)
+        if image is not None:
+            add(image.name, image.filepath)
+
+        group = getattr(node, "node_tree", None)
+        if group is not None and group.name not in groups:
+            groups.add(group.name)
+            HashNodeTree(add, group, groups)
+
+    add(tuple(sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+                     for link in tree.links if not link.is_muted)))
+
+
+def HashSceneInputs(scene):
+    """
+    Returns a digest of every scene input shared by all frames: render
+    settings, the compositor, world, and material node trees, camera and
+    light data, and the transform and mesh of every other object. Output
+    paths aren't included, so identical scenes share cached frames.
+    """
+
+    digest = hashlib.sha256()
+
+    def add(*values):
+        digest.update(repr(values).encode("utf-8"))
+
+    render = scene.render
+
+    # Fitted render borders change from frame to frame and are hashed with the plan instead
+    border = () if scene.file_tool.use_roi_border else (render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y)
+
+    add(render.engine, render.resolution_x, render.resolution_y, render.resolution_percentage,
+        render.pixel_aspect_x, render.pixel_aspect_y, render.film_transparent,
+        render.use_border, render.use_crop_to_border, border,
+        render.image_settings.file_format, render.image_settings.color_mode, render.image_settings.color_depth,
+        render.image_settings.exr_codec, render.use_compositing)
+    add(scene.display_settings.display_device, scene.view_settings.view_transform,
+        scene.view_settings.look, scene.view_settings.exposure, scene.view_settings.gamma)
+
+    if hasattr(scene, "cycles"):
+        add(scene.cycles.samples, scene.cycles.use_adaptive_sampling, scene.cycles.adaptive_threshold,
+            scene.cycles.max_bounces, scene.cycles.seed)
+
+    if scene.use_nodes and scene.node_tree is not None:
+        HashNodeTree(add, scene.node_tree)
+
+    viewLayer = scene.view_layers[0]
+    add(scene.file_tool.pass_profile, SharesInvariantPasses(scene),
+        tuple(getattr(viewLayer, name) for name in dir(viewLayer) if name.startswith("use_pass_")))
+
+    world = scene.world
+    if world is not None:
+        add(world.name, world.use_nodes, tuple(world.color))
+        if world.use_nodes and world.node_tree is not None:
+            HashNodeTree(add, world.node_tree)
+
+    if scene.sff_tool.camera_list:
+        camera = scene.objects[scene.sff_tool.camera_list[0]]
+        cameraData = camera.data
+        add(cameraData.type, cameraData.sensor_fit, cameraData.sensor_width, cameraData.sensor_height,
+            cameraData.shift_x, cameraData.shift_y, cameraData.dof.use_dof, cameraData.dof.aperture_blades)
+
+        # A moving camera's location is set per frame and hashed with the plan, so only hash its parent's transform
+        if scene.sff_tool.camera_type == 'Moving' and camera.parent is not None:
+            add(scene.sff_tool.camera_type, tuple(tuple(row) for row in camera.parent.matrix_world))
+        else:
+            add(scene.sff_tool.camera_type, scene.sff_tool.camera_height, tuple(tuple(row) for row in camera.matrix_world))
+
+    # Positions and visibility of the acquisition's lights change per frame and are hashed with the plan
+    lightNames = list(scene.rti_tool.light_list)
+    for name in lightNames:
+        if name in scene.objects:
+            lightData = scene.objects[name].data
+            add(lightData.type, lightData.energy, tuple(lightData.color), getattr(lightData, "angle", None))
+
+    acquisitionObjects = set(lightNames) | set(scene.sff_tool.camera_list)
+    materials = {}
+    meshes = set()
+
+    for obj in sorted(scene.objects, key=lambda obj: obj.name):
+        if obj.name in acquisitionObjects:
+            continue
+
+        slots = [slot.material for slot in obj.material_slots]
+        materials.update((material.name, material) for material in slots if material is not None)
+
+        add(obj.name, obj.type, obj.hide_render, tuple(tuple(row) for row in obj.matrix_world),
+            tuple(HashableValue(material) for material in slots),
+            tuple((modifier.type, modifier.show_render) for modifier in obj.modifiers))
+
+        if obj.type == 'MESH' and obj.data.name not in meshes:
+            # Objects can share a mesh, which only needs hashing once
+            meshes.add(obj.data.name)
+            co = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+            obj.data.vertices.foreach_get("co", co)
+            add(obj.data.name)
+            digest.update(co.tobytes())
+
+        elif obj.type == 'LIGHT':
+            add(obj.data.type, obj.data.energy, tuple(obj.data.color), getattr(obj.data, "angle", None))
+
+    for name in sorted(materials):
+        material = materials[name]
+        add(name, material.use_nodes, tuple(material.diffuse_color))
+        if material.use_nodes and material.node_tree is not None:
+            HashNodeTree(add, material.node_tree)
+
+    return digest.digest()
+
+
+def HashFrameInputs(plan, sceneDigest):
+    """
+    Returns a hex digest for every frame of the acquisition plan, combining
+    the frame's own row of the plan with the shared scene digest
+    """
+
+    # Hash everything but the frame number itself so that reordered plans reuse frames with identical inputs
+    rows = np.column_stack([plan[name].astype(np.float64) for name in ACQUISITION_PLAN_DTYPE.names[1:]])
+
+    return [hashlib.sha256(sceneDigest + row.tobytes()).hexdigest() for row in rows]
+
+
+def ReadRenderIndex(filepath):
+    """
+    Returns the frame to input hash mapping stored in a render index
+    """
+
+    if not os.path.isfile(filepath):
+        return {}
+
+    with open(filepath, 'r', encoding="utf-8") as file:
+        return {int(frame): value for frame, value in json.load(file).items()}
+
+
+def WriteRenderIndex(filepath, index):
+    """
+    Atomically replaces a render index with the given frame to hash mapping
+    """
+
+    tmpPath = filepath + ".tmp"
+    with open(tmpPath, 'w', encoding="utf-8") as file:
+        json.dump({str(frame): index[frame] for frame in sorted(index)}, file, indent=0)
+
+    os.replace(tmpPath, filepath)
+
+
+# Cycles status messages that show scene synchronization is done and path tracing has started
+RENDERING_STATS = ("Sample", "Path Tracing", "Rendering")
+
+# Phases timed for every rendered frame
+FRAME_PHASES = ("sync", "render", "composite", "save", "total")
+
+def GetTimingsPath(scene, extension):
+    """
+    Returns the path timings are exported to, next to the render manifest
+    """
+
+    return os.path.splitext(GetManifestPath(scene))[0] + " Timings" + extension
+
+
+def SummarizeTimings():
+    """
+    Returns mean per-frame phase times, frame count, and total bytes written
+    for frames rendered this session
+    """
+
+    summary = {"frames": len(_frameTimings), "bytes": sum(timing["bytes"] for timing in _frameTimings.values())}
+
+    for phase in FRAME_PHASES:
+        values = [timing[phase] for timing in _frameTimings.values()]
+        summary[phase] = float(np.mean(values)) if values else 0.0
+
+    return summary
+
+def ExportTimings(scene):
+    """
+    Writes operator and frame timings as JSON, and frame timings as CSV,
+    next to the render manifest
+    """
+
+    jsonPath = GetTimingsPath(scene, ".json")
+    os.makedirs(os.path.dirname(jsonPath), exist_ok=True)
+
+    frames = [dict(frame=frame, **_frameTimings[frame]) for frame in sorted(_frameTimings)]
+
+    with open(jsonPath, 'w', encoding="utf-8") as file:
+        json.dump({"operators": _operatorTimings, "frames": frames, "summary": SummarizeTimings()}, file, indent=1)
+
+    with open(GetTimingsPath(scene, ".csv"), 'w', newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=("frame",) + FRAME_PHASES + ("bytes",))
+        writer.writeheader()
+        writer.writerows(frames)
+
+    return jsonPath
+
+
+@persistent
+def TimingRenderInitHandler(scene, depsgraph=None):
+    """
+    render_init handler that starts a new set of frame timings
+    """
+
+    if _renderingStill:
+        return
+
+    _frameTimings.clear()
+
+
+@persistent
+def TimingRenderPreHandler(scene, depsgraph=None):
+    """
+    render_pre handler that marks the start of a frame
+    """
+
+    if _renderingStill:
+        return
+
+    _frameMarks.clear()
+    _frameMarks["pre"] = time.perf_counter()
+
+
+@persistent
+def TimingRenderStatsHandler(stats, *args):
+    """
+    render_stats handler that marks the end of scene synchronization once
+    Cycles starts reporting samples
+    """
+
+    if _renderingStill:
+        return
+
+    if "pre" in _frameMarks and "synced" not in _frameMarks and any(word in str(stats) for word in RENDERING_STATS):
+        _frameMarks["synced"] = time.perf_counter()
+
+
+@persistent
+def TimingCompositePreHandler(scene, depsgraph=None):
+    if _renderingStill:
+        return
+
+    _frameMarks["composite_pre"] = time.perf_counter()
+
+
+@persistent
+def TimingCompositePostHandler(scene, depsgraph=None):
+    if _renderingStill:
+        return
+
+    _frameMarks["composite_post"] = time.perf_counter()
+
+
+@persistent
+def TimingRenderPostHandler(scene, depsgraph=None):
+    if _renderingStill:
+        return
+
+    _frameMarks["post"] = time.perf_counter()
+
+
+@persistent
+def TimingRenderWriteHandler(scene, depsgraph=None):
+    """
+    render_write handler that stores the phase timings of the frame that was
+    just written along with the size of its outputs
+    """
+
+    if _renderingStill:
+        return
+
+    if "pre" not in _frameMarks:
+        return
+
+    now = time.perf_counter()
+    pre = _frameMarks["pre"]
+    post = _frameMarks.get("post", now)
+    synced = _frameMarks.get("synced", pre)
+    compositePre = _frameMarks.get("composite_pre", post)
+    compositePost = _frameMarks.get("composite_post", compositePre)
+
+    # Shared passes are listed for every frame but only written by one
+    paths = GetOutputFilePaths(scene, scene.frame_current, ownOnly=True)
+
+    _frameTimings[scene.frame_current] = {
+        "sync": synced - pre,
+        "render": compositePre - synced,
+        "composite": compositePost - compositePre,
+        # Compositor file outputs are written while compositing, the render result once it's done
+        "save": now - compositePost,
+        "total": now - pre,
+        "bytes": sum(os.path.getsize(path) for path in paths.values() if os.path.isfile(path)),
+    }
+
+
+@persistent
+def TimingRenderCompleteHandler(scene, depsgraph=None):
+    """
+    render_complete and render_cancel handler that exports the timings
+    """
+
+    if _renderingStill:
+        return
+
+    if _frameTimings and (scene.file_tool.output_path != "" or scene.file_tool.prep_for_background_render):
+        logger.info("Timings written to {0}".format(ExportTimings(scene)))
+
+
+@persistent
+def LogLevelLoadHandler(*args):
+    """
+    load_post handler applying the loaded scene's log level
+    """
+
+    if bpy.context.scene is not None:
+        logger.setLevel(bpy.context.scene.file_tool.log_level)
+
+
+# Handlers registered by the add-on, by handler list
+HANDLERS = (
+    ("frame_change_pre", "AcquisitionFrameHandler"),
+    ("frame_change_pre", "SharedPassFrameHandler"),
+    ("frame_change_pre", "RenderBorderFrameHandler"),
+    ("render_init", "TimingRenderInitHandler"),
+    ("render_init", "FrameCacheRenderInitHandler"),
+    ("render_pre", "TimingRenderPreHandler"),
+    ("render_pre", "ManifestRenderPreHandler"),
+    ("render_stats", "TimingRenderStatsHandler"),
+    ("composite_pre", "TimingCompositePreHandler"),
+    ("composite_post", "TimingCompositePostHandler"),
+    ("render_post", "TimingRenderPostHandler"),
+    ("render_write", "TimingRenderWriteHandler"),
+    ("render_write", "ManifestRenderWriteHandler"),
+    ("render_write", "FrameCacheRenderWriteHandler"),
+    ("render_complete", "TimingRenderCompleteHandler"),
+    ("render_cancel", "TimingRenderCompleteHandler"),
+    ("load_post", "LogLevelLoadHandler"),
+    ("load_post", "AcquisitionLoadHandler"),
+)
+
+
+# Start time of the frame currently being rendered
+_renderStartTime = None
+
+def GetManifestPath(scene):
+    """
+    Returns the absolute path of the render manifest for the scene's output
+    folder. The SFFRTI_MANIFEST_PATH environment variable overrides it, which
+    lets sharded renders each append to their own manifest.
+    """
+
+    if os.environ.get("SFFRTI_MANIFEST_PATH"):
+        return os.environ["SFFRTI_MANIFEST_PATH"]
+
+    return os.path.join(GetOutputFolder(scene), RENDER_MANIFEST_NAME)
+
+
+def GetOutputFolder(scene):
+    """
+    Returns the absolute path of the folder that manifests and indices are
+    written to, which is next to the .blend file when preparing for a
+    background render
+    """
+
+    if scene.file_tool.prep_for_background_render:
+        return bpy.path.abspath("//")
+
+    return bpy.path.abspath(scene.file_tool.output_path)
+
+
+# View layer passes enabled for each pass profile
+PASS_PROFILES = {
+    'Beauty': ("use_pass_combined",),
+    'Geometry': ("use_pass_combined", "use_pass_z", "use_pass_normal"),
+    'Full': ("use_pass_combined", "use_pass_z", "use_pass_normal", "use_pass_shadow",
+             "use_pass_diffuse_direct", "use_pass_diffuse_indirect", "use_pass_diffuse_color",
+             "use_pass_glossy_direct", "use_pass_glossy_indirect", "use_pass_glossy_color"),
+}
+
+# Names of the passes' layers in multilayer EXR files
+PASS_LAYER_NAMES = {
+    "use_pass_combined": "Combined", "use_pass_z": "Depth", "use_pass_normal": "Normal", "use_pass_shadow": "Shadow",
+    "use_pass_diffuse_direct": "DiffDir", "use_pass_diffuse_indirect": "DiffInd", "use_pass_diffuse_color": "DiffCol",
+    "use_pass_glossy_direct": "GlossDir", "use_pass_glossy_indirect": "GlossInd", "use_pass_glossy_color": "GlossCol",
+}
+
+# Custom property marking compositor file outputs of light-invariant passes
+SHARED_PASS_KEY = "sffrti_shared_pass"
+
+def ApplyPassProfile(scene):
+    """
+    Enables the view layer passes of the selected pass profile and disables
+    every other pass
+    """
+
+    enabled = PASS_PROFILES[scene.file_tool.pass_profile]
+
+    viewLayer = scene.view_layers['ViewLayer']
+    for name in dir(viewLayer):
+        if name.startswith("use_pass_") and isinstance(getattr(viewLayer, name), bool):
+            setattr(viewLayer, name, name in enabled)
+
+
+# Acquisition plan and shared pass frames it was last computed for
+_sharedPassFrames = [None, None]
+
+def GetSharedPassFrames(plan):
+    """
+    Returns, for every row of the plan, the frame that writes its
+    light-invariant passes. This is the first frame with the same camera
+    position, focus distance, aperture, and focal length.
+    """
+
+    if _sharedPassFrames[0] is not plan:
+        cameraState = np.column_stack([plan[name].astype(np.float64) for name in ("z_cam", "aperture_fstop", "lens")])
+        _, first, inverse = np.unique(cameraState, axis=0, return_index=True, return_inverse=True)
+        _sharedPassFrames[:] = [plan, plan["frame"][first][inverse.ravel()]]
+
+    return _sharedPassFrames[1]
+
+
+def SharesInvariantPasses(scene):
+    """
+    Checks whether light-invariant passes are only written on the first frame
+    of every camera position. Passes are computed for every frame and only
+    their compositor file outputs are shared, so multilayer EXR files, which
+    hold every pass of the frame, never share passes.
+    """
+
+    return scene.file_tool.share_invariant_passes and scene.file_tool.output_profile != "EXR"
+
+
+def GetSharedPassFrame(scene, frame):
+    """
+    Returns the frame whose light-invariant passes a frame uses, which is the
+    frame itself unless passes are shared
+    """
+
+    if not SharesInvariantPasses(scene):
+        return frame
+
+    plan = GetAcquisitionPlan(scene)
+    idx = GetPlanIndex(plan, frame)
+    if idx is None:
+        return frame
+
+    return int(GetSharedPassFrames(plan)[idx])
+
+
+@persistent
+def SharedPassFrameHandler(scene, depsgraph=None):
+    """
+    frame_change_pre handler that mutes the file outputs of light-invariant
+    passes on frames that don't write the shared passes. The view layer's
+    passes are left alone, so the render itself is the same on every frame.
+    """
+
+    if not SharesInvariantPasses(scene) or GetAcquisitionPlan(scene) is None:
+        return
+
+    writesShared = GetSharedPassFrame(scene, scene.frame_current) == scene.frame_current
+
+    # Only touch nodes that change, as every change tags the scene for an update
+    if scene.use_nodes and scene.node_tree is not None:
+        for node in scene.node_tree.nodes:
+            if node.get(SHARED_PASS_KEY) and node.mute == writesShared:
+                node.mute = not writesShared
+
+def SetMultilayerEXROutput(scene):
+    """
+    Sets the render output to one float32 multilayer EXR per frame holding
+    the passes of the pass profile. Depth is written as metric distance, so
+    it keeps the same scale across frames.
+    """
+
+    # Drop the compositor so no per-frame compositing or file nodes are run
+    if scene.use_nodes and scene.node_tree is not None:
+        for node in list(scene.node_tree.nodes):
+            scene.node_tree.nodes.remove(node)
+    scene.render.use_compositing = False
+
+    imageSettings = scene.render.image_settings
+    imageSettings.file_format = "OPEN_EXR_MULTILAYER"
+    imageSettings.color_mode = "RGB"
+    imageSettings.color_depth = "32"
+    imageSettings.exr_codec = scene.file_tool.exr_codec
+
+    # Every enabled pass ends up in the file, so only enable the ones that are used
+    ApplyPassProfile(scene)
+
+
+def GetOutputFilePaths(scene, frame, ownOnly=False):
+    """
+    Returns a dictionary of every file written for a frame, keyed on "image"
+    for the main render and on the folder name for compositor file outputs.
+    With ownOnly, shared light-invariant passes are only included if the
+    frame itself writes them.
+    """
+
+    paths = {"image": bpy.path.abspath(scene.render.frame_path(frame=frame))}
+
+    if not scene.use_nodes or scene.node_tree is None:
+        return paths
+
+    sharedFrame = GetSharedPassFrame(scene, frame)
+
+    for node in scene.node_tree.nodes:
+        # Shared pass outputs are muted on frames that don't write them, but still belong to every frame
+        shared = node.get(SHARED_PASS_KEY, False)
+        if node.type != 'OUTPUT_FILE' or (node.mute and not shared) or (shared and ownOnly and sharedFrame != frame):
+            continue
+
+        nodeFrame = sharedFrame if shared else frame
+        key = os.path.basename(os.path.normpath(node.base_path))
+        extension = IMAGE_EXTENSIONS.get(node.format.file_format, "")
+
+        if node.format.file_format == 'OPEN_EXR_MULTILAYER':
+            # Multilayer outputs write every slot into a single file named after the base path
+            paths[key] = bpy.path.abspath(FormatFramePath(node.base_path, nodeFrame) + extension)
+            continue
+
+        for slot in node.file_slots:
+            slotKey = key if len(node.file_slots) == 1 else "{0}/{1}".format(key, slot.path)
+            paths[slotKey] = bpy.path.abspath(FormatFramePath(node.base_path + slot.path, nodeFrame) + extension)
+
+    return paths
+
+
+def FormatFramePath(path, frame):
+    """
+    Fills in a file path's frame number the way Blender does, replacing the
+    last run of '#' or appending a four digit frame number
+    """
+
+    end = path.rfind("#")
+    if end == -1:
+        return path + str(frame).zfill(4)
+
+    start = end
+    while start > 0 and path[start - 1] == "#":
+        start -= 1
+
+    return path[:start] + str(frame).zfill(end - start + 1) + path[end + 1:]
+
+
+def FileChecksum(filepath, blockSize=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's contents
+    """
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(blockSize), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def AppendManifestRecord(filepath, record):
+    """
+    Appends a single JSON record to the manifest as one line. The line is
+    written with a single O_APPEND write and synced to disk, so a crash can at
+    worst leave one truncated last line, which ReadRenderManifest skips.
+    """
+
+    line = (json.dumps(record) + "\n").encode("utf-8")
+
+    fd = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def ReadRenderManifest(filepath, syntheticSource=False):
+    """
+    Returns a dictionary of the latest manifest record for every completed
+    frame, skipping any truncated lines left by an interrupted render. With
+    syntheticSource, the in-focus renders of synthetic defocus are returned
+    instead of the acquisition's frames.
+    """
+
+    records = {}
+
+    if not os.path.isfile(filepath):
+        return records
+
+    with open(filepath, 'r', encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            # Invalidated frames have to be rendered again
+            if record.get("invalidated"):
+                records.pop(record["frame"], None)
+                continue
+
+            if record.get("synthetic_source", False) != syntheticSource:
+                continue
+
+            records[record["frame"]] = record
+
+    return records
+
+
+def IsFrameComplete(scene, record):
+    """
+    Checks that every file the scene currently writes for a manifest record's
+    frame is listed in the record and still exists with the recorded size
+    and checksum
+    """
+
+    if not record["outputs"]:
+        return False
 
-        # Write out camera distance and aperture size from sff_tool into
-        # space-delimited text file for human readability
-        filePath = bpy.path.abspath(outputPath + "/Scene Settings" + ".txt")
-        file = open(filePath, 'w')
-        file.write("---Camera Settings---")
-        file.write("\ndistance ")
-        file.write(str(context.scene.sff_tool.camera_height))
-        file.write("\naperture ")
-        file.write(str(context.scene.sff_tool.aperture_size))
-        file.write("\n\n---Object Info---")
-        file.write("\nname ")
-        file.write(obj.name)
-        file.write("\nlocation ")
-        file.write(str(obj.location))
-        file.write("\nrotation ")
-        file.write(str(obj.rotation_euler))
-        file.write("\nscale ")
-        file.write(str(obj.scale))
+    for key, path in GetOutputFilePaths(scene, record["frame"]).items():
+        recorded = record["outputs"].get(key)
+        if recorded is None or os.path.normpath(recorded) != os.path.normpath(path):
+            return False
+        if not os.path.isfile(path) or os.path.getsize(path) != record["bytes"].get(key):
+            return False
 
-        file.close()
+        # Files rewritten with the same size are only caught by their checksum
+        if "sha256" in record and FileChecksum(path) != record["sha256"].get(key):
+            return False
 
-        return {'FINISHED'}
+    return True
 
 
-### Helper functions
+@persistent
+def ManifestRenderPreHandler(scene, depsgraph=None):
+    """
+    render_pre handler that records when rendering of a frame starts
+    """
+
+    if _renderingStill:
+        return
+
+    global _renderStartTime
+    _renderStartTime = time.perf_counter()
+
 
-def DefineFocusLimits(context):
+@persistent
+def ManifestRenderWriteHandler(scene, depsgraph=None):
     """
-    Function to compute list of Z-axis positions for SFF camera
+    render_write handler that appends a record for the frame that was just
+    written to the render manifest
     """
 
-    scene = context.scene
-    sfftool = scene.sff_tool
+    if _renderingStill:
+        return
 
-    f = []
-    if sfftool.focus_limits_type == "Auto":
-        # Get min and max vertex Z positions and use to create f
+    if not scene.file_tool.write_render_manifest:
+        return
+
+    renderTime = None if _renderStartTime is None else time.perf_counter() - _renderStartTime
+    record = BuildManifestRecord(scene, scene.frame_current, renderTime)
 
+    # In-focus renders for synthetic defocus aren't frames of the acquisition, SynthesizeFocusStack records those
+    if IsSyntheticDefocus(scene):
+        record["synthetic_source"] = True
 
-        obj = sfftool.main_object # Selected object for SFF
-        mw = obj.matrix_world # Selected object's world matrix
+    AppendManifestRecord(GetManifestPath(scene), record)
 
-        minZ = 9999
-        maxZ = 0
 
-        if len(obj.children) >= 1:
+def BuildManifestRecord(scene, frame, renderTime, paths=None):
+    """
+    Returns a manifest record of a frame's plan parameters and the outputs
+    that exist for it on disk, optionally taking the frame's output paths
+    """
 
-            # If the selected object has children, iterate through them, transforming their vertex coordinates into world coordinates, then find the minimum and maximum amongst them.
-            for child in obj.children:
+    record = {"frame": frame}
 
-                glob_vertex_coordinates = [mw @ v.co for v in child.data.vertices] # Global coordinates of vertices
+    row = GetPlanRow(GetAcquisitionPlan(scene), frame)
+    if row is not None:
+        for name in ACQUISITION_PLAN_DTYPE.names[1:]:
+            record[name] = row[name].item()
 
-                # Find lowest Z value amongst the object's verts
-                minZCurr = min([co.z for co in glob_vertex_coordinates])
+        # Offset of cropped outputs on the full canvas
+        if scene.file_tool.use_roi_border:
+            record["roi"] = GetRenderBorderPixels(scene, row)
 
-                # Find highest Z value amongst the object's verts
-                maxZCurr = max([co.z for co in glob_vertex_coordinates])
+    if paths is None:
+        paths = GetOutputFilePaths(scene, frame)
 
-                if minZCurr < minZ:
-                    minZ = minZCurr
+    outputs = {key: path for key, path in paths.items() if os.path.isfile(path)}
 
-                if maxZCurr > maxZ:
-                    maxZ = maxZCurr
+    record["outputs"] = outputs
+    if scene.render.image_settings.file_format == 'OPEN_EXR_MULTILAYER':
+        # Multilayer files hold every pass of the profile, including light-invariant ones
+        record["layers"] = {PASS_LAYER_NAMES[name]: paths["image"] for name in PASS_PROFILES[scene.file_tool.pass_profile]}
+    record["bytes"] = {key: os.path.getsize(path) for key, path in outputs.items()}
+    record["sha256"] = {key: FileChecksum(path) for key, path in outputs.items()}
+    record["render_time"] = renderTime
+    record["completed"] = time.time()
 
-        else:
-            # In case there aren't any children, just iterate through all object vertices and find the min and max.
+    return record
 
-            glob_vertex_coordinates = [mw @ v.co for v in obj.data.vertices] # Global coordinates of vertices
 
-            # Find lowest Z value amongst the object's verts
-            minZCurr = min([co.z for co in glob_vertex_coordinates])
+# Scene ID property holding the input hash of every planned frame, used by the frame cache
+FRAME_HASHES_KEY = "sffrti_frame_hashes"
 
-            # Find highest Z value amongst the object's verts
-            maxZCurr = max([co.z for co in glob_vertex_coordinates])
+def GetFrameCacheEntry(cacheDir, frameHash):
+    """
+    Returns the folder holding a cached frame's outputs
+    """
 
-            if minZCurr < minZ:
-                minZ = minZCurr
+    return os.path.join(cacheDir, frameHash[:2], frameHash)
 
-            if maxZCurr > maxZ:
-                maxZ = maxZCurr
 
-        f = np.linspace(start=minZ, stop=maxZ, num=sfftool.num_z_pos, endpoint=True)
+def LinkOrCopy(src, dst):
+    """
+    Hard links a file into place, copying it if linking isn't possible
+    """
 
-    elif sfftool.focus_limits_type == "Tasked":
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
 
-        # Check to make sure that CSV exists
-        if not os.path.isfile(sfftool.tasked_file_path):
-            self.report({"ERROR"})
+    if os.path.exists(dst):
+        os.remove(dst)
 
-        # Read in .csv data
-        filename = open(sfftool.tasked_file_path, 'r')
-        depthData = csv.DictReader(filename)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
 
-        ## NOTE: Subtracting camera height from distances
 
-        # Iterate through CSV file and get desired depth levels
-        for col in depthData:
-            # f.append(sfftool.camera_height - float(col["Depth"]))
-            f.append(float(col["Depth"]))
+def CacheLookup(cacheDir, frameHash):
+    """
+    Returns a dictionary of output key to cached file for a frame hash, or
+    None if the frame isn't cached. Marks the entry as recently used.
+    """
 
-        # Sort stored depth levels
-        f = sorted(f)
+    entry = GetFrameCacheEntry(cacheDir, frameHash)
+    if not os.path.isdir(entry):
+        return None
 
-    elif sfftool.focus_limits_type == "Manual":
-        f = np.linspace(start=sfftool.min_z_pos, stop=sfftool.max_z_pos, num=sfftool.num_z_pos, endpoint=True)
+    files = {}
+    for name in os.listdir(entry):
+        key = os.path.splitext(name)[0].replace("%", "/")
+        files[key] = os.path.join(entry, name)
 
-    return f
+    if "image" not in files:
+        return None
+
+    os.utime(entry)
 
+    return files
 
-def ComputeApertureSize(context):
+
+def CacheRestore(cacheDir, frameHash, paths):
     """
-    Used to compute an appropriate aperture size for the desired number of Z positions in the given space
+    Places a cached frame's outputs at the given output paths. Returns False
+    if the frame isn't cached or is missing one of the outputs.
     """
 
-    scene = context.scene
-    sfftool = scene.sff_tool
+    files = CacheLookup(cacheDir, frameHash)
+    if files is None or any(key not in files for key in paths):
+        return False
 
-    camera_data = scene.objects[sfftool.camera_list[0]].data
+    for key, path in paths.items():
+        LinkOrCopy(files[key], path)
 
-    # Get camera focal length
-    # NOTE: Assuming one camera right now
-    f = camera_data.lens / 1000
+    return True
 
-    # Get object distance for computing DoF
-    s = (sfftool.camera_height - sfftool.zPosList[0]) / 1000
 
-    # NOTE: From dof_utils Blender plugin
-    # Calculate Circle of confusion (diameter limit based on d/1500)
-    # https://en.wikipedia.org/wiki/Circle_of_confusion#Circle_of_confusion_diameter_limit_based_on_d.2F1500
-    c = math.sqrt(camera_data.sensor_width**2 + camera_data.sensor_height**2) / 1500
+def CacheStore(cacheDir, frameHash, paths):
+    """
+    Adds a rendered frame's outputs to the cache under its input hash, and
+    returns the number of bytes added
+    """
+
+    entry = GetFrameCacheEntry(cacheDir, frameHash)
+    tmpEntry = entry + ".tmp"
+
+    if os.path.isdir(entry):
+        os.utime(entry)
+        return 0
+
+    if os.path.isdir(tmpEntry):
+        shutil.rmtree(tmpEntry)
+    os.makedirs(tmpEntry)
+
+    for key, path in paths.items():
+        # NOTE: '/' can appear in output keys of multi-slot file output nodes
+        LinkOrCopy(path, os.path.join(tmpEntry, key.replace("/", "%") + os.path.splitext(path)[1]))
+
+    # Entries only become visible once all of their files are in place
+    os.replace(tmpEntry, entry)
+
+    return sum(os.path.getsize(path) for path in paths.values())
+
+
+# Bytes held by every frame cache folder used this session, counted once and then kept up to date
+_frameCacheBytes = {}
+
+def CacheEvict(cacheDir, maxBytes):
+    """
+    Removes the least recently used cache entries until the cache holds at
+    most maxBytes, and returns the number of bytes left in the cache
+    """
+
+    entries = []
+    totalBytes = 0
+
+    if not os.path.isdir(cacheDir):
+        _frameCacheBytes[cacheDir] = 0
+        return 0
+
+    for prefix in os.scandir(cacheDir):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            if not entry.is_dir() or entry.name.endswith(".tmp"):
+                continue
+            size = sum(file.stat().st_size for file in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+            totalBytes += size
+
+    for _, size, path in sorted(entries):
+        if totalBytes <= maxBytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        totalBytes -= size
+
+    _frameCacheBytes[cacheDir] = totalBytes
+
+    return totalBytes
+
+
+# Input hash of every planned frame and the planned frames of every input hash, indexed
+# by PlanRender, or from the frame hashes saved on the scene when a loaded file is rendered
+_frameHashes = {}
+_hashFrames = {}
+
+def IndexFrameHashes(scene):
+    """
+    Indexes the frame hashes stored on the scene by PlanRender by frame and
+    by hash, so render_write handlers look frames up in constant time
+    """
+
+    _frameHashes.clear()
+    _hashFrames.clear()
+
+    stored = scene.get(FRAME_HASHES_KEY)
+    if stored is None:
+        return
+
+    for frame, frameHash in zip(stored["frames"], stored["hashes"]):
+        _frameHashes[frame] = frameHash
+        _hashFrames.setdefault(frameHash, []).append(frame)
+
+
+@persistent
+def FrameCacheRenderInitHandler(scene, depsgraph=None):
+    """
+    render_init handler that indexes the frame hashes saved with a loaded
+    file for FrameCacheRenderWriteHandler, once per file
+    """
+
+    if _renderingStill or _frameHashes:
+        return
+
+    IndexFrameHashes(scene)
+
+
+@persistent
+def FrameCacheRenderWriteHandler(scene, depsgraph=None):
+    """
+    render_write handler that adds the frame that was just written to the
+    frame cache and fills in every other planned frame with identical inputs
+    """
+
+    if _renderingStill:
+        return
+
+    filetool = scene.file_tool
+
+    if not filetool.use_frame_cache or filetool.frame_cache_path == "":
+        return
+
+    frame = scene.frame_current
+    frameHash = _frameHashes.get(frame)
+
+    if frameHash is None:
+        return
+
+    paths = {key: path for key, path in GetOutputFilePaths(scene, frame).items() if os.path.isfile(path)}
+    if "image" not in paths:
+        return
+
+    cacheDir = bpy.path.abspath(filetool.frame_cache_path)
+    maxBytes = filetool.frame_cache_size * 1e9
+
+    # Only scan the cache once, and again whenever it has grown too large
+    if cacheDir not in _frameCacheBytes:
+        CacheEvict(cacheDir, maxBytes)
+    _frameCacheBytes[cacheDir] += CacheStore(cacheDir, frameHash, paths)
+
+    # Duplicates later in the render get their files now, so they're skipped when rendering without overwriting
+    for otherFrame in _hashFrames[frameHash]:
+        if otherFrame == frame:
+            continue
+
+        otherPaths = GetOutputFilePaths(scene, otherFrame)
+        if os.path.isfile(otherPaths["image"]):
+            continue
+
+        if CacheRestore(cacheDir, frameHash, {key: otherPaths[key] for key in paths}) and filetool.write_render_manifest:
+            record = BuildManifestRecord(scene, otherFrame, 0.0)
+            record["cached_from"] = frameHash
+            AppendManifestRecord(GetManifestPath(scene), record)
+
+    if _frameCacheBytes[cacheDir] > maxBytes:
+        CacheEvict(cacheDir, maxBytes)
+
+
+# Folder in-focus renders and metric depth are written to for synthetic defocus
+SYNTHETIC_SOURCE_FOLDER = "AllInFocus"
+
+# Output keys of the linear render and metric depth that defocus is synthesized from
+SYNTHETIC_SOURCE_KEYS = ("ImageRaw", "DepthRaw")
+
+def IsSyntheticDefocus(scene):
+    """
+    Returns True if focus levels are synthesized from in-focus renders
+    """
+
+    return scene.sff_tool.sff_render_mode == 'Synthetic'
+
+
+def GetSyntheticFilePaths(scene, frame):
+    """
+    Returns the output paths of a synthesized frame, which are the paths a
+    path traced render of the frame would have been written to
+    """
+
+    paths = {key: path for key, path in GetOutputFilePaths(scene, frame).items() if key not in SYNTHETIC_SOURCE_KEYS}
+
+    fileName = "Image-{0}{1}".format(str(frame).zfill(GetFramePadding(scene)), IMAGE_EXTENSIONS.get(scene.render.image_settings.file_format, ""))
+    paths["image"] = os.path.join(GetOutputFolder(scene), "Renders", fileName)
+
+    return paths
+
 
+def GetPixelPitch(scene, cameraData):
+    """
+    Returns the size of a rendered pixel on the camera sensor in meters
+    """
+
+    scale = scene.render.resolution_percentage / 100
+    resX = scene.render.resolution_x * scale
+    resY = scene.render.resolution_y * scale
+
+    if cameraData.sensor_fit == 'VERTICAL' or (cameraData.sensor_fit == 'AUTO' and resY > resX):
+        sensorSize = cameraData.sensor_height if cameraData.sensor_fit == 'VERTICAL' else cameraData.sensor_width
+        return sensorSize / 1000 / resY
+
+    return cameraData.sensor_width / 1000 / resX
+
+
+def LoadImagePixels(filepath):
+    """
+    Loads an image into a (height, width, 4) float32 array, top row first
+    """
+
+    image = bpy.data.images.load(filepath, check_existing=False)
+    try:
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+
+    # Blender stores pixels bottom row first
+    return pixels.reshape(height, width, 4)[::-1]
+
+
+def SaveImagePixels(pixels, filepath, scene):
+    """
+    Saves a (height, width, 3 or 4) array of linear pixels the way a render
+    of the scene is saved, using its output format and color management
+    """
+
+    height, width = pixels.shape[:2]
+
+    rgba = np.ones((height, width, 4), dtype=np.float32)
+    rgba[..., :pixels.shape[2]] = pixels[..., :4]
+
+    image = bpy.data.images.new("SFFRTI_output", width, height, alpha=True, float_buffer=True)
+    try:
+        image.pixels.foreach_set(rgba[::-1].ravel())
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        image.save_render(filepath, scene=scene)
+    finally:
+        bpy.data.images.remove(image)
+
+
+def RenderStill(scene, filepath, fileFormat=None):
+    """
+    Renders the current frame to a file, without writing compositor file
+    outputs, and returns its pixels. Optionally overrides the file format.
+    """
+
+    global _renderingStill
+
+    previousFilepath = scene.render.filepath
+    previousFormat = (scene.render.image_settings.file_format, scene.render.image_settings.color_depth)
+    mutedNodes = [node for node in scene.node_tree.nodes if node.type == 'OUTPUT_FILE' and not node.mute] if scene.use_nodes and scene.node_tree else []
+
+    try:
+        for node in mutedNodes:
+            node.mute = True
+
+        if fileFormat is not None:
+            scene.render.image_settings.file_format = fileFormat
+            if fileFormat == 'OPEN_EXR':
+                scene.render.image_settings.color_depth = '32'
+
+        scene.render.filepath = filepath
+        _renderingStill = True
+        bpy.ops.render.render(write_still=True)
+    finally:
+        _renderingStill = False
+        for node in mutedNodes:
+            node.mute = False
+        scene.render.image_settings.file_format, scene.render.image_settings.color_depth = previousFormat
+        scene.render.filepath = previousFilepath
+
+    return LoadImagePixels(filepath)
+
+
+def ImageRMSE(image, reference):
+    """
+    Returns the root mean square error between the color channels of two images
+    """
+
+    error = image[..., :3] - reference[..., :3]
+
+    return float(np.sqrt(np.mean(error * error)))
+
+
+# Sample counts and adaptive sampling thresholds tried by TuneSamples, cheapest first
+SAMPLE_LADDER = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+ADAPTIVE_THRESHOLDS = (0.1, 0.05, 0.02, 0.01)
+
+def PilotFrames(plan):
+    """
+    Returns the frames used for pilot renders: the lowest and highest light
+    elevations at the nearest and farthest focus levels
+    """
+
+    elevation = plan["z_lamp"] / np.maximum(np.sqrt(plan["x_lamp"]**2 + plan["y_lamp"]**2 + plan["z_lamp"]**2), 1e-12)
+    zCam = plan["z_cam"]
+
+    frames = []
+    for focusMask in (zCam == zCam.min(), zCam == zCam.max()):
+        candidates = np.flatnonzero(focusMask)
+        for pick in (np.argmin, np.argmax):
+            frames.append(int(plan["frame"][candidates[pick(elevation[candidates])]]))
+
+    return sorted(set(frames))
+
+
+def DiskKernelSpectrum(radius, shape):
+    """
+    Returns the real FFT of an anti-aliased, normalized disk kernel of the
+    given radius in pixels, centered for convolving images of the given shape
+    """
+
+    height, width = shape
+    y = np.fft.fftfreq(height, 1 / height)[:, None]
+    x = np.fft.fftfreq(width, 1 / width)[None, :]
+
+    kernel = np.clip(radius + 0.5 - np.sqrt(x * x + y * y), 0, 1)
+    kernel /= kernel.sum()
+
+    return np.fft.rfft2(kernel)
+
+
+def SynthesizeDefocus(image, depth, focusDistances, fstops, lenses, pixelPitch, numLevels=16):
+    """
+    Synthesizes thin-lens defocus of a linear in-focus image for every given
+    focus distance, yielding one (height, width, channels) image per focus
+    distance
+
+    The circle of confusion of every pixel is computed from its depth [m],
+    the focus distance [m], f-stop, and focal length [mm]. The image is blurred
+    once for each of numLevels disk radii, and every focus level then picks
+    and interpolates its per-pixel blur from that set. Blurred images are kept
+    in a temporary file, so memory use doesn't grow with numLevels or the
+    number of focus distances. Occlusion effects at depth edges aren't modeled.
+    """
+
+    image = np.asarray(image, dtype=np.float32)
+    depth = np.asarray(depth, dtype=np.float64)
+    focusDistances = np.asarray(focusDistances, dtype=np.float64).ravel()
+    f = np.broadcast_to(np.asarray(lenses, dtype=np.float64) / 1000, focusDistances.shape)
+    fstops = np.broadcast_to(np.asarray(fstops, dtype=np.float64), focusDistances.shape)
+
+    # Background pixels without geometry are treated as infinitely far away
+    depth = np.where(np.isfinite(depth) & (depth > 0) & (depth < 1e9), depth, np.inf)
+
+    def BlurRadii(idx):
+        # Circle of confusion radius in pixels: (f / N) * f * |d - s| / (d * (s - f)), halved
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relative = np.where(np.isinf(depth), 1.0, np.abs(depth - focusDistances[idx]) / depth)
+        radii = (f[idx] / fstops[idx]) * f[idx] * relative / (focusDistances[idx] - f[idx]) / 2 / pixelPitch
+        return np.nan_to_num(np.abs(radii)).astype(np.float32)
+
+    maxRadius = max((float(BlurRadii(idx).max()) for idx in range(len(focusDistances))), default=0.0)
+    if maxRadius < 0.5:
+        for _ in range(len(focusDistances)):
+            yield image.copy()
+        return
+
+    levelRadii = np.linspace(0, maxRadius, numLevels)
+
+    # Blur the edge-padded image once per level radius, sharing a single forward FFT
+    pad = int(np.ceil(maxRadius)) + 1
+    padded = np.pad(image, ((pad, pad), (pad, pad), (0, 0)), mode="edge")
+    spectrum = np.fft.rfft2(padded, axes=(0, 1))
+    del padded
+
+    height, width = image.shape[:2]
+    paddedShape = (height + 2 * pad, width + 2 * pad)
+
+    with tempfile.TemporaryFile() as scratch:
+        levels = np.memmap(scratch, dtype=np.float32, mode='w+', shape=(numLevels,) + image.shape)
+        levels[0] = image
+        for idx in range(1, numLevels):
+            kernel = DiskKernelSpectrum(levelRadii[idx], paddedShape)[..., None]
+            blurred = np.fft.irfft2(spectrum * kernel, s=paddedShape, axes=(0, 1))
+            levels[idx] = blurred[pad:pad + height, pad:pad + width]
+        del spectrum
+
+        for idx in range(len(focusDistances)):
+            # Interpolate between the two nearest blur levels of every pixel
+            position = BlurRadii(idx) / maxRadius * (numLevels - 1)
+            lower = np.minimum(position.astype(np.int64), numLevels - 2)
+            weight = (position - lower)[..., None]
+
+            synthesized = np.empty_like(image)
+            for level in np.unique(lower).tolist():
+                mask = lower == level
+                below = levels[level][mask]
+                above = levels[level + 1][mask]
+                synthesized[mask] = below + (above - below) * weight[mask]
+
+            yield synthesized
+
+
+# ID property recording which system, 'RTI' or 'SFF', created an object or its data
+RIG_OWNER_KEY = "sffrti_rig"
+
+def TagRigIDs(rig, *ids):
+    """
+    Records the given objects and data as owned by the 'RTI' or 'SFF' system
+    """
+
+    for id_data in ids:
+        id_data[RIG_OWNER_KEY] = rig
+
+
+def GetRigIDs(rig, parent=None):
+    """
+    Returns lists of the objects and of the other datablocks owned by the
+    'RTI' or 'SFF' system, including actions only used by them. Systems
+    created before ownership was recorded are found through their parent.
+    """
+
+    objects = [obj for obj in bpy.data.objects if obj.get(RIG_OWNER_KEY) == rig]
+    data = [id_data for collection in (bpy.data.lights, bpy.data.cameras) for id_data in collection if id_data.get(RIG_OWNER_KEY) == rig]
+
+    if parent is not None and parent.get(RIG_OWNER_KEY) is None:
+        # Everything below the parent was created with it
+        stack = [parent]
+        while stack:
+            current = stack.pop()
+            stack.extend(current.children)
 
-    D = np.sqrt( (sfftool.zPosList[1] - sfftool.zPosList[0])**2 )
+            objects.append(current)
+            if current.data is not None and current.data not in data:
+                data.append(current.data)
 
-    print(D)
+    # Keyframes written by SetAnimation live in an action per object or camera data
+    for id_data in objects + data:
+        animation = id_data.animation_data
+        if animation is not None and animation.action is not None and animation.action.users == 1:
+            data.append(animation.action)
 
-    # D = (np.max(sfftool.zPosList) - np.min(sfftool.zPosList)) / len(sfftool.zPosList)
-    # D = (sfftool.max_z_pos - sfftool.min_z_pos) / sfftool.num_z_pos
+    return objects, data
 
-    # H = (-np.sqrt( (2*f*s - 2*(s**s)) - 4*D*(-D*(f**f) + 2*D*f*s - D*(s**s)) ) - 2*f*s + 2*(s**s)) / (2*D)
-    H = (-np.sqrt( (D*D + s*s) * (f-s)**2 ) - f*s+(s*s) ) / D
 
-    print(H)
+def IsLightRig(scene):
+    """
+    Returns True if the RTI system was created as a single moving sun rig
+    """
+
+    rtitool = scene.rti_tool
+
+    return rtitool.light_rig_type == 'Moving' and rtitool.rti_parent is not None and len(rtitool.light_positions) > 0
+
+
+def GetNumLights(scene):
+    """
+    Returns the number of light positions per focus level, which is the
+    number of stored .lp positions for a moving sun rig or the number of
+    light objects otherwise
+    """
+
+    if IsLightRig(scene):
+        return len(scene.rti_tool.light_positions)
+
+    return len(scene.rti_tool.light_list)
+
+
+def GetLightPositions(scene):
+    """
+    Returns an (N, 3) array of light positions, one per light position in
+    the acquisition
+    """
+
+    if IsLightRig(scene):
+        return np.asarray(scene.rti_tool.light_positions, dtype=np.float64).reshape(-1, 3)
+
+    return np.array([scene.objects[name].location[:] for name in scene.rti_tool.light_list], dtype=np.float64).reshape(-1, 3)
 
-    N = ((f*f) / (c*f - c * H))
 
-    print(N)
+def GetLightNumbers(scene):
+    """
+    Returns the .lp entry number of every light position in the
+    acquisition, or zeros if the lights weren't created from an .lp file
+    """
+
+    numbers = scene.rti_tool.light_numbers
+    if len(numbers) != GetNumLights(scene):
+        return np.zeros(GetNumLights(scene), dtype=np.int32)
+
+    return np.asarray(numbers, dtype=np.int32)
+
+
+def ReadLPFile(filepath):
+    """
+    Reads a light positions (.lp) file into an (N, 3) array of X, Y, Z
+    light directions.
+
+    The first line of the file holds the number of lights, each following
+    line holds an image name and the light's X, Y, and Z coordinates.
+    """
+
+    with open(filepath, 'r') as file:
+        header = file.readline().split()
+
+        try:
+            numLights = int(header[0])
+        except (IndexError, ValueError):
+            raise ValueError("first line must hold the number of lights")
 
-    # N = np.abs(((-np.sqrt(c**2 * f**4 * (targetDoF**2 + s**2) * (f-s)**2)) + (c * f**2 * s) - (c * f**2 * s**2)) / (c**2 * targetDoF * (f-s)**2))
+        if numLights < 1:
+            raise ValueError("header lists {0} lights".format(numLights))
+
+        # Parse the remaining rows straight from the open file, skipping blank lines and only reading as many rows as the header lists
+        rows = itertools.islice((line for line in file if line.strip()), numLights)
+        positions = np.loadtxt(rows, dtype=np.float64, usecols=(1, 2, 3), ndmin=2)
 
-    return N
+    if positions.shape[0] != numLights:
+        raise ValueError("header lists {0} lights but {1} were found".format(numLights, positions.shape[0]))
 
+    return positions
 
-def Cartesian2Polar3D(x, y, z):
+
+def ProjectToDome(positions, radius):
+    """
+    Re-projects an (N, 3) array of light positions onto a dome of the given
+    radius, keeping each light's direction from the origin
     """
-    Takes X, Y, and Z coordinates as input and converts them to a polar
-    coordinate system
 
-    Source: https://stackoverflow.com/questions/10868135/cartesian-to-polar-3d-coordinates
+    positions = np.asarray(positions, dtype=np.float64)
 
+    norms = np.linalg.norm(positions, axis=1, keepdims=True)
+
+    if np.any(norms == 0):
+        raise ValueError("light positions can't be located at the origin")
+
+    return positions * (radius / norms)
+
+
+def RTIBasis(positions, basis):
     """
+    Returns the PTM or hemispherical harmonics basis of an (N, 3) array of
+    light positions as an (N, terms) matrix
+    """
+
+    directions = positions / np.linalg.norm(positions, axis=1, keepdims=True)
+    lu, lv = directions[:, 0], directions[:, 1]
 
-    r = math.sqrt(x*x + y*y + z*z)
+    if basis == 'PTM':
+        return np.column_stack([lu * lu, lv * lv, lu * lv, lu, lv, np.ones_like(lu)])
 
-    longitude = math.acos(x / math.sqrt(x*x + y*y)) * (-1 if y < 0 else 1)
+    phi = np.arctan2(lv, lu)
+    cosTheta = np.clip(directions[:, 2], 0, 1)
+    root = np.sqrt(cosTheta - cosTheta ** 2)
 
-    latitude = math.acos(z / r)
+    terms = [
+        np.full_like(phi, 1 / math.sqrt(2 * math.pi)),
+        math.sqrt(6 / math.pi) * np.cos(phi) * root,
+        math.sqrt(3 / (2 * math.pi)) * (-1 + 2 * cosTheta),
+        math.sqrt(6 / math.pi) * np.sin(phi) * root,
+        math.sqrt(30 / math.pi) * np.cos(2 * phi) * (-cosTheta + cosTheta ** 2),
+        math.sqrt(30 / math.pi) * np.cos(phi) * (-1 + 2 * cosTheta) * root,
+        math.sqrt(5 / (2 * math.pi)) * (1 - 6 * cosTheta + 6 * cosTheta ** 2),
+        math.sqrt(30 / math.pi) * np.sin(phi) * (-1 + 2 * cosTheta) * root,
+        math.sqrt(30 / math.pi) * (-cosTheta + cosTheta ** 2) * np.sin(2 * phi),
+    ]
 
-    return r, longitude, latitude
+    return np.column_stack(terms[:4 if basis == 'HSH2' else 9])
 
 
-def Polar2Cartesian3D(r, longitude, latitude):
+def ExpectedFitError(basis, subsetBasis=None):
     """
-    Takes, r, longitude, and latitude coordinates in a polar coordinate
-    system and converts them to a 3D cartesian coordinate system
+    Returns the RMS error of relit intensities over every direction of the
+    basis, relative to the noise of a single image, when fitting with the
+    lights of subsetBasis (or every light)
+    """
+
+    if subsetBasis is None:
+        subsetBasis = basis
 
-    Source: https://stackoverflow.com/questions/10868135/cartesian-to-polar-3d-coordinates
+    # Prediction variance at direction b is b^T (B^T B)^-1 b times the image noise variance
+    inverse = np.linalg.pinv(subsetBasis.T @ subsetBasis)
+
+    return math.sqrt(np.einsum("ij,jk,ik->", basis, inverse, basis) / len(basis))
+
+
+def SelectLightSubset(positions, numLights, basis='PTM', criterion='Conditioning'):
+    """
+    Greedily selects numLights of the given light positions for fitting an
+    RTI basis. Returns the selected indices in the order they were chosen
+    and the expected fit error of the first K selected lights for every K,
+    which is infinite until the basis is fully determined.
     """
 
-    x = r * math.sin(latitude) * math.cos(longitude)
-    y = r * math.sin(latitude) * math.sin(longitude)
-    z = r * math.cos(latitude)
+    B = RTIBasis(positions, basis)
+    numTerms = B.shape[1]
+    numLights = min(numLights, len(B))
+
+    # Second moment of the basis over the whole dome, for the mean prediction variance
+    moment = B.T @ B / len(B)
+
+    # A small ridge keeps the information matrix invertible until enough lights are chosen
+    ridge = 1e-9 * np.trace(moment)
+    inverse = np.eye(numTerms) / ridge
+
+    directions = positions / np.linalg.norm(positions, axis=1, keepdims=True)
+    angularDistance = np.full(len(B), np.inf)
+
+    available = np.ones(len(B), dtype=bool)
+    order = np.empty(numLights, dtype=np.int64)
+    errors = np.full(numLights, np.inf)
 
-    return x, y, z
+    for k in range(numLights):
+        if criterion == 'Coverage':
+            # Start overhead, then take the light farthest from all chosen lights
+            scores = directions[:, 2] if k == 0 else angularDistance
+        else:
+            # Adding light b multiplies det(B^T B) by 1 + b^T (B^T B)^-1 b (D-optimal design)
+            scores = np.einsum("ij,jk,ik->i", B, inverse, B)
+
+        idx = int(np.argmax(np.where(available, scores, -np.inf)))
+        order[k] = idx
+        available[idx] = False
+
+        # Sherman-Morrison update of the inverse information matrix
+        b = B[idx]
+        inverseB = inverse @ b
+        inverse -= np.outer(inverseB, inverseB) / (1 + b @ inverseB)
+
+        angularDistance = np.minimum(angularDistance, np.arccos(np.clip(directions @ directions[idx], -1, 1)))
+
+        if k + 1 >= numTerms:
+            errors[k] = math.sqrt(max(np.sum(inverse * moment), 0))
+
+    return order, errors
 
 
 ### Panel in Object Mode
@@ -1080,6 +4046,29 @@ class RTIPanel(Panel):
         layout.prop(rtitool, "lp_file_path")
         layout.prop(rtitool, "dome_radius")
 
+        # Rig type can only be changed before the system is created
+        row = layout.row()
+        row.enabled = rtitool.rti_parent == None
+        row.prop(rtitool, "light_rig_type")
+
+        layout.prop(rtitool, "use_light_subset")
+        if rtitool.use_light_subset:
+            layout.prop(rtitool, "subset_size")
+            layout.prop(rtitool, "subset_criterion")
+            layout.prop(rtitool, "subset_basis")
+            layout.operator("rti.plan_light_subset")
+
+            # Expected fit error at a handful of subset sizes
+            if rtitool.subset_errors:
+                box = layout.box()
+                box.label(text="Lights: expected fit error / image noise")
+                step = max(1, len(rtitool.subset_errors) // 6)
+                rows = rtitool.subset_errors[::step]
+                if rows[-1] != rtitool.subset_errors[-1]:
+                    rows.append(rtitool.subset_errors[-1])
+                for k, error in rows:
+                    box.label(text="{0}: {1:.3f}".format(k, error))
+
         layout.label(text="RTI system creation")
         row = layout.row(align = True)
 
@@ -1127,7 +4116,18 @@ class SFFPanel(Panel):
         layout.prop(sfftool, "focus_limits_type")
         layout.prop(sfftool, "main_object")
 
-        if sfftool.focus_limits_type != "Tasked":
+        if sfftool.focus_limits_type == "Density":
+            layout.prop(sfftool, "density_threshold")
+
+        if sfftool.focus_limits_type == "DoF":
+            layout.prop(sfftool, "lens")
+            layout.prop(sfftool, "sensor_width")
+            layout.prop(sfftool, "circle_of_confusion")
+            layout.prop(sfftool, "dof_overlap")
+            layout.prop(sfftool, "per_level_fstop")
+
+        # The depth of field planner picks the number of levels unless f-stops are planned per level
+        if sfftool.focus_limits_type not in ("Tasked", "DoF") or sfftool.per_level_fstop:
             layout.prop(sfftool, "num_z_pos")
 
         layout.separator()
@@ -1136,6 +4136,11 @@ class SFFPanel(Panel):
         layout.prop(sfftool, "camera_type")
         layout.prop(sfftool, "aperture_size")
 
+        layout.prop(sfftool, "sff_render_mode")
+        if sfftool.sff_render_mode == "Synthetic":
+            layout.prop(sfftool, "synthetic_blur_levels")
+            layout.prop(sfftool, "comparison_frames")
+
         if sfftool.camera_type == "Static":
             layout.prop(sfftool, "camera_height")
             layout.prop(sfftool, "static_focus")
@@ -1188,6 +4193,7 @@ class OutputPanel(Panel):
         filetool = scene.file_tool
 
         layout.prop(filetool, "prep_for_background_render")
+        layout.prop(filetool, "animation_mode")
 
         layout.operator("sffrti.set_animation")
 
@@ -1196,12 +4202,53 @@ class OutputPanel(Panel):
         layout.operator("files.set_render")
         layout.operator("files.create_csv")
 
+        if scene.sff_tool.sff_render_mode == "Synthetic":
+            layout.operator("files.synthesize_focus_stack")
+            layout.operator("files.compare_synthetic_defocus")
+
+        layout.prop(filetool, "noise_target")
+        layout.prop(filetool, "reference_samples")
+        layout.operator("files.tune_samples")
+
+        layout.prop(filetool, "output_profile")
+        layout.prop(filetool, "pass_profile")
+        if filetool.output_profile == "EXR":
+            layout.prop(filetool, "exr_codec")
+        else:
+            layout.prop(filetool, "share_invariant_passes")
+        layout.prop(filetool, "use_roi_border")
+        if filetool.use_roi_border:
+            layout.prop(filetool, "roi_margin")
+            layout.prop(filetool, "roi_scope")
+        layout.prop(filetool, "log_level")
+        layout.prop(filetool, "write_render_manifest")
+        layout.prop(filetool, "use_frame_cache")
+        if filetool.use_frame_cache:
+            layout.prop(filetool, "frame_cache_path")
+            layout.prop(filetool, "frame_cache_size")
+        layout.operator("files.plan_render")
+        layout.operator("files.resume_render")
+
+        # Timing summary of this session
+        if _operatorTimings or _frameTimings:
+            box = layout.box()
+            for timing in _operatorTimings[-3:]:
+                box.label(text="{0}: {1:.3f} s".format(timing["operator"], timing["seconds"]))
+
+            if _frameTimings:
+                summary = SummarizeTimings()
+                box.label(text="{0} frames, {1:.1f} MB written".format(summary["frames"], summary["bytes"] / 2**20))
+                box.label(text="Mean sync {0:.2f} s, render {1:.2f} s".format(summary["sync"], summary["render"]))
+                box.label(text="Mean composite {0:.2f} s, save {1:.2f} s".format(summary["composite"], summary["save"]))
+
+            box.operator("files.export_timings")
+
         layout.separator()
 
 
 ### Registration
 
-classes = (light, camera, lightSettings, cameraSettings, fileSettings, CreateLights, CreateSingleCamera, DeleteLights, CreateCameras, CreateSingleLight, DeleteCameras, SetAnimation, SetRender, CreateCSV, MainPanel, RTIPanel, SFFPanel, OutputPanel)
+classes = (light, camera, lightSettings, cameraSettings, fileSettings, CreateLights, PlanLightSubset, CreateSingleCamera, DeleteLights, CreateCameras, CreateSingleLight, DeleteCameras, SetAnimation, SetRender, SynthesizeFocusStack, CompareSyntheticDefocus, TuneSamples, PlanRender, ResumeRender, WriteTimings, CreateCSV, MainPanel, RTIPanel, SFFPanel, OutputPanel)
 
 def register():
 
@@ -1212,8 +4259,19 @@ def register():
     bpy.types.Scene.sff_tool = PointerProperty(type=cameraSettings)
     bpy.types.Scene.file_tool = PointerProperty(type=fileSettings)
 
+    # NOTE: Handler lists missing from older Blender versions (e.g. composite_pre) are skipped
+    for handlerList, name in HANDLERS:
+        handlers = getattr(bpy.app.handlers, handlerList, None)
+        if handlers is not None and globals()[name] not in handlers:
+            handlers.append(globals()[name])
+
 
 def unregister():
+    for handlerList, name in HANDLERS:
+        handlers = getattr(bpy.app.handlers, handlerList, None)
+        if handlers is not None and globals()[name] in handlers:
+            handlers.remove(globals()[name])
+
     for cls in reversed(classes):
         bpy.utils.unregister_class(cls)
     del bpy.types.Scene.rti_tool
@@ -0,0 +1,251 @@
+"""
+Scaling benchmarks for the Blender SFF-RTI add-on operators.
+
+Sweeps the number of lights, focus levels, and mesh vertices one at a time
+around a baseline and reports wall time and peak Python memory for every
+operator at every scale point.
+
+Inside Blender the real `bpy` is used:
+    blender -b --factory-startup --python benchmarks/bench_operators.py -- --csv results.csv
+
+From plain Python a lightweight stand-in is used instead, which is enough to
+track regressions of the add-on's own Python and NumPy cost:
+    python benchmarks/bench_operators.py --quick
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+try:
+    import bpy
+    IN_BLENDER = not getattr(bpy, "__file__", "").startswith(BENCH_DIR)
+except ImportError:
+    sys.path.insert(0, BENCH_DIR)
+    import bpy_standin
+    bpy = bpy_standin.install()
+    IN_BLENDER = False
+
+import BlenderSFFRTI as addon
+
+
+BASELINE = {"lights": 100, "focus_levels": 10, "vertices": 10000}
+
+SWEEPS = {
+    "lights": (10, 100, 1000, 10000),
+    "focus_levels": (1, 10, 100, 1000),
+    "vertices": (1000, 100000, 1000000),
+}
+
+QUICK_SWEEPS = {
+    "lights": (10, 100, 1000),
+    "focus_levels": (1, 10, 100),
+    "vertices": (1000, 100000),
+}
+
+
+def ResetScene():
+    """
+    Starts from an empty scene and clears the add-on's class-level state
+    """
+
+    if IN_BLENDER:
+        bpy.ops.wm.read_factory_settings(use_empty=True)
+    else:
+        bpy_standin.reset()
+
+    addon.lightSettings.light_list.clear()
+    addon.lightSettings.light_positions.clear()
+    addon.lightSettings.light_numbers.clear()
+    addon.lightSettings.light_subset.clear()
+    addon.lightSettings.subset_errors.clear()
+    addon.cameraSettings.camera_list.clear()
+    addon.cameraSettings.zPosList.clear()
+    addon.cameraSettings.fstopList.clear()
+    addon._acquisitionPlans.clear()
+    del addon._operatorTimings[:]
+
+
+def WriteLPFile(filepath, numLights, rng):
+    """
+    Writes an .lp file with lights spread over the upper hemisphere
+    """
+
+    directions = rng.normal(size=(numLights, 3))
+    directions[:, 2] = np.abs(directions[:, 2]) + 0.05
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+
+    with open(filepath, 'w') as file:
+        file.write("{0}\n".format(numLights))
+        for idx, (x, y, z) in enumerate(directions.tolist(), start=1):
+            file.write("Image-{0}.png {1} {2} {3}\n".format(idx, x, y, z))
+
+
+def CreateMeshObject(scene, numVertices, rng):
+    """
+    Creates a point cloud mesh object with the given number of vertices
+    """
+
+    mesh = bpy.data.meshes.new("BenchMesh")
+    mesh.vertices.add(numVertices)
+
+    co = rng.uniform(-0.5, 0.5, size=(numVertices, 3)).astype(np.float32)
+    co[:, 2] *= 0.2
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.update()
+
+    obj = bpy.data.objects.new("BenchObject", mesh)
+    scene.collection.objects.link(obj)
+
+    return obj
+
+
+def Measure(results, point, name, function, trackMemory):
+    """
+    Runs a function once, recording its wall time and peak traced memory
+    """
+
+    if trackMemory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        outcome = function()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if trackMemory:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    results.append(dict(point, operator=name, seconds=seconds, peak_mb=peak, result=str(outcome)))
+
+    return outcome
+
+
+def RunScalePoint(point, workDir, trackMemory, seed=0):
+    """
+    Builds a complete SFF-RTI acquisition for one scale point and times
+    every operator along the way
+    """
+
+    ResetScene()
+    rng = np.random.default_rng(seed)
+
+    scene = bpy.context.scene
+    outputPath = os.path.join(workDir, "output")
+    os.makedirs(outputPath, exist_ok=True)
+
+    lpPath = os.path.join(workDir, "bench.lp")
+    WriteLPFile(lpPath, point["lights"], rng)
+
+    scene.rti_tool.lp_file_path = lpPath
+    scene.rti_tool.dome_radius = 1.0
+
+    sfftool = scene.sff_tool
+    sfftool.main_object = CreateMeshObject(scene, point["vertices"], rng)
+    sfftool.focus_limits_type = 'Auto'
+    sfftool.num_z_pos = point["focus_levels"]
+    sfftool.camera_type = 'Static'
+    sfftool.camera_height = 2.0
+    sfftool.aperture_size = 2.8
+
+    scene.file_tool.output_path = outputPath
+
+    results = []
+
+    Measure(results, point, "CreateLights", bpy.ops.rti.create_rti, trackMemory)
+
+    # Vertex bounds are cached per mesh, so time the first (uncached) and a repeated call
+    Measure(results, point, "DefineFocusLimits", lambda: len(addon.DefineFocusLimits(bpy.context)), trackMemory)
+    Measure(results, point, "DefineFocusLimits (cached)", lambda: len(addon.DefineFocusLimits(bpy.context)), trackMemory)
+    addon._zBoundsCache.clear()
+
+    Measure(results, point, "CreateCameras", bpy.ops.sff.create_sff, trackMemory)
+    Measure(results, point, "SetAnimation", bpy.ops.sffrti.set_animation, trackMemory)
+    Measure(results, point, "SetRender", bpy.ops.files.set_render, trackMemory)
+    Measure(results, point, "CreateCSV", bpy.ops.files.create_csv, trackMemory)
+    Measure(results, point, "DeleteLights", bpy.ops.rti.delete_rti, trackMemory)
+    Measure(results, point, "DeleteCameras", bpy.ops.sff.delete_sff, trackMemory)
+
+    return results
+
+
+def ScalePoints(sweeps):
+    """
+    Yields scale points varying one parameter at a time around the baseline
+    """
+
+    for axis, values in sweeps.items():
+        for value in values:
+            point = dict(BASELINE, sweep=axis)
+            point[axis] = value
+            yield point
+
+
+def PrintTable(results):
+    header = "{0:<13} {1:>7} {2:>7} {3:>9}  {4:<28} {5:>10} {6:>10}".format("sweep", "lights", "levels", "vertices", "operator", "seconds", "peak MB")
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        peak = "" if row["peak_mb"] is None else "{0:.2f}".format(row["peak_mb"])
+        print("{0:<13} {1:>7} {2:>7} {3:>9}  {4:<28} {5:>10.4f} {6:>10}".format(
+            row["sweep"], row["lights"], row["focus_levels"], row["vertices"], row["operator"], row["seconds"], peak))
+
+
+def main(argv=None):
+    if argv is None:
+        # Blender passes script arguments after "--"
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description="Benchmark the SFF-RTI add-on operators over a range of scales.")
+    parser.add_argument("--quick", action="store_true", help="Use a smaller sweep suited for CI")
+    parser.add_argument("--sweep", choices=sorted(SWEEPS), action="append", help="Only run the given sweeps")
+    parser.add_argument("--no-memory", action="store_true", help="Skip peak memory tracking, which slows down timings")
+    parser.add_argument("--csv", help="Write results to a CSV file")
+    args = parser.parse_args(argv)
+
+    sweeps = QUICK_SWEEPS if args.quick else SWEEPS
+    if args.sweep:
+        sweeps = {axis: sweeps[axis] for axis in args.sweep}
+
+    addon.register()
+    addon.logger.setLevel("WARNING")
+
+    workDir = tempfile.mkdtemp(prefix="sffrti_bench_")
+    results = []
+    try:
+        for point in ScalePoints(sweeps):
+            results.extend(RunScalePoint(point, workDir, not args.no_memory))
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+        addon.unregister()
+
+    print("Environment: {0}".format("Blender {0}".format(".".join(map(str, bpy.app.version))) if IN_BLENDER else "bpy stand-in"))
+    PrintTable(results)
+
+    if args.csv:
+        with open(args.csv, 'w', newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["environment", "sweep", "lights", "focus_levels", "vertices", "operator", "seconds", "peak_mb", "result"])
+            writer.writeheader()
+            for row in results:
+                writer.writerow(dict(row, environment="blender" if IN_BLENDER else "standin"))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
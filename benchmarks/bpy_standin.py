@@ -0,0 +1,921 @@
+"""
+Lightweight stand-in for the parts of `bpy` and `mathutils` used by the
+Blender SFF-RTI add-on, so that its operators can be benchmarked from a plain
+Python interpreter.
+
+Only the data model the add-on touches is implemented. Nothing is rendered:
+render and compositing calls only record their settings. Timings taken
+against the stand-in show the add-on's own Python and NumPy cost, not
+Blender's, and should only be compared with other stand-in runs.
+
+Call `install()` before importing the add-on.
+"""
+
+import math
+import os
+import sys
+import types
+
+import numpy as np
+
+
+### mathutils
+
+class Vector:
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self._values = [float(value) for value in values]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, idx):
+        return self._values[idx]
+
+    def __setitem__(self, idx, value):
+        self._values[idx] = value
+
+    def __repr__(self):
+        return "Vector(({0}))".format(", ".join("{0:.4f}".format(value) for value in self._values))
+
+    @property
+    def x(self):
+        return self._values[0]
+
+    @property
+    def y(self):
+        return self._values[1]
+
+    @property
+    def z(self):
+        return self._values[2]
+
+    def to_track_quat(self, track='Z', up='Y'):
+        # Shortest rotation taking +Z onto the vector, which is what the add-on tracks lights with
+        x, y, z = self._values[:3]
+        length = math.sqrt(x*x + y*y + z*z) or 1.0
+        x, y, z = x / length, y / length, z / length
+
+        if z < -0.999999:
+            return Quaternion((0.0, 1.0, 0.0, 0.0))
+
+        w = 1.0 + z
+        norm = math.sqrt(w*w + y*y + x*x)
+        return Quaternion((w / norm, -y / norm, x / norm, 0.0))
+
+
+class Quaternion(Vector):
+    def __init__(self, values=(1.0, 0.0, 0.0, 0.0)):
+        super().__init__(values)
+
+
+class Euler(Vector):
+    pass
+
+
+class Matrix:
+    def __init__(self, rows=None):
+        self._array = np.identity(4) if rows is None else np.array(rows, dtype=np.float64)
+
+    def __iter__(self):
+        return iter([Vector(row) for row in self._array])
+
+    def __array__(self, dtype=None, copy=None):
+        return self._array if dtype is None else self._array.astype(dtype)
+
+    def __matmul__(self, other):
+        co = np.append(np.asarray(list(other), dtype=np.float64), 1.0)
+        return Vector((self._array @ co)[:3])
+
+
+### Properties and types
+
+class _Property:
+    def __init__(self, kind, **kwargs):
+        self.kind = kind
+        self.kwargs = kwargs
+
+    def Default(self):
+        if "default" in self.kwargs:
+            return self.kwargs["default"]
+        if self.kind == 'ENUM':
+            return self.kwargs["items"][0][0]
+        return {'STRING': "", 'BOOL': False, 'INT': 0, 'FLOAT': 0.0, 'FLOAT_VECTOR': (0.0, 0.0, 0.0)}.get(self.kind)
+
+
+def _PropertyFunction(kind):
+    def function(**kwargs):
+        return _Property(kind, **kwargs)
+    return function
+
+
+class bpy_struct:
+    pass
+
+
+class PropertyGroup(bpy_struct):
+    def __init__(self):
+        for cls in reversed(type(self).__mro__):
+            for name, prop in getattr(cls, "__annotations__", {}).items():
+                if isinstance(prop, _Property):
+                    object.__setattr__(self, name, prop.Default())
+
+
+class Operator(bpy_struct):
+    def report(self, level, message=""):
+        self.reports = getattr(self, "reports", [])
+        self.reports.append((set(level), message))
+
+
+class Panel(bpy_struct):
+    pass
+
+
+class Menu(bpy_struct):
+    pass
+
+
+class IDProperties:
+    """
+    Mixin giving a datablock dictionary-style custom properties
+    """
+
+    def _Props(self):
+        if "_idprops" not in self.__dict__:
+            self.__dict__["_idprops"] = {}
+        return self.__dict__["_idprops"]
+
+    def __getitem__(self, key):
+        return self._Props()[key]
+
+    def __setitem__(self, key, value):
+        self._Props()[key] = value
+
+    def __delitem__(self, key):
+        del self._Props()[key]
+
+    def __contains__(self, key):
+        return key in self._Props()
+
+    def get(self, key, default=None):
+        return self._Props().get(key, default)
+
+
+class ID(IDProperties, bpy_struct):
+    _pointers = 0
+
+    def __init__(self, name):
+        self.name = name
+        self.animation_data = None
+        ID._pointers += 1
+        self._pointer = ID._pointers
+
+    def as_pointer(self):
+        return self._pointer
+
+    def animation_data_create(self):
+        if self.animation_data is None:
+            self.animation_data = AnimData()
+        return self.animation_data
+
+    def animation_data_clear(self):
+        if self.animation_data is not None:
+            self.animation_data.action = None
+        self.animation_data = None
+
+    def keyframe_insert(self, data_path, index=-1, frame=0.0):
+        action = self.animation_data_create().action
+        if action is None:
+            action = self.animation_data.action = data.actions.new(self.name + "Action")
+
+        value = _ResolvePath(self, data_path)
+        values = list(value) if hasattr(value, "__iter__") else [value]
+        indices = range(len(values)) if index == -1 else [index]
+
+        for idx in indices:
+            fcurve = action.fcurves.find(data_path, index=idx) or action.fcurves.new(data_path, index=idx)
+            fcurve.keyframe_points.insert(frame, float(values[idx]))
+        return True
+
+
+def _ResolvePath(struct, path):
+    for part in path.split("."):
+        struct = getattr(struct, part)
+    return struct
+
+
+class AnimData:
+    def __init__(self):
+        self._action = None
+
+    @property
+    def action(self):
+        return self._action
+
+    @action.setter
+    def action(self, value):
+        # Actions count their users like in Blender
+        if self._action is not None:
+            self._action.users -= 1
+        if value is not None:
+            value.users += 1
+        self._action = value
+
+
+class _KeyframePoints:
+    def __init__(self):
+        self.co = np.zeros((0, 2), dtype=np.float32)
+        self.interpolation = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.co)
+
+    def add(self, count):
+        self.co = np.concatenate((self.co, np.zeros((count, 2), dtype=np.float32)))
+        self.interpolation = np.concatenate((self.interpolation, np.full(count, 2, dtype=np.int32)))
+
+    def insert(self, frame, value):
+        self.add(1)
+        self.co[-1] = (frame, value)
+
+    def foreach_set(self, attr, seq):
+        target = getattr(self, attr)
+        target.ravel()[:] = np.asarray(seq).ravel()
+
+
+class FCurve:
+    def __init__(self, data_path, index):
+        self.data_path = data_path
+        self.array_index = index
+        self.keyframe_points = _KeyframePoints()
+
+    def update(self):
+        order = np.argsort(self.keyframe_points.co[:, 0], kind="stable")
+        self.keyframe_points.co = self.keyframe_points.co[order]
+        self.keyframe_points.interpolation = self.keyframe_points.interpolation[order]
+
+
+class _FCurves(list):
+    def find(self, data_path, index=0):
+        for fcurve in self:
+            if fcurve.data_path == data_path and fcurve.array_index == index:
+                return fcurve
+        return None
+
+    def new(self, data_path, index=0, action_group=""):
+        fcurve = FCurve(data_path, index)
+        self.append(fcurve)
+        return fcurve
+
+
+class Action(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.fcurves = _FCurves()
+        self.users = 0
+
+
+class _DOF:
+    def __init__(self):
+        self.use_dof = False
+        self.focus_distance = 10.0
+        self.aperture_fstop = 2.8
+        self.aperture_blades = 0
+        self.id_data = None
+
+    def keyframe_insert(self, data_path, index=-1, frame=0.0):
+        return self.id_data.keyframe_insert("dof." + data_path, index=index, frame=frame)
+
+
+class Camera(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.type = 'PERSP'
+        self.lens = 50.0
+        self.sensor_fit = 'AUTO'
+        self.sensor_width = 36.0
+        self.sensor_height = 24.0
+        self.shift_x = 0.0
+        self.shift_y = 0.0
+        self.dof = _DOF()
+        self.dof.id_data = self
+
+    def view_frame(self, scene=None):
+        # Frame corners in camera space one unit in front of a perspective camera, fitted to the larger dimension
+        aspect = 1.0 if scene is None else scene.render.resolution_y / scene.render.resolution_x
+        halfX = 0.5 * self.sensor_width / self.lens
+        halfY = halfX * aspect
+        if aspect > 1:
+            halfX, halfY = halfX / aspect, halfY / aspect
+        depth = -1.0
+        shiftX, shiftY = 2 * halfX * self.shift_x, 2 * halfX * self.shift_y
+        return [Vector((x + shiftX, y + shiftY, depth)) for x, y in ((halfX, halfY), (halfX, -halfY), (-halfX, -halfY), (-halfX, halfY))]
+
+
+class Light(ID):
+    def __init__(self, name, type='POINT'):
+        super().__init__(name)
+        self.type = type
+        self.energy = 1.0
+        self.color = (1.0, 1.0, 1.0)
+        self.angle = 0.0
+
+
+class _Vertices:
+    def __init__(self):
+        self.co = np.zeros((0, 3), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.co)
+
+    def add(self, count):
+        self.co = np.concatenate((self.co, np.zeros((count, 3), dtype=np.float32)))
+
+    def foreach_get(self, attr, seq):
+        seq[:] = getattr(self, attr).ravel()
+
+    def foreach_set(self, attr, seq):
+        getattr(self, attr).ravel()[:] = np.asarray(seq).ravel()
+
+
+class Mesh(ID):
+    def __init__(self, name):
+        super().__init__(name)
+        self.vertices = _Vertices()
+
+    def update(self):
+        pass
+
+
+class Object(ID):
+    def __init__(self, name, object_data=None):
+        super().__init__(name)
+        self.data = object_data
+        self.location = Vector()
+        self.rotation_mode = 'XYZ'
+        self.rotation_quaternion = Quaternion()
+        self.rotation_euler = Euler()
+        self.scale = Vector((1.0, 1.0, 1.0))
+        self.hide_render = False
+        self.hide_viewport = False
+        self.material_slots = []
+        self.modifiers = []
+        self.matrix_parent_inverse = Matrix()
+        self._hidden = False
+        self._selected = False
+        self._parent = None
+        self.children = []
+
+    @property
+    def bound_box(self):
+        if not isinstance(self.data, Mesh) or len(self.data.vertices) == 0:
+            return [Vector()] * 8
+        co = self.data.vertices.co
+        low, high = co.min(axis=0).tolist(), co.max(axis=0).tolist()
+        return [Vector((high[0] if i & 4 else low[0], high[1] if i & 2 else low[1], high[2] if i & 1 else low[2])) for i in range(8)]
+
+    @property
+    def type(self):
+        return {Mesh: 'MESH', Light: 'LIGHT', Camera: 'CAMERA'}.get(type(self.data), 'EMPTY')
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, value):
+        if self._parent is not None:
+            self._parent.children.remove(self)
+        self._parent = value
+        if value is not None:
+            value.children.append(self)
+
+    @property
+    def matrix_basis(self):
+        matrix = np.identity(4)
+        matrix[:3, 3] = list(self.location)
+        matrix[:3, :3] *= np.asarray(list(self.scale))
+        return Matrix(matrix)
+
+    @property
+    def matrix_world(self):
+        matrix = np.asarray(self.matrix_basis)
+        if self._parent is not None:
+            matrix = np.asarray(self._parent.matrix_world) @ np.asarray(self.matrix_parent_inverse) @ matrix
+        return Matrix(matrix)
+
+    def hide_set(self, state):
+        self._hidden = state
+
+    def select_set(self, state):
+        self._selected = state
+
+    def select_get(self):
+        return self._selected
+
+
+class _IDCollection:
+    """
+    Name-keyed collection of datablocks, like bpy.data.objects
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._items = {}
+
+    def _UniqueName(self, name):
+        if name not in self._items:
+            return name
+        idx = 1
+        while "{0}.{1:03d}".format(name, idx) in self._items:
+            idx += 1
+        return "{0}.{1:03d}".format(name, idx)
+
+    def new(self, name, *args, **kwargs):
+        item = self._factory(self._UniqueName(name), *args, **kwargs)
+        self._items[item.name] = item
+        return item
+
+    def remove(self, item, do_unlink=True):
+        self._items.pop(item.name, None)
+        if isinstance(item, Object):
+            item.parent = None
+            for child in list(item.children):
+                child.parent = None
+            for scene in data.scenes:
+                scene.collection.objects.unlink(item)
+
+    def batch_remove(self, ids):
+        for item in list(ids):
+            for collection in data._collections():
+                if collection._items.get(item.name) is item:
+                    collection.remove(item)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self._items.values())[key]
+        return self._items[key]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _SceneObjects:
+    def __init__(self):
+        self._items = {}
+
+    def link(self, obj):
+        self._items[obj.name] = obj
+
+    def unlink(self, obj):
+        self._items.pop(obj.name, None)
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _Collection:
+    def __init__(self):
+        self.objects = _SceneObjects()
+
+
+class _Socket:
+    def __init__(self, name, node=None):
+        self.name = name
+        self.identifier = name
+        self.node = node
+        self.default_value = 0.0
+
+
+class _Sockets:
+    def __init__(self, names, node=None):
+        self._node = node
+        self._sockets = [_Socket(name, node) for name in names]
+
+    def __iter__(self):
+        return iter(self._sockets)
+
+    def __len__(self):
+        return len(self._sockets)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._sockets[key]
+        for socket in self._sockets:
+            if socket.name == key:
+                return socket
+        raise KeyError(key)
+
+    def new(self, type, name):
+        socket = _Socket(name, self._node)
+        self._sockets.append(socket)
+        return socket
+
+
+class _ImageFormat:
+    def __init__(self):
+        self.file_format = 'PNG'
+        self.color_mode = 'RGBA'
+        self.color_depth = '8'
+        self.exr_codec = 'ZIP'
+
+
+class _FileSlot:
+    def __init__(self, path):
+        self.path = path
+
+
+class _FileSlots(list):
+    def new(self, name):
+        slot = _FileSlot(name)
+        self.append(slot)
+        return slot
+
+
+_NODE_SOCKETS = {
+    "CompositorNodeRLayers": ((), ("Image", "Alpha", "Depth", "Normal")),
+    "CompositorNodeOutputFile": (("Image",), ()),
+    "CompositorNodeMapRange": (("Value", "From Min", "From Max", "To Min", "To Max"), ("Value",)),
+    "CompositorNodeNormalize": (("Value",), ("Value",)),
+}
+
+
+class _RNAProperty:
+    def __init__(self, identifier, type, is_readonly=False):
+        self.identifier = identifier
+        self.type = type
+        self.is_readonly = is_readonly
+
+
+class _RNA:
+    """
+    RNA description listing an instance's plain attributes as properties
+    """
+
+    _TYPES = {bool: 'BOOLEAN', int: 'INT', float: 'FLOAT', str: 'STRING'}
+    _READONLY = ("bl_idname", "type")
+
+    def __init__(self, instance):
+        self.properties = [_RNAProperty(name, _RNA._TYPES[type(value)], name in _RNA._READONLY)
+                           for name, value in vars(instance).items()
+                           if not name.startswith("_") and type(value) in _RNA._TYPES]
+
+
+class Node(IDProperties, bpy_struct):
+    def __init__(self, type):
+        inputs, outputs = _NODE_SOCKETS.get(type, (("Image",), ("Image",)))
+        self.bl_idname = type
+        self.type = 'OUTPUT_FILE' if type == "CompositorNodeOutputFile" else type
+        self.name = type
+        self.label = ""
+        self.mute = False
+        self.inputs = _Sockets(inputs, self)
+        self.outputs = _Sockets(outputs, self)
+        self.use_clamp = False
+        self.base_path = ""
+        self.format = _ImageFormat()
+        self.file_slots = _FileSlots([_FileSlot("Image")])
+        self.layer_slots = self.file_slots
+
+    @property
+    def bl_rna(self):
+        return _RNA(self)
+
+
+class _Nodes(list):
+    def new(self, type):
+        node = Node(type)
+        self.append(node)
+        return node
+
+
+class _Link:
+    def __init__(self, output, input):
+        self.from_socket = output
+        self.to_socket = input
+        self.from_node = output.node
+        self.to_node = input.node
+        self.is_muted = False
+
+
+class _Links(list):
+    def new(self, output, input):
+        link = _Link(output, input)
+        self.append(link)
+        return link
+
+
+class NodeTree(bpy_struct):
+    def __init__(self):
+        self.nodes = _Nodes()
+        self.links = _Links()
+
+
+class _ViewLayer(bpy_struct):
+    def __init__(self, name):
+        self.name = name
+        for name in ("combined", "z", "normal", "shadow", "diffuse_direct", "diffuse_indirect", "diffuse_color",
+                     "glossy_direct", "glossy_indirect", "glossy_color"):
+            setattr(self, "use_pass_" + name, name == "combined")
+
+
+class _ViewLayers(list):
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for layer in self:
+                if layer.name == key:
+                    return layer
+            raise KeyError(key)
+        return list.__getitem__(self, key)
+
+
+class _RenderSettings(bpy_struct):
+    def __init__(self):
+        self.engine = 'BLENDER_EEVEE'
+        self.filepath = "/tmp/"
+        self.resolution_x = 1920
+        self.resolution_y = 1080
+        self.resolution_percentage = 100
+        self.pixel_aspect_x = 1.0
+        self.pixel_aspect_y = 1.0
+        self.film_transparent = False
+        self.use_border = False
+        self.use_crop_to_border = False
+        self.border_min_x = 0.0
+        self.border_max_x = 1.0
+        self.border_min_y = 0.0
+        self.border_max_y = 1.0
+        self.use_compositing = True
+        self.use_overwrite = True
+        self.use_placeholder = False
+        self.threads_mode = 'AUTO'
+        self.threads = 1
+        self.image_settings = _ImageFormat()
+
+    def frame_path(self, frame=0):
+        from_path = self.filepath
+        end = from_path.rfind("#")
+        if end == -1:
+            return from_path + str(frame).zfill(4) + ".png"
+        start = end
+        while start > 0 and from_path[start - 1] == "#":
+            start -= 1
+        return from_path[:start] + str(frame).zfill(end - start + 1) + from_path[end + 1:] + ".png"
+
+
+class _Settings(bpy_struct):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Scene(ID):
+    _pointer_properties = {}
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.collection = _Collection()
+        self.render = _RenderSettings()
+        self.display_settings = _Settings(display_device='sRGB')
+        self.view_settings = _Settings(view_transform='Filmic', look='None', exposure=0.0, gamma=1.0)
+        self.cycles = _Settings(samples=128, use_adaptive_sampling=True, adaptive_threshold=0.01, max_bounces=12, seed=0)
+        self.view_layers = _ViewLayers([_ViewLayer("ViewLayer")])
+        self.node_tree = None
+        self.world = None
+        self._use_nodes = False
+        self.frame_start = 1
+        self.frame_end = 250
+        self.frame_current = 1
+        self.timeline_markers = []
+
+    def __getattr__(self, name):
+        # Pointer properties registered on bpy.types.Scene are created on first access
+        prop = Scene._pointer_properties.get(name)
+        if prop is None:
+            raise AttributeError(name)
+
+        value = prop.kwargs["type"]()
+        object.__setattr__(self, name, value)
+        return value
+
+    @property
+    def objects(self):
+        return self.collection.objects
+
+    @property
+    def use_nodes(self):
+        return self._use_nodes
+
+    @use_nodes.setter
+    def use_nodes(self, value):
+        self._use_nodes = value
+        if value and self.node_tree is None:
+            self.node_tree = NodeTree()
+
+    def frame_set(self, frame, subframe=0.0):
+        self.frame_current = frame
+        for handler in app.handlers.frame_change_pre:
+            handler(self)
+
+
+class _Data:
+    def __init__(self):
+        self.objects = _IDCollection(Object)
+        self.lights = _IDCollection(Light)
+        self.cameras = _IDCollection(Camera)
+        self.meshes = _IDCollection(Mesh)
+        self.actions = _IDCollection(Action)
+        self.scenes = _IDCollection(Scene)
+
+    def _collections(self):
+        return (self.objects, self.lights, self.cameras, self.meshes, self.actions)
+
+    def batch_remove(self, ids):
+        self.objects.batch_remove(ids)
+
+
+class _Handlers:
+    def __init__(self):
+        for name in ("frame_change_pre", "frame_change_post", "render_pre", "render_post",
+                     "render_write", "render_complete", "render_cancel", "render_init", "load_post"):
+            setattr(self, name, [])
+
+    @staticmethod
+    def persistent(function):
+        return function
+
+
+class _Context:
+    def __init__(self, scene):
+        self.scene = scene
+        self.view_layer = scene.view_layers[0]
+
+
+class _OperatorCall:
+    def __init__(self, cls):
+        self._cls = cls
+
+    def __call__(self, *args, **kwargs):
+        operator = self._cls()
+        for key, value in kwargs.items():
+            setattr(operator, key, value)
+        if hasattr(self._cls, "poll") and not self._cls.poll(context):
+            raise RuntimeError("Operator {0}.poll() failed, context is incorrect".format(self._cls.bl_idname))
+        result = operator.execute(context)
+        for level, message in getattr(operator, "reports", []):
+            if 'ERROR' in level:
+                raise RuntimeError("Error: {0}".format(message))
+        return result
+
+
+def _SelectAll(action='TOGGLE'):
+    for obj in context.scene.objects:
+        obj.select_set(action == 'SELECT')
+    return {'FINISHED'}
+
+
+def _DeleteSelected(use_global=False):
+    for obj in list(context.scene.objects):
+        if obj.select_get():
+            data.objects.remove(obj)
+    return {'FINISHED'}
+
+
+### Module assembly
+
+data = None
+context = None
+app = None
+types_module = None
+ops = None
+
+
+def reset():
+    """
+    Replaces all data with an empty scene, like loading factory settings
+    """
+
+    global data, context
+
+    data = _Data()
+    scene = data.scenes.new("Scene")
+    context = _Context(scene)
+
+    bpy = sys.modules["bpy"]
+    bpy.data = data
+    bpy.context = context
+
+
+def install():
+    """
+    Registers the stand-in `bpy` and `mathutils` modules in sys.modules
+    """
+
+    global app, types_module, ops
+
+    bpy = types.ModuleType("bpy")
+    bpy.__file__ = __file__
+
+    props = types.ModuleType("bpy.props")
+    for name, kind in (("StringProperty", 'STRING'), ("BoolProperty", 'BOOL'), ("IntProperty", 'INT'),
+                       ("FloatProperty", 'FLOAT'), ("FloatVectorProperty", 'FLOAT_VECTOR'),
+                       ("EnumProperty", 'ENUM'), ("PointerProperty", 'POINTER'), ("CollectionProperty", 'COLLECTION')):
+        setattr(props, name, _PropertyFunction(kind))
+
+    types_module = types.ModuleType("bpy.types")
+    for cls in (bpy_struct, PropertyGroup, Operator, Panel, Menu, ID, Object, Mesh, Light, Camera, Action, Node, NodeTree):
+        setattr(types_module, cls.__name__, cls)
+
+    app = types.ModuleType("bpy.app")
+    app.background = True
+    app.version = (3, 0, 0)
+    app.binary_path = ""
+    app.handlers = types.ModuleType("bpy.app.handlers")
+    handlers = _Handlers()
+    for name, value in vars(handlers).items():
+        setattr(app.handlers, name, value)
+    app.handlers.persistent = _Handlers.persistent
+
+    utils = types.ModuleType("bpy.utils")
+    utils.register_class = _RegisterClass
+    utils.unregister_class = lambda cls: None
+
+    path = types.ModuleType("bpy.path")
+    path.abspath = lambda filepath: os.path.abspath(filepath.replace("//", os.getcwd() + os.sep, 1)) if filepath.startswith("//") else filepath
+
+    ops = types.ModuleType("bpy.ops")
+    ops.object = types.SimpleNamespace(select_all=_SelectAll, delete=_DeleteSelected)
+    ops.render = types.SimpleNamespace(render=lambda **kwargs: {'FINISHED'})
+
+    bpy.props = props
+    bpy.types = types_module
+    bpy.app = app
+    bpy.utils = utils
+    bpy.path = path
+    bpy.ops = ops
+
+    mathutils = types.ModuleType("mathutils")
+    mathutils.Vector = Vector
+    mathutils.Quaternion = Quaternion
+    mathutils.Euler = Euler
+    mathutils.Matrix = Matrix
+
+    sys.modules.update({
+        "bpy": bpy,
+        "bpy.props": props,
+        "bpy.types": types_module,
+        "bpy.app": app,
+        "bpy.app.handlers": app.handlers,
+        "bpy.utils": utils,
+        "bpy.path": path,
+        "bpy.ops": ops,
+        "mathutils": mathutils,
+    })
+
+    # Properties registered on the Scene type are created for every new scene
+    class _SceneTypeProxy:
+        def __setattr__(self, name, value):
+            if isinstance(value, _Property):
+                Scene._pointer_properties[name] = value
+
+        def __delattr__(self, name):
+            Scene._pointer_properties.pop(name, None)
+
+    types_module.Scene = _SceneTypeProxy()
+
+    reset()
+
+    return bpy
+
+
+def _RegisterClass(cls):
+    idname = getattr(cls, "bl_idname", "")
+    if issubclass(cls, Operator) and "." in idname:
+        category, name = idname.split(".", 1)
+        namespace = getattr(ops, category, None)
+        if namespace is None:
+            namespace = types.SimpleNamespace()
+            setattr(ops, category, namespace)
+        setattr(namespace, name, _OperatorCall(cls))
@@ -0,0 +1,91 @@
+"""
+Imports the add-on for the unit tests. Outside Blender, the lightweight
+`bpy` stand-in from the benchmarks is installed first.
+"""
+
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+BENCH_DIR = os.path.join(ROOT_DIR, "benchmarks")
+
+sys.path[:0] = [ROOT_DIR, BENCH_DIR, os.path.join(ROOT_DIR, "tools")]
+
+try:
+    import bpy
+    IN_BLENDER = not getattr(bpy, "__file__", "").startswith(BENCH_DIR)
+except ImportError:
+    import bpy_standin
+    bpy = bpy_standin.install()
+    IN_BLENDER = False
+
+import numpy as np
+
+import BlenderSFFRTI as addon
+import bench_operators as bench
+
+if not hasattr(bpy.context.scene, "file_tool"):
+    addon.register()
+
+
+def ResetScene():
+    """
+    Starts from an empty scene and clears the add-on's module-level state
+    """
+
+    if IN_BLENDER:
+        bpy.ops.wm.read_factory_settings(use_empty=True)
+    else:
+        bpy_standin.reset()
+
+    addon.lightSettings.light_list.clear()
+    addon.lightSettings.light_positions.clear()
+    addon.lightSettings.light_numbers.clear()
+    addon.lightSettings.light_subset.clear()
+    addon.lightSettings.subset_errors.clear()
+    addon.cameraSettings.camera_list.clear()
+    addon.cameraSettings.zPosList.clear()
+    addon.cameraSettings.fstopList.clear()
+    addon._acquisitionPlans.clear()
+    addon._frameCacheBytes.clear()
+    addon._driverActiveLight = None
+
+    return bpy.context.scene
+
+
+def BuildAcquisition(folder, numLights=3, numLevels=2, seed=0, subsetSize=None):
+    """
+    Builds a static camera acquisition of a small point cloud the way the
+    benchmarks do, writing outputs to the given folder, optionally from a
+    subset of the lights
+    """
+
+    scene = ResetScene()
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(folder, exist_ok=True)
+    lpPath = os.path.join(folder, "lights.lp")
+    bench.WriteLPFile(lpPath, numLights, rng)
+
+    scene.rti_tool.lp_file_path = lpPath
+    scene.rti_tool.dome_radius = 1.0
+    if subsetSize is not None:
+        scene.rti_tool.use_light_subset = True
+        scene.rti_tool.subset_size = subsetSize
+
+    sfftool = scene.sff_tool
+    sfftool.main_object = bench.CreateMeshObject(scene, 100, rng)
+    sfftool.focus_limits_type = 'Auto'
+    sfftool.num_z_pos = numLevels
+    sfftool.camera_type = 'Static'
+    sfftool.camera_height = 2.0
+    sfftool.aperture_size = 2.8
+
+    scene.file_tool.output_path = folder
+
+    for operator in (bpy.ops.rti.create_rti, bpy.ops.sff.create_sff, bpy.ops.sffrti.set_animation, bpy.ops.files.set_render):
+        if operator() != {'FINISHED'}:
+            raise RuntimeError("{0} didn't finish".format(operator))
+
+    return scene
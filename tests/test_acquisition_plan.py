@@ -0,0 +1,104 @@
+"""
+Tests of the structured acquisition plan
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from standin import addon, bpy
+
+
+def ExamplePlan():
+    """
+    Returns a four frame plan of two lights at two camera heights
+    """
+
+    lights = np.array([[0.5, 0.0, 0.5], [0.0, 0.5, 0.5]] * 2)
+
+    return addon.BuildAcquisitionPlan(np.arange(1, 5), lights, [0.1, 0.1, 0.2, 0.2], [2.8, 2.8, 4.0, 4.0], 50.0)
+
+
+class BuildAcquisitionPlanTest(unittest.TestCase):
+
+    def test_fills_every_column(self):
+        frames = np.arange(1, 5)
+        lights = np.arange(12, dtype=np.float64).reshape(4, 3)
+
+        plan = addon.BuildAcquisitionPlan(frames, lights, [0.1, 0.1, 0.2, 0.2], [2.8, 2.8, 4.0, 4.0], 50.0)
+
+        self.assertEqual(plan.dtype, addon.ACQUISITION_PLAN_DTYPE)
+        np.testing.assert_array_equal(plan["frame"], frames)
+        np.testing.assert_array_equal(np.column_stack([plan["x_lamp"], plan["y_lamp"], plan["z_lamp"]]), lights)
+        np.testing.assert_array_equal(plan["z_cam"], [0.1, 0.1, 0.2, 0.2])
+        np.testing.assert_array_equal(plan["aperture_fstop"], [2.8, 2.8, 4.0, 4.0])
+        np.testing.assert_array_equal(plan["lens"], 50.0)
+
+
+class StoredPlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = bpy.context.scene
+
+    def tearDown(self):
+        addon.SetAcquisitionPlan(self.scene, None)
+
+    def test_rebuilds_plan_saved_with_scene(self):
+        plan = ExamplePlan()
+        addon.SetAcquisitionPlan(self.scene, plan)
+
+        # A loaded file only has the copy saved on the scene
+        addon._acquisitionPlans.clear()
+        stored = addon.GetAcquisitionPlan(self.scene)
+
+        self.assertEqual(stored.dtype, addon.ACQUISITION_PLAN_DTYPE)
+        np.testing.assert_array_equal(stored, plan)
+
+    def test_clearing_removes_saved_copy(self):
+        addon.SetAcquisitionPlan(self.scene, ExamplePlan())
+        addon.SetAcquisitionPlan(self.scene, None)
+
+        self.assertNotIn(addon.ACQUISITION_PLAN_KEY, self.scene)
+        self.assertIsNone(addon.GetAcquisitionPlan(self.scene))
+
+
+class GetPlanIndexTest(unittest.TestCase):
+
+    def test_finds_consecutive_and_sparse_frames(self):
+        plan = ExamplePlan()
+        self.assertEqual([addon.GetPlanIndex(plan, frame) for frame in (1, 3, 4)], [0, 2, 3])
+
+        plan["frame"] = [2, 5, 9, 10]
+        self.assertEqual([addon.GetPlanIndex(plan, frame) for frame in (2, 9, 10)], [0, 2, 3])
+
+    def test_missing_frames(self):
+        plan = ExamplePlan()
+        plan["frame"] = [2, 5, 9, 10]
+
+        for frame in (0, 1, 3, 11):
+            self.assertIsNone(addon.GetPlanIndex(plan, frame))
+
+        self.assertIsNone(addon.GetPlanIndex(None, 1))
+        self.assertIsNone(addon.GetPlanRow(plan[:0], 1))
+
+
+class WritePlanCSVTest(unittest.TestCase):
+
+    def test_writes_one_row_per_image(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filepath = os.path.join(folder, "Image.csv")
+            addon.WritePlanCSV(filepath, ExamplePlan(), 3)
+
+            with open(filepath) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual(lines[0].split(",")[:4], ["image", "x_lamp", "y_lamp", "z_lamp"])
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[1].split(",")[:5], ["Image-001", "0.5", "0.0", "0.5", "0.1"])
+        self.assertEqual(lines[4].split(",")[0], "Image-004")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Tests of the scoring of reconstructions against ground truth
+"""
+
+import unittest
+
+import numpy as np
+
+import standin  # noqa: F401 (puts tools/ on the path)
+import evaluate
+
+
+class NearestLevelTest(unittest.TestCase):
+
+    def test_picks_closest_level(self):
+        levels = np.array([1.0, 2.0, 4.0])
+        depth = np.array([0.0, 1.2, 1.6, 2.9, 3.1, 9.0])
+
+        np.testing.assert_array_equal(evaluate.NearestLevel(depth, levels), [0, 0, 1, 1, 2, 2])
+
+    def test_ties_go_to_lower_level(self):
+        levels = np.array([1.0, 2.0, 3.0])
+
+        np.testing.assert_array_equal(evaluate.NearestLevel(np.array([1.5, 2.5]), levels), [0, 1])
+
+
+class TileMeansTest(unittest.TestCase):
+
+    def test_partial_tiles_and_empty_tiles(self):
+        values = np.arange(15, dtype=np.float64).reshape(3, 5)
+        valid = np.ones_like(values, dtype=bool)
+        valid[:2, 2:4] = False
+
+        tiles = evaluate.TileMeans(values, valid, 2)
+
+        self.assertEqual(tiles.shape, (2, 3))
+        self.assertAlmostEqual(tiles[0, 0], np.mean([0, 1, 5, 6]))
+        self.assertTrue(np.isnan(tiles[0, 1]))
+        self.assertAlmostEqual(tiles[1, 2], 14)
+
+
+class EvaluateDepthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.levels = np.array([1.0, 1.1, 1.2, 1.3])
+        self.truth = np.random.default_rng(0).uniform(1.0, 1.3, (6, 8))
+
+    def test_perfect_reconstruction(self):
+        metrics, tiles = evaluate.EvaluateDepth(self.truth.copy(), self.truth, self.levels, 1.0, 0.0, 1e-6, 4)
+
+        self.assertEqual(metrics["pixels"], 48)
+        self.assertEqual(metrics["depth_rmse"], 0)
+        self.assertEqual(metrics["completeness"], 1)
+        self.assertEqual(metrics["within_tolerance"], 1)
+        self.assertEqual(metrics["focus_index_accuracy"], 1)
+        self.assertEqual(tiles.shape, (2, 2))
+
+    def test_constant_error(self):
+        metrics, _ = evaluate.EvaluateDepth(self.truth + 0.002, self.truth, self.levels, 1.0, 0.0, 0.001, 4)
+
+        self.assertAlmostEqual(metrics["depth_rmse"], 0.002)
+        self.assertAlmostEqual(metrics["depth_mae"], 0.002)
+        self.assertEqual(metrics["within_tolerance"], 0)
+
+    def test_maps_moving_camera_heights(self):
+        # A moving camera reconstructs camera heights, and its focus levels are heights too
+        heights = 2.5 - self.truth
+        levels = np.sort(2.5 - self.levels)
+
+        metrics, _ = evaluate.EvaluateDepth(heights, self.truth, levels, -1.0, 2.5, 1e-9, 4)
+
+        self.assertAlmostEqual(metrics["depth_rmse"], 0)
+        self.assertEqual(metrics["focus_index_accuracy"], 1)
+
+    def test_missing_and_background_pixels(self):
+        truth = self.truth.copy()
+        truth[0] = evaluate.BACKGROUND_DEPTH
+        truth[1, 0] = np.nan
+        depth = truth.copy()
+        depth[2, :4] = np.nan
+        depth[0] = 0
+
+        metrics, _ = evaluate.EvaluateDepth(depth, truth, self.levels, 1.0, 0.0, 1e-6, 4)
+
+        self.assertEqual(metrics["pixels"], 39)
+        self.assertAlmostEqual(metrics["completeness"], 35 / 39)
+        self.assertAlmostEqual(metrics["within_tolerance"], 35 / 39)
+        self.assertEqual(metrics["depth_rmse"], 0)
+
+    def test_focus_index_accuracy(self):
+        truth = np.full((2, 5), 1.1)
+        depth = np.array([[1.1, 1.1, 1.2, 1.3, 1.0], [1.1, 1.1, 1.1, 1.1, 1.1]])
+
+        metrics, _ = evaluate.EvaluateDepth(depth, truth, self.levels, 1.0, 0.0, 1e-6, 4)
+
+        self.assertAlmostEqual(metrics["focus_index_accuracy"], 7 / 10)
+        self.assertAlmostEqual(metrics["focus_index_within_one"], 9 / 10)
+
+    def test_single_level_has_no_focus_index(self):
+        metrics, _ = evaluate.EvaluateDepth(self.truth, self.truth, self.levels[:1], 1.0, 0.0, 1e-6, 4)
+
+        self.assertNotIn("focus_index_accuracy", metrics)
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            evaluate.EvaluateDepth(self.truth[:, :4], self.truth, self.levels, 1.0, 0.0, 1e-6, 4)
+
+
+class EvaluateNormalsTest(unittest.TestCase):
+
+    def test_angles(self):
+        truth = np.zeros((2, 2, 3))
+        truth[..., 2] = 1
+        truth[1, 1] = 0
+
+        normal = truth.copy()
+        normal[0, 1] = [0, np.sin(np.radians(10)), np.cos(np.radians(10))]
+        normal[1, 0] = 0
+
+        metrics, _ = evaluate.EvaluateNormals(normal, truth, 5.0, 2)
+
+        self.assertAlmostEqual(metrics["normal_mean_angle"], 5.0, places=4)
+        self.assertAlmostEqual(metrics["normal_within_angle"], 1 / 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+Tests of RTI coefficient fitting and .lp light lookup
+"""
+
+import argparse
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import standin  # noqa: F401 (puts tools/ on the path)
+import BlenderSFFRTI
+import fit_rti
+import sffrti_io
+
+
+def DomeDirections(numLights, seed=0):
+    """
+    Returns random unit light directions on the upper hemisphere
+    """
+
+    rng = np.random.default_rng(seed)
+    azimuth = rng.uniform(0, 2 * np.pi, numLights)
+    elevation = rng.uniform(np.radians(15), np.radians(85), numLights)
+
+    return np.column_stack([np.cos(elevation) * np.cos(azimuth),
+                            np.cos(elevation) * np.sin(azimuth),
+                            np.sin(elevation)])
+
+
+class BasisTest(unittest.TestCase):
+
+    def test_matches_addon(self):
+        positions = DomeDirections(20) * 3.0
+        directions = positions / np.linalg.norm(positions, axis=1, keepdims=True)
+
+        np.testing.assert_allclose(fit_rti.PTMBasis(directions), BlenderSFFRTI.RTIBasis(positions, 'PTM'))
+        np.testing.assert_allclose(fit_rti.HSHBasis(directions, 2), BlenderSFFRTI.RTIBasis(positions, 'HSH2'))
+        np.testing.assert_allclose(fit_rti.HSHBasis(directions, 3), BlenderSFFRTI.RTIBasis(positions, 'HSH3'))
+
+
+class FitCoefficientsTest(unittest.TestCase):
+
+    def RoundTrip(self, basisName, order):
+        directions = DomeDirections(24)
+        basis = fit_rti.BASES[basisName](directions, order)
+        height, width = 5, 7
+
+        rng = np.random.default_rng(1)
+        coefficients = rng.normal(size=(height, width, 1, basis.shape[1])).astype(np.float32)
+        stack = np.einsum("lt,hwct->lhw", basis, coefficients).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as folder:
+            stackPath = os.path.join(folder, fit_rti.STACK_NAME)
+            np.save(stackPath, stack)
+
+            args = argparse.Namespace(out=folder, dtype="float32", residual=True, tile_size=4, workers=1)
+            scale, bias = fit_rti.FitCoefficients(args, stackPath, stack.shape, basis)
+
+            fitted = np.load(os.path.join(folder, fit_rti.COEFFICIENTS_NAME))
+            residual = np.load(os.path.join(folder, fit_rti.RESIDUAL_NAME))
+
+        np.testing.assert_allclose(fitted * scale + bias, coefficients, atol=1e-3)
+        self.assertLess(residual.max(), 1e-4)
+
+    def test_ptm_round_trip(self):
+        self.RoundTrip("ptm", None)
+
+    def test_hsh_round_trip(self):
+        self.RoundTrip("hsh", 3)
+
+    def test_quantized_round_trip(self):
+        directions = DomeDirections(12)
+        basis = fit_rti.PTMBasis(directions)
+        coefficients = np.random.default_rng(2).random((4, 4, 1, 6)).astype(np.float32)
+        stack = np.einsum("lt,hwct->lhw", basis, coefficients).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as folder:
+            stackPath = os.path.join(folder, fit_rti.STACK_NAME)
+            np.save(stackPath, stack)
+
+            args = argparse.Namespace(out=folder, dtype="uint8", residual=False, tile_size=4, workers=1)
+            scale, bias = fit_rti.FitCoefficients(args, stackPath, stack.shape, basis)
+
+            stored = np.load(os.path.join(folder, fit_rti.COEFFICIENTS_NAME))
+
+        self.assertEqual(stored.dtype, np.uint8)
+        np.testing.assert_allclose(stored * scale + bias, coefficients, atol=scale.max())
+
+
+class LPFileTest(unittest.TestCase):
+
+    def WriteLP(self, folder, text):
+        path = os.path.join(folder, "lights.lp")
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def test_reads_like_addon(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = self.WriteLP(folder, "3\nimg1 0.1 0.2 0.9\n\nimg2 -0.5 0 0.8\nimg3 0 0.6 0.7\n\n")
+
+            np.testing.assert_array_equal(sffrti_io.ReadLPFile(path), BlenderSFFRTI.ReadLPFile(path))
+
+    def test_count_mismatch(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = self.WriteLP(folder, "3\nimg1 0.1 0.2 0.9\nimg2 -0.5 0 0.8\n")
+
+            with self.assertRaises(ValueError):
+                sffrti_io.ReadLPFile(path)
+
+    def test_missing_count(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = self.WriteLP(folder, "img1 0.1 0.2 0.9\n")
+
+            with self.assertRaises(ValueError):
+                sffrti_io.ReadLPFile(path)
+
+
+class SelectLPPositionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.positions = np.arange(15, dtype=np.float64).reshape(5, 3)
+
+    def test_indexes_light_subset(self):
+        np.testing.assert_array_equal(fit_rti.SelectLPPositions(self.positions, [4, 1, 2]), self.positions[[3, 0, 1]])
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            fit_rti.SelectLPPositions(self.positions, [1, 6])
+
+    def test_plans_without_light_numbers(self):
+        np.testing.assert_array_equal(fit_rti.SelectLPPositions(self.positions, [0] * 5), self.positions)
+
+        with self.assertRaises(ValueError):
+            fit_rti.SelectLPPositions(self.positions, [0] * 3)
+
+
+class LightNumbersTest(unittest.TestCase):
+
+    def test_plan_holds_lp_numbers_of_light_subset(self):
+        with tempfile.TemporaryDirectory() as folder:
+            scene = standin.BuildAcquisition(folder, numLights=10, numLevels=2, subsetSize=7)
+
+            subset = np.array(scene.rti_tool.light_subset)
+            self.assertEqual(len(subset), 7)
+
+            plan = BlenderSFFRTI.GetAcquisitionPlan(scene)
+            np.testing.assert_array_equal(plan["light"], np.tile(subset + 1, 2))
+            # Downstream tools read the light numbers back from both plan files
+            self.assertEqual(standin.bpy.ops.files.create_csv(), {'FINISHED'})
+            np.testing.assert_array_equal(sffrti_io.LoadPlan(folder)["light"], plan["light"])
+            os.remove(os.path.join(folder, "Image.npy"))
+            np.testing.assert_array_equal(sffrti_io.LoadPlan(folder)["light"], plan["light"])
+
+            # The .lp rows of the subset are the lights the add-on placed
+            lpPositions = sffrti_io.ReadLPFile(os.path.join(folder, "lights.lp"))
+            selected = fit_rti.SelectLPPositions(lpPositions, plan["light"][:7])
+            np.testing.assert_allclose(BlenderSFFRTI.ProjectToDome(selected, 1.0), scene.rti_tool.light_positions)
+
+
+if __name__ == "__main__":
+    unittest.main()
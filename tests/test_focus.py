@@ -0,0 +1,149 @@
+"""
+Tests of focus level planning from depth of field and from surface density
+"""
+
+import math
+import unittest
+
+import numpy as np
+
+from standin import addon
+
+
+def DepthOfField(distance, fstop, lens, coc):
+    """
+    Returns the thin lens near and far limits of focus for a focus distance
+    """
+
+    u, k = 1 / distance, fstop * coc / lens
+    g = 1 / lens - u
+
+    return 1 / (u + k * g), (1 / (u - k * g) if u > k * g else math.inf)
+
+
+# 50 mm lens and 30 um circle of confusion, in meters
+LENS = 0.05
+COC = 0.00003
+
+
+class PlanFocusDistancesTest(unittest.TestCase):
+
+    def test_fixed_fstop_covers_range_with_overlap(self):
+        near, far, overlap = 0.9, 1.1, 0.2
+
+        distances, fstops = addon.PlanFocusDistances(near, far, LENS, COC, overlap, fstop=4.0)
+        limits = [DepthOfField(distance, 4.0, LENS, COC) for distance in distances.tolist()]
+
+        np.testing.assert_array_equal(fstops, 4.0)
+        self.assertTrue((np.diff(distances) > 0).all())
+        self.assertAlmostEqual(limits[0][0], near)
+        self.assertGreaterEqual(limits[-1][1], far - 1e-12)
+
+        for (previousNear, previousFar), (nextNear, _) in zip(limits, limits[1:]):
+            # Neighbouring levels share the overlap fraction of a level's depth of field, in reciprocal distance
+            self.assertAlmostEqual(1 / nextNear - 1 / previousFar, overlap * (1 / previousNear - 1 / previousFar))
+
+        # The fewest levels are used, so the second to last level doesn't reach the far end yet
+        if len(limits) > 1:
+            self.assertLess(limits[-2][1], far)
+
+    def test_per_level_fstops_split_range(self):
+        near, far = 0.9, 1.1
+
+        distances, fstops = addon.PlanFocusDistances(near, far, LENS, COC, 0.0, numLevels=5)
+        limits = [DepthOfField(distance, fstop, LENS, COC) for distance, fstop in zip(distances.tolist(), fstops.tolist())]
+
+        self.assertEqual(len(distances), 5)
+        self.assertAlmostEqual(limits[0][0], near)
+        self.assertAlmostEqual(limits[-1][1], far)
+
+        for (_, previousFar), (nextNear, _) in zip(limits, limits[1:]):
+            self.assertAlmostEqual(previousFar, nextNear)
+
+    def test_rejects_impossible_settings(self):
+        with self.assertRaises(ValueError):
+            addon.PlanFocusDistances(0.01, 1.0, LENS, COC, 0.0, fstop=4.0)
+
+        with self.assertRaises(ValueError):
+            addon.PlanFocusDistances(0.9, 1.1, LENS, 0.05, 0.0, fstop=4.0)
+
+
+class PlanFocusPlanesTest(unittest.TestCase):
+
+    def test_fixed_fstop_covers_heights_top_down(self):
+        minZ, maxZ, focusDistance, overlap = -0.05, 0.05, 1.0, 0.1
+
+        planes, fstops = addon.PlanFocusPlanes(minZ, maxZ, focusDistance, LENS, COC, overlap, fstop=2.8)
+        near, far = DepthOfField(focusDistance, 2.8, LENS, COC)
+
+        # The camera sits focusDistance above every focus plane
+        tops = planes + focusDistance - near
+        bottoms = planes + focusDistance - far
+
+        np.testing.assert_array_equal(fstops, 2.8)
+        self.assertTrue((np.diff(planes) < 0).all())
+        self.assertAlmostEqual(tops[0], maxZ)
+        self.assertLessEqual(bottoms[-1], minZ + 1e-12)
+        np.testing.assert_allclose(bottoms[:-1] - tops[1:], -overlap * (far - near))
+
+    def test_per_level_fstop_spans_heights(self):
+        minZ, maxZ, focusDistance = -0.05, 0.05, 1.0
+
+        planes, fstops = addon.PlanFocusPlanes(minZ, maxZ, focusDistance, LENS, COC, 0.0, numLevels=4)
+        near, far = DepthOfField(focusDistance, fstops[0], LENS, COC)
+
+        self.assertEqual(len(planes), 4)
+        self.assertTrue((fstops == fstops[0]).all())
+        self.assertAlmostEqual(planes[0] + focusDistance - near, maxZ)
+        self.assertAlmostEqual(planes[-1] + focusDistance - far, minZ)
+
+    def test_rejects_focus_inside_lens(self):
+        with self.assertRaises(ValueError):
+            addon.PlanFocusPlanes(0.0, 0.1, 0.01, LENS, COC, 0.0, fstop=2.8)
+
+
+class PlaceDensityFocusLevelsTest(unittest.TestCase):
+
+    def assertCovered(self, levels, edges, counts, spacing):
+        centers = (edges[:-1] + edges[1:]) / 2
+        for center in centers[np.asarray(counts) > 0].tolist():
+            self.assertLessEqual(min(abs(center - level) for level in levels), spacing / 2 + 1e-9)
+
+    def test_uniform_density_covers_range(self):
+        edges = np.linspace(0.0, 1.0, 41)
+        counts = np.full(40, 10)
+
+        levels = addon.PlaceDensityFocusLevels(edges, counts, 0.25)
+
+        self.assertEqual(len(levels), 4)
+        self.assertTrue((np.diff(levels) > 0).all())
+        self.assertCovered(levels, edges, counts, 0.25)
+
+    def test_skips_empty_heights(self):
+        edges = np.linspace(0.0, 1.0, 41)
+        counts = np.zeros(40)
+        counts[:4] = 10
+        counts[-4:] = 10
+
+        levels = addon.PlaceDensityFocusLevels(edges, counts, 0.1)
+
+        self.assertCovered(levels, edges, counts, 0.1)
+        self.assertFalse(any(0.2 < level < 0.8 for level in levels))
+
+    def test_full_threshold_keeps_densest_bins(self):
+        edges = np.linspace(0.0, 1.0, 11)
+
+        self.assertEqual(len(addon.PlaceDensityFocusLevels(edges, np.full(10, 5), 0.25, threshold=1.0)), 4)
+
+        counts = np.array([1, 1, 1, 1, 20, 20, 1, 1, 1, 1])
+        levels = addon.PlaceDensityFocusLevels(edges, counts, 0.25, threshold=1.0)
+        self.assertEqual(len(levels), 1)
+        self.assertAlmostEqual(levels[0], 0.5)
+
+    def test_rejects_empty_histogram(self):
+        with self.assertRaises(ValueError):
+            addon.PlaceDensityFocusLevels(np.linspace(0.0, 1.0, 11), np.zeros(10), 0.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+"""
+Tests of scene input hashing and the content-addressed frame cache
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+import standin
+from standin import addon, bpy, BuildAcquisition
+
+
+def SceneDigest(folder):
+    """
+    Returns the input digest of the test acquisition as a hex string
+    """
+
+    return addon.HashSceneInputs(BuildAcquisition(folder)).hex()
+
+
+class HashSceneInputsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.scene = BuildAcquisition(self.folder.name)
+        self.digest = addon.HashSceneInputs(self.scene)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    @unittest.skipIf(standin.IN_BLENDER, "needs a plain Python interpreter to start")
+    def test_stable_across_runs(self):
+        for seed in ("1", "2"):
+            with tempfile.TemporaryDirectory() as folder:
+                output = subprocess.run([sys.executable, "-c", "import sys, test_frame_cache; print(test_frame_cache.SceneDigest(sys.argv[1]))", folder],
+                                        cwd=standin.TESTS_DIR, env=dict(os.environ, PYTHONHASHSEED=seed),
+                                        stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+            self.assertEqual(output.split()[-1], self.digest.hex())
+
+    def test_ignores_output_folder(self):
+        with tempfile.TemporaryDirectory() as folder:
+            addon.SetOutputFolder(self.scene, folder)
+
+            self.assertTrue(addon.GetOutputFilePaths(self.scene, 1)["image"].startswith(os.path.abspath(folder)))
+            self.assertEqual(addon.HashSceneInputs(self.scene), self.digest)
+
+    def test_changes_with_object_transform(self):
+        self.scene.sff_tool.main_object.location = (0.0, 0.0, 0.01)
+
+        self.assertNotEqual(addon.HashSceneInputs(self.scene), self.digest)
+
+    def test_changes_with_mesh(self):
+        vertices = self.scene.sff_tool.main_object.data.vertices
+        co = np.zeros(len(vertices) * 3, dtype=np.float32)
+        vertices.foreach_set("co", co)
+
+        self.assertNotEqual(addon.HashSceneInputs(self.scene), self.digest)
+
+    def test_changes_with_render_settings(self):
+        self.scene.render.resolution_x += 1
+
+        self.assertNotEqual(addon.HashSceneInputs(self.scene), self.digest)
+
+    def test_changes_with_camera(self):
+        self.scene.sff_tool.camera_height += 0.5
+
+        self.assertNotEqual(addon.HashSceneInputs(self.scene), self.digest)
+
+    def test_changes_with_compositor_value(self):
+        node = next(node for node in self.scene.node_tree.nodes if node.inputs and hasattr(node.inputs[-1], "default_value")
+                    and isinstance(node.inputs[-1].default_value, float))
+        node.inputs[-1].default_value += 1.0
+
+        self.assertNotEqual(addon.HashSceneInputs(self.scene), self.digest)
+
+
+class HashFrameInputsTest(unittest.TestCase):
+
+    def test_frames_with_identical_rows_share_hashes(self):
+        lights = np.array([[0.5, 0.0, 0.5], [0.0, 0.5, 0.5], [0.5, 0.0, 0.5]])
+        plan = addon.BuildAcquisitionPlan(np.arange(1, 4), lights, 0.1, 2.8, 50.0)
+
+        hashes = addon.HashFrameInputs(plan, b"scene")
+
+        self.assertEqual(hashes[0], hashes[2])
+        self.assertNotEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes, addon.HashFrameInputs(plan, b"other scene"))
+
+
+class FrameCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.cacheDir = os.path.join(self.folder.name, "cache")
+        addon._frameCacheBytes.clear()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def WriteOutputs(self, paths, contents=b"pixels"):
+        for path in paths.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(contents)
+
+
+class CacheTest(FrameCacheTestCase):
+
+    def OutputPaths(self, name):
+        return {"image": os.path.join(self.folder.name, name, "Image.png"),
+                "Depth/Z": os.path.join(self.folder.name, name, "Depth.exr")}
+
+    def test_store_and_restore(self):
+        paths = self.OutputPaths("rendered")
+        self.WriteOutputs(paths)
+
+        self.assertEqual(addon.CacheStore(self.cacheDir, "ab" * 32, paths), 2 * len(b"pixels"))
+        self.assertEqual(addon.CacheStore(self.cacheDir, "ab" * 32, paths), 0)
+
+        restored = self.OutputPaths("restored")
+        self.assertTrue(addon.CacheRestore(self.cacheDir, "ab" * 32, restored))
+        for path in restored.values():
+            with open(path, 'rb') as file:
+                self.assertEqual(file.read(), b"pixels")
+
+        self.assertFalse(addon.CacheRestore(self.cacheDir, "cd" * 32, restored))
+        self.assertFalse(addon.CacheRestore(self.cacheDir, "ab" * 32, dict(restored, Normal=restored["image"])))
+
+    def test_evicts_least_recently_used(self):
+        paths = self.OutputPaths("rendered")
+        self.WriteOutputs(paths)
+
+        hashes = ["aa" * 32, "bb" * 32, "cc" * 32]
+        for age, frameHash in zip((300, 200, 100), hashes):
+            entryBytes = addon.CacheStore(self.cacheDir, frameHash, paths)
+            entry = addon.GetFrameCacheEntry(self.cacheDir, frameHash)
+            os.utime(entry, (os.path.getmtime(entry) - age,) * 2)
+
+        # Looking up the oldest entry makes it the most recently used one
+        self.assertIsNotNone(addon.CacheLookup(self.cacheDir, hashes[0]))
+
+        self.assertEqual(addon.CacheEvict(self.cacheDir, 2 * entryBytes), 2 * entryBytes)
+        self.assertEqual(addon._frameCacheBytes[self.cacheDir], 2 * entryBytes)
+        self.assertEqual([os.path.isdir(addon.GetFrameCacheEntry(self.cacheDir, frameHash)) for frameHash in hashes], [True, False, True])
+
+        self.assertEqual(addon.CacheEvict(self.cacheDir, entryBytes), entryBytes)
+        self.assertEqual([os.path.isdir(addon.GetFrameCacheEntry(self.cacheDir, frameHash)) for frameHash in hashes], [True, False, False])
+
+    def test_missing_cache(self):
+        self.assertEqual(addon.CacheEvict(self.cacheDir, 0), 0)
+        self.assertEqual(addon._frameCacheBytes[self.cacheDir], 0)
+
+
+class CachedRenderTest(FrameCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.scene = BuildAcquisition(os.path.join(self.folder.name, "output"))
+        filetool = self.scene.file_tool
+        filetool.use_frame_cache = True
+        filetool.frame_cache_path = self.cacheDir
+        filetool.write_render_manifest = True
+
+    def Render(self, frames):
+        """
+        Writes the outputs of the given frames and runs the render_write
+        handlers the way a render does
+        """
+
+        addon.FrameCacheRenderInitHandler(self.scene)
+        for frame in frames:
+            self.scene.frame_current = frame
+            self.WriteOutputs(addon.GetOutputFilePaths(self.scene, frame), "frame {0}".format(frame).encode())
+            addon.ManifestRenderWriteHandler(self.scene)
+            addon.FrameCacheRenderWriteHandler(self.scene)
+
+    def test_restores_frames_into_new_output_folder(self):
+        frames = addon.GetAcquisitionPlan(self.scene)["frame"].tolist()
+
+        self.assertEqual(bpy.ops.files.plan_render(), {'FINISHED'})
+        self.Render(frames)
+
+        # Rendering the same scene to another folder takes every frame from the cache
+        newFolder = os.path.join(self.folder.name, "copy")
+        addon.SetOutputFolder(self.scene, newFolder)
+        self.assertEqual(bpy.ops.files.plan_render(), {'FINISHED'})
+
+        records = addon.ReadRenderManifest(addon.GetManifestPath(self.scene))
+
+        self.assertEqual(sorted(records), frames)
+        for frame in frames:
+            self.assertIn("cached_from", records[frame])
+            self.assertTrue(addon.IsFrameComplete(self.scene, records[frame]))
+            with open(records[frame]["outputs"]["image"], 'rb') as file:
+                self.assertEqual(file.read(), "frame {0}".format(frame).encode())
+
+    def test_fills_in_duplicate_frames(self):
+        hashes = ["aa" * 32, "bb" * 32, "aa" * 32, "cc" * 32]
+        self.scene[addon.FRAME_HASHES_KEY] = {"frames": [1, 2, 3, 4], "hashes": hashes}
+        addon.IndexFrameHashes(self.scene)
+
+        self.Render([1])
+
+        records = addon.ReadRenderManifest(addon.GetManifestPath(self.scene))
+
+        self.assertEqual(sorted(records), [1, 3])
+        self.assertEqual(records[3]["cached_from"], hashes[0])
+        self.assertTrue(os.path.isfile(addon.GetOutputFilePaths(self.scene, 3)["image"]))
+        self.assertFalse(os.path.isfile(addon.GetOutputFilePaths(self.scene, 2)["image"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Tests of the frame sharding helpers of the render launcher
+"""
+
+import argparse
+import os
+import tempfile
+import unittest
+
+import standin  # noqa: F401 (puts tools/ on the path)
+import launch_render
+import sffrti_io
+
+
+def WriteManifest(filepath, frames, **fields):
+    """
+    Writes a manifest with a record for each of the given frames
+    """
+
+    sffrti_io.WriteRenderManifest(filepath, {frame: dict(fields, frame=frame, outputs={}) for frame in frames})
+
+
+class FrameRangeArgumentTest(unittest.TestCase):
+
+    def test_compacts_runs(self):
+        self.assertEqual(sffrti_io.FrameRangeArgument([1, 2, 3, 7]), "1..3,7")
+        self.assertEqual(sffrti_io.FrameRangeArgument([9, 4, 5, 4, 11, 10]), "4..5,9..11")
+        self.assertEqual(sffrti_io.FrameRangeArgument([5]), "5")
+        self.assertEqual(sffrti_io.FrameRangeArgument(range(1, 101)), "1..100")
+
+
+class ChunkFramesTest(unittest.TestCase):
+
+    def test_splits_in_order(self):
+        self.assertEqual(launch_render.ChunkFrames(list(range(1, 8)), 3), [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual(launch_render.ChunkFrames([], 3), [])
+
+
+class ShardManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.args = argparse.Namespace(output=self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def ShardPath(self, shardId):
+        return launch_render.GetShardManifestPath(self.folder.name, shardId)
+
+
+class StealFramesTest(ShardManifestTestCase):
+
+    def test_splits_busiest_shard(self):
+        small = launch_render.Shard(0, range(1, 5), self.ShardPath(0), None)
+        busy = launch_render.Shard(1, range(5, 17), self.ShardPath(1), None)
+        WriteManifest(busy.manifestPath, [5, 6, 7, 8])
+
+        stolen = launch_render.StealFrames([small, busy], 2)
+
+        # Eight frames are left, the second half moves to the new shard
+        self.assertEqual(stolen, [13, 14, 15, 16])
+        self.assertEqual(busy.frames, list(range(5, 13)))
+        self.assertEqual(small.frames, [1, 2, 3, 4])
+
+    def test_keeps_small_shards(self):
+        shard = launch_render.Shard(0, range(1, 6), self.ShardPath(0), None)
+        WriteManifest(shard.manifestPath, [1, 2])
+
+        self.assertIsNone(launch_render.StealFrames([shard], 2))
+        self.assertIsNone(launch_render.StealFrames([], 2))
+        self.assertEqual(shard.frames, [1, 2, 3, 4, 5])
+
+
+class MergeManifestsTest(ShardManifestTestCase):
+
+    def test_merges_shards_into_main_manifest(self):
+        mainPath = os.path.join(self.folder.name, sffrti_io.RENDER_MANIFEST_NAME)
+        WriteManifest(mainPath, [1, 2])
+        WriteManifest(self.ShardPath(0), [3, 4], render_time=1.0)
+        WriteManifest(self.ShardPath(1), [2, 5], render_time=2.0)
+        WriteManifest(self.ShardPath(2), [6], synthetic_source=True)
+
+        shardPaths = launch_render.FindShardManifests(self.folder.name)
+        done = launch_render.MergeManifests(self.args, shardPaths)
+
+        self.assertEqual(shardPaths, [self.ShardPath(shardId) for shardId in range(3)])
+        self.assertEqual(done, {1, 2, 3, 4, 5, 6})
+        self.assertEqual(launch_render.FindShardManifests(self.folder.name), [])
+
+        records = sffrti_io.ReadRenderManifest(mainPath)
+        self.assertEqual(sorted(records), [1, 2, 3, 4, 5])
+        self.assertEqual(records[2]["render_time"], 2.0)
+        self.assertEqual(launch_render.ReadFinishedFrames(mainPath), done)
+
+    def test_restart_merges_leftover_shards(self):
+        # An interrupted launcher left shard manifests without merging them
+        WriteManifest(self.ShardPath(0), [1, 2, 3])
+        WriteManifest(self.ShardPath(3), [4])
+
+        exitCode = launch_render.main(["scene.blend", "--output", self.folder.name, "--start", "1", "--end", "4"])
+
+        self.assertEqual(exitCode, 0)
+        self.assertEqual(launch_render.FindShardManifests(self.folder.name), [])
+        self.assertEqual(launch_render.ReadFinishedFrames(os.path.join(self.folder.name, sffrti_io.RENDER_MANIFEST_NAME)),
+                         {1, 2, 3, 4})
+
+
+if __name__ == "__main__":
+    unittest.main()
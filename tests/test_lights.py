@@ -0,0 +1,159 @@
+"""
+Tests of reading light positions, placing them on the dome, and planning
+light subsets
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from standin import addon, bpy, BuildAcquisition
+
+
+def DomePositions(numLights, seed=0):
+    """
+    Returns light positions spread over the upper hemisphere
+    """
+
+    directions = np.random.default_rng(seed).normal(size=(numLights, 3))
+    directions[:, 2] = np.abs(directions[:, 2]) + 0.05
+
+    return directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+class ReadLPFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def WriteLP(self, text):
+        filepath = os.path.join(self.folder.name, "lights.lp")
+        with open(filepath, 'w') as file:
+            file.write(text)
+
+        return filepath
+
+    def test_reads_directions(self):
+        filepath = self.WriteLP("3\n"
+                                "img_000.png 0.5 -0.5 0.7071\n"
+                                "img_001.png -0.25 0.1 0.96\n"
+                                "img_002.png 0 0 1\n")
+
+        np.testing.assert_array_equal(addon.ReadLPFile(filepath),
+                                      [[0.5, -0.5, 0.7071], [-0.25, 0.1, 0.96], [0.0, 0.0, 1.0]])
+
+    def test_rejects_count_mismatch(self):
+        with self.assertRaises(ValueError):
+            addon.ReadLPFile(self.WriteLP("4\nimg_000.png 0 0 1\nimg_001.png 1 0 1\n"))
+
+    def test_rejects_missing_count(self):
+        for header in ("", "img_000.png 0 0 1\n", "0\n"):
+            with self.assertRaises(ValueError):
+                addon.ReadLPFile(self.WriteLP(header + "img_000.png 0 0 1\n"))
+
+    def test_ignores_blank_and_trailing_lines(self):
+        filepath = self.WriteLP("2\n"
+                                "\n"
+                                "img_000.png 1 0 1\n"
+                                "   \n"
+                                "img_001.png 0 1 1\n"
+                                "\n"
+                                "notes written after the lights\n")
+
+        np.testing.assert_array_equal(addon.ReadLPFile(filepath), [[1.0, 0.0, 1.0], [0.0, 1.0, 1.0]])
+
+    def test_keeps_zenith_light(self):
+        positions = addon.ReadLPFile(self.WriteLP("1\nimg_000.png 0.0 0.0 1.0\n"))
+
+        np.testing.assert_array_equal(addon.ProjectToDome(positions, 2.0), [[0.0, 0.0, 2.0]])
+
+
+class ProjectToDomeTest(unittest.TestCase):
+
+    def test_keeps_directions_at_radius(self):
+        positions = np.array([[1.0, 0.0, 0.0], [0.0, 3.0, 4.0], [-2.0, 2.0, 1.0]])
+
+        projected = addon.ProjectToDome(positions, 2.5)
+
+        np.testing.assert_allclose(np.linalg.norm(projected, axis=1), 2.5)
+        np.testing.assert_allclose(projected / 2.5, positions / np.linalg.norm(positions, axis=1, keepdims=True))
+
+    def test_rejects_light_at_origin(self):
+        with self.assertRaises(ValueError):
+            addon.ProjectToDome([[0.0, 0.0, 1.0], [0.0, 0.0, 0.0]], 1.0)
+
+
+class SelectLightSubsetTest(unittest.TestCase):
+
+    def test_selects_distinct_lights(self):
+        positions = DomePositions(60)
+
+        for criterion in ('Conditioning', 'Coverage'):
+            order, errors = addon.SelectLightSubset(positions, 20, 'PTM', criterion)
+
+            self.assertEqual(len(order), 20)
+            self.assertEqual(len(set(order.tolist())), 20)
+            self.assertEqual(len(errors), 20)
+
+    def test_errors_are_finite_once_basis_is_determined(self):
+        positions = DomePositions(60)
+
+        for basis, numTerms in (('PTM', 6), ('HSH2', 4), ('HSH3', 9)):
+            _, errors = addon.SelectLightSubset(positions, 20, basis)
+
+            self.assertTrue(np.isinf(errors[:numTerms - 1]).all())
+            self.assertTrue(np.isfinite(errors[numTerms - 1:]).all())
+
+            # Adding a light never increases the prediction variance
+            self.assertTrue((np.diff(errors[numTerms - 1:]) <= 1e-9).all())
+
+    def test_coverage_starts_overhead(self):
+        positions = DomePositions(40)
+        positions[17] = (0.0, 0.0, 1.0)
+
+        order, _ = addon.SelectLightSubset(positions, 5, 'PTM', 'Coverage')
+
+        self.assertEqual(order[0], 17)
+
+    def test_clamps_to_available_lights(self):
+        order, errors = addon.SelectLightSubset(DomePositions(8), 20)
+
+        self.assertEqual(sorted(order.tolist()), list(range(8)))
+        self.assertEqual(len(errors), 8)
+
+
+class LightSubsetStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_plan_reports_errors(self):
+        scene = BuildAcquisition(self.folder.name, numLights=12)
+        scene.rti_tool.subset_size = 8
+
+        self.assertEqual(bpy.ops.rti.plan_light_subset(), {'FINISHED'})
+
+        self.assertEqual(len(scene.rti_tool.light_subset), 8)
+        self.assertEqual(scene.rti_tool.subset_errors[-1][0], 12)
+
+    def test_delete_clears_subset(self):
+        scene = BuildAcquisition(self.folder.name, numLights=12, subsetSize=8)
+        self.assertEqual(bpy.ops.rti.plan_light_subset(), {'FINISHED'})
+
+        self.assertEqual(bpy.ops.rti.delete_rti(), {'FINISHED'})
+
+        self.assertEqual(scene.rti_tool.light_subset, [])
+        self.assertEqual(scene.rti_tool.subset_errors, [])
+        self.assertEqual(scene.rti_tool.light_numbers, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
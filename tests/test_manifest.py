@@ -0,0 +1,134 @@
+"""
+Tests of the crash-safe render manifest and resuming from it
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from standin import addon, ResetScene
+
+
+class ManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.manifestPath = os.path.join(self.folder.name, addon.RENDER_MANIFEST_NAME)
+
+        self.scene = ResetScene()
+        self.scene.file_tool.output_path = self.folder.name
+        self.scene.render.filepath = os.path.join(self.folder.name, "Image-###")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def WriteFrame(self, frame, contents=b"rendered pixels"):
+        """
+        Writes a frame's image and returns its manifest record
+        """
+
+        with open(self.scene.render.frame_path(frame=frame), 'wb') as file:
+            file.write(contents)
+
+        return addon.BuildManifestRecord(self.scene, frame, 1.0)
+
+
+class ReadRenderManifestTest(ManifestTestCase):
+
+    def test_skips_truncated_last_line(self):
+        for frame in (1, 2):
+            addon.AppendManifestRecord(self.manifestPath, self.WriteFrame(frame))
+
+        # A crash while appending leaves part of a line behind
+        line = json.dumps(self.WriteFrame(3))
+        with open(self.manifestPath, 'a') as file:
+            file.write(line[:len(line) // 2])
+
+        self.assertEqual(sorted(addon.ReadRenderManifest(self.manifestPath)), [1, 2])
+
+    def test_latest_record_wins(self):
+        addon.AppendManifestRecord(self.manifestPath, dict(self.WriteFrame(1), render_time=1.0))
+        addon.AppendManifestRecord(self.manifestPath, dict(self.WriteFrame(1), render_time=2.0))
+        addon.AppendManifestRecord(self.manifestPath, self.WriteFrame(2))
+        addon.AppendManifestRecord(self.manifestPath, {"frame": 2, "invalidated": True})
+
+        records = addon.ReadRenderManifest(self.manifestPath)
+
+        self.assertEqual(list(records), [1])
+        self.assertEqual(records[1]["render_time"], 2.0)
+
+    def test_separates_synthetic_sources(self):
+        addon.AppendManifestRecord(self.manifestPath, dict(self.WriteFrame(1), synthetic_source=True))
+        addon.AppendManifestRecord(self.manifestPath, self.WriteFrame(2))
+
+        self.assertEqual(list(addon.ReadRenderManifest(self.manifestPath)), [2])
+        self.assertEqual(list(addon.ReadRenderManifest(self.manifestPath, syntheticSource=True)), [1])
+
+    def test_missing_manifest(self):
+        self.assertEqual(addon.ReadRenderManifest(self.manifestPath), {})
+
+
+class IsFrameCompleteTest(ManifestTestCase):
+
+    def test_complete_frame(self):
+        record = self.WriteFrame(1)
+
+        self.assertEqual(record["bytes"], {"image": len(b"rendered pixels")})
+        self.assertTrue(addon.IsFrameComplete(self.scene, record))
+
+    def test_size_mismatch(self):
+        record = self.WriteFrame(1)
+        self.WriteFrame(1, b"partially")
+
+        self.assertFalse(addon.IsFrameComplete(self.scene, record))
+
+    def test_checksum_mismatch(self):
+        record = self.WriteFrame(1)
+        self.WriteFrame(1, b"Rendered pixels")
+
+        self.assertFalse(addon.IsFrameComplete(self.scene, record))
+
+    def test_missing_output(self):
+        record = self.WriteFrame(1)
+        os.remove(record["outputs"]["image"])
+
+        self.assertFalse(addon.IsFrameComplete(self.scene, record))
+
+    def test_output_moved(self):
+        record = self.WriteFrame(1)
+        self.scene.render.filepath = os.path.join(self.folder.name, "Other-###")
+        self.WriteFrame(1)
+
+        self.assertFalse(addon.IsFrameComplete(self.scene, record))
+
+
+class GetManifestPathTest(ManifestTestCase):
+
+    def tearDown(self):
+        os.environ.pop("SFFRTI_MANIFEST_PATH", None)
+        super().tearDown()
+
+    def test_defaults_to_output_folder(self):
+        os.environ.pop("SFFRTI_MANIFEST_PATH", None)
+
+        self.assertEqual(os.path.normpath(addon.GetManifestPath(self.scene)), os.path.normpath(self.manifestPath))
+
+    def test_environment_override(self):
+        shardPath = os.path.join(self.folder.name, "shards", "Render Manifest 2.jsonl")
+        os.environ["SFFRTI_MANIFEST_PATH"] = shardPath
+
+        self.assertEqual(addon.GetManifestPath(self.scene), shardPath)
+
+        os.makedirs(os.path.dirname(shardPath))
+        self.scene.file_tool.write_render_manifest = True
+        self.scene.frame_current = 4
+        self.WriteFrame(4)
+        addon.ManifestRenderWriteHandler(self.scene)
+
+        self.assertEqual(list(addon.ReadRenderManifest(shardPath)), [4])
+        self.assertFalse(os.path.exists(self.manifestPath))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Tests of shape-from-focus reconstruction on synthetic focus stacks
+"""
+
+import argparse
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import standin  # noqa: F401 (puts tools/ on the path)
+import reconstruct_sff
+import sffrti_io
+
+
+def SyntheticStack(levelPeaks, numLevels, seed=0):
+    """
+    Returns a focus stack of a random texture whose contrast falls off as a
+    Gaussian of the distance from every pixel's peak level
+    """
+
+    texture = np.random.default_rng(seed).random(levelPeaks.shape).astype(np.float32)
+    levels = np.arange(numLevels, dtype=np.float32)[:, np.newaxis, np.newaxis]
+
+    return texture * np.exp(-(levels - levelPeaks) ** 2 / 2).astype(np.float32)
+
+
+class BoxSumTest(unittest.TestCase):
+
+    def test_matches_window_sums(self):
+        image = np.random.default_rng(0).random((9, 12)).astype(np.float32)
+        padded = np.pad(image, 2)
+
+        expected = np.array([[padded[y:y + 5, x:x + 5].sum() for x in range(12)] for y in range(9)])
+
+        np.testing.assert_allclose(reconstruct_sff.BoxSum(image, 5), expected, rtol=1e-5)
+
+
+class FocusMeasureTest(unittest.TestCase):
+
+    def test_laplacian_of_parabola(self):
+        x = np.arange(20, dtype=np.float32)
+        image = np.tile(x * x, (15, 1))
+
+        for step in (1, 2, 3):
+            result = reconstruct_sff.ModifiedLaplacian(image, step)
+
+            np.testing.assert_allclose(result[step:-step, step:-step], 2 * step * step)
+            self.assertTrue((result[:step] == 0).all() and (result[:, -step:] == 0).all())
+
+    def test_tenengrad_of_ramp(self):
+        y = np.arange(15, dtype=np.float32)
+        image = np.tile(3 * y[:, np.newaxis], (1, 20))
+
+        for step in (1, 2, 3):
+            result = reconstruct_sff.Tenengrad(image, step)
+
+            # The Sobel weights sum to 4 on each side of the center, which are 2 * step apart
+            np.testing.assert_allclose(result[step:-step, step:-step], (4 * 3 * 2 * step) ** 2)
+            self.assertTrue((result[:step] == 0).all() and (result[:, -step:] == 0).all())
+
+
+class InterpolatePeakTest(unittest.TestCase):
+
+    def test_gaussian_peak(self):
+        peaks = np.array([-0.4, -0.1, 0.0, 0.25, 0.45])
+        left, center, right = (np.exp(-(x - peaks) ** 2 / (2 * 0.8 ** 2)) for x in (-1, 0, 1))
+
+        np.testing.assert_allclose(reconstruct_sff.InterpolatePeak(left, center, right), peaks, atol=1e-6)
+
+    def test_parabolic_peak(self):
+        peaks = np.array([-0.3, 0.0, 0.2])
+        left, center, right = (5 - (x - peaks) ** 2 for x in (-1, 0, 1))
+
+        np.testing.assert_allclose(reconstruct_sff.InterpolatePeak(left, center, right, gaussian=False), peaks, atol=1e-6)
+
+    def test_flat_and_clipped(self):
+        offset = reconstruct_sff.InterpolatePeak(np.array([1.0, 0.0, 1.0]), np.array([1.0, 0.0, 2.0]), np.array([1.0, 0.0, 1.9]), gaussian=False)
+
+        self.assertEqual(offset[0], 0.0)
+        self.assertEqual(offset[1], 0.0)
+        self.assertGreater(offset[2], 0.0)
+        self.assertLessEqual(offset[2], 0.5)
+
+
+class ReconstructDepthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+        # The left half peaks between levels 1 and 2, the right half between levels 2 and 3
+        self.levelPeaks = np.full((40, 48), 1.3, dtype=np.float32)
+        self.levelPeaks[:, 24:] = 2.7
+        self.levels = np.array([10.0, 20.0, 30.0, 40.0, 50.0])
+
+        self.stackPath = os.path.join(self.folder.name, reconstruct_sff.STACK_NAME)
+        np.save(self.stackPath, SyntheticStack(self.levelPeaks, len(self.levels)))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def Reconstruct(self, tileSize, measure="laplacian", step=1, interpolation="gaussian"):
+        out = os.path.join(self.folder.name, "tiles-{0}-{1}-{2}".format(tileSize, measure, step))
+        os.makedirs(out)
+
+        args = argparse.Namespace(out=out, measure=measure, window=5, step=step, interpolation=interpolation,
+                                  tile_size=tileSize, workers=2)
+        depthPath, focusPath = reconstruct_sff.ReconstructDepth(args, self.levels, self.stackPath, *self.levelPeaks.shape)
+
+        return np.load(depthPath), np.load(focusPath)
+
+    def test_finds_interpolated_depth(self):
+        for measure in sorted(reconstruct_sff.FOCUS_MEASURES):
+            for step in (1, 2):
+                depth, _ = self.Reconstruct(64, measure, step)
+
+                # Window sums mix both halves near the boundary and the image edges
+                inner = depth[6:-6, 6:18], depth[6:-6, 30:-6]
+                np.testing.assert_allclose(inner[0], 23.0, atol=0.05)
+                np.testing.assert_allclose(inner[1], 37.0, atol=0.05)
+
+    def test_tiles_match_whole_image(self):
+        for measure in sorted(reconstruct_sff.FOCUS_MEASURES):
+            whole = self.Reconstruct(64, measure, 2)
+
+            # Tiles that don't divide the image exercise the halos at every edge
+            for tileSize in (7, 16):
+                tiled = self.Reconstruct(tileSize, measure, 2)
+
+                np.testing.assert_array_equal(tiled[0], whole[0])
+                np.testing.assert_array_equal(tiled[1], whole[1])
+
+
+class GroupFocusLevelsTest(unittest.TestCase):
+
+    def test_groups_frames_on_rounded_z_cam(self):
+        records = {frame: {"frame": frame, "z_cam": zCam, "outputs": {"image": "Image-{0}.png".format(frame)}}
+                   for frame, zCam in ((1, 0.2), (2, 0.2 + 1e-12), (3, 0.1), (4, 0.1), (5, 0.3))}
+
+        with tempfile.TemporaryDirectory() as folder:
+            sffrti_io.WriteRenderManifest(os.path.join(folder, sffrti_io.RENDER_MANIFEST_NAME), records)
+
+            levels, levelRecords = reconstruct_sff.GroupFocusLevels(folder)
+            _, singleLight = reconstruct_sff.GroupFocusLevels(folder, light=1)
+
+        np.testing.assert_array_equal(levels, [0.1, 0.2, 0.3])
+        self.assertEqual([[record["frame"] for record in group] for group in levelRecords], [[3, 4], [1, 2], [5]])
+        self.assertEqual([[record["frame"] for record in group] for group in singleLight], [[4], [2], []])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests of render borders, the pixel rectangles they crop the canvas to, and
+how SetAnimation fits them
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from standin import addon, bpy, BuildAcquisition
+
+
+def BorderRow(border):
+    """
+    Returns a one frame acquisition plan row with the given render border
+    """
+
+    return addon.BuildAcquisitionPlan([1], np.ones((1, 3)), 0.0, 2.8, 50.0, np.array([border]))[0]
+
+
+class GetRenderBorderPixelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.render = bpy.context.scene.render
+        self.saved = (self.render.resolution_x, self.render.resolution_y, self.render.resolution_percentage)
+        self.render.resolution_x, self.render.resolution_y, self.render.resolution_percentage = 400, 200, 50
+
+    def tearDown(self):
+        self.render.resolution_x, self.render.resolution_y, self.render.resolution_percentage = self.saved
+
+    def test_full_frame(self):
+        pixels = addon.GetRenderBorderPixels(bpy.context.scene, BorderRow((0.0, 1.0, 0.0, 1.0)))
+
+        self.assertEqual(pixels, {"x": 0, "y": 0, "width": 200, "height": 100,
+                                  "canvas_width": 200, "canvas_height": 100})
+
+    def test_measures_from_top_left(self):
+        # Bottom left quarter of the canvas in Blender's border coordinates
+        pixels = addon.GetRenderBorderPixels(bpy.context.scene, BorderRow((0.0, 0.5, 0.0, 0.5)))
+
+        self.assertEqual((pixels["x"], pixels["y"], pixels["width"], pixels["height"]), (0, 50, 100, 50))
+
+    def test_truncates_to_whole_pixels(self):
+        pixels = addon.GetRenderBorderPixels(bpy.context.scene, BorderRow((0.1012, 0.6049, 0.2537, 0.7551)))
+
+        # 200 x 100 canvas: x from 20 to 120, y from 25 to 75 measured from the bottom
+        self.assertEqual((pixels["x"], pixels["y"], pixels["width"], pixels["height"]), (20, 25, 100, 50))
+
+
+class PlanBordersTest(unittest.TestCase):
+
+    def test_borders_default_to_full_frame(self):
+        plan = addon.BuildAcquisitionPlan(np.arange(1, 3), np.ones((2, 3)), 0.0, 2.8, 50.0)
+
+        for name, value in zip(addon.BORDER_COLUMNS, (0.0, 1.0, 0.0, 1.0)):
+            np.testing.assert_array_equal(plan[name], value)
+
+    def test_keeps_per_frame_borders(self):
+        borders = np.array([[0.1, 0.9, 0.2, 0.8], [0.3, 0.7, 0.4, 0.6]])
+
+        plan = addon.BuildAcquisitionPlan(np.arange(1, 3), np.ones((2, 3)), 0.0, 2.8, 50.0, borders)
+
+        np.testing.assert_array_equal(np.column_stack([plan[name] for name in addon.BORDER_COLUMNS]), borders)
+
+
+class SetAnimationBordersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.scene = BuildAcquisition(os.path.join(self.folder.name, "output"))
+        self.plan = addon.GetAcquisitionPlan(self.scene).copy()
+        self.camera = self.scene.objects[self.scene.sff_tool.camera_list[0]]
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def assertAnimationKept(self):
+        np.testing.assert_array_equal(addon.GetAcquisitionPlan(self.scene), self.plan)
+        self.assertIsNotNone(self.camera.data.animation_data)
+
+    def test_fits_object(self):
+        self.scene.file_tool.use_roi_border = True
+
+        self.assertEqual(bpy.ops.sffrti.set_animation(), {'FINISHED'})
+
+        plan = addon.GetAcquisitionPlan(self.scene)
+        self.assertLess(plan["border_max_x"][0] - plan["border_min_x"][0], 1)
+
+    def test_missing_object_keeps_animation(self):
+        self.scene.file_tool.use_roi_border = True
+        self.scene.sff_tool.main_object = None
+
+        # Operators that report an error raise it when called from Python
+        with self.assertRaises(RuntimeError):
+            bpy.ops.sffrti.set_animation()
+
+        self.assertAnimationKept()
+
+    def test_object_without_vertices_keeps_animation(self):
+        empty = bpy.data.objects.new("Empty", None)
+        self.scene.collection.objects.link(empty)
+
+        self.scene.file_tool.use_roi_border = True
+        self.scene.sff_tool.main_object = empty
+
+        with self.assertRaises(RuntimeError):
+            bpy.ops.sffrti.set_animation()
+
+        self.assertAnimationKept()
+
+
+if __name__ == "__main__":
+    unittest.main()
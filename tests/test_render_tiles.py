@@ -0,0 +1,122 @@
+"""
+Tests of splitting the canvas into tiles for distributed rendering and
+stitching them back together
+"""
+
+import hashlib
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from standin import addon, bpy
+import render_tiles
+import sffrti_io
+
+
+class SplitCanvasTest(unittest.TestCase):
+
+    def test_cores_cover_canvas_once(self):
+        width, height = 103, 61
+
+        tiles = render_tiles.SplitCanvas(width, height, 4, 3, 8)
+        coverage = np.zeros((height, width), dtype=int)
+        for tile in tiles:
+            x0, y0, x1, y1 = tile.core
+            coverage[y0:y1, x0:x1] += 1
+
+        self.assertEqual(len(tiles), 12)
+        self.assertEqual([tile.tileId for tile in tiles], list(range(12)))
+        self.assertTrue((coverage == 1).all())
+
+    def test_rendered_grows_core_within_canvas(self):
+        width, height, overlap = 103, 61, 8
+
+        for tile in render_tiles.SplitCanvas(width, height, 4, 3, overlap):
+            x0, y0, x1, y1 = tile.core
+
+            self.assertEqual(tile.rendered, (max(x0 - overlap, 0), max(y0 - overlap, 0),
+                                             min(x1 + overlap, width), min(y1 + overlap, height)))
+
+    def test_crop_box_selects_core(self):
+        for tile in render_tiles.SplitCanvas(103, 61, 4, 3, 8):
+            left, top, right, bottom = tile.CropBox()
+            rx0, ry0, rx1, ry1 = tile.rendered
+
+            self.assertEqual((left + rx0, top + ry0, right + rx0, bottom + ry0), tile.core)
+            self.assertTrue(0 <= left <= right <= rx1 - rx0)
+            self.assertTrue(0 <= top <= bottom <= ry1 - ry0)
+
+
+class TileBorderTest(unittest.TestCase):
+
+    def test_truncation_recovers_rendered_pixels(self):
+        for width, height in ((103, 61), (1920, 1080), (7, 5)):
+            for tile in render_tiles.SplitCanvas(width, height, 3, 2, 2):
+                xMin, xMax, yMin, yMax = tile.Border(width, height)
+                x0, y0, x1, y1 = tile.rendered
+
+                self.assertTrue(0.0 <= xMin < xMax <= 1.0 and 0.0 <= yMin < yMax <= 1.0)
+                self.assertEqual((int(xMin * width), int(xMax * width)), (x0, x1))
+                self.assertEqual((int(yMin * height), int(yMax * height)), (height - y1, height - y0))
+
+    def test_matches_add_on_border_pixels(self):
+        render = bpy.context.scene.render
+        saved = (render.resolution_x, render.resolution_y, render.resolution_percentage)
+        render.resolution_x, render.resolution_y, render.resolution_percentage = 103, 61, 100
+
+        try:
+            for tile in render_tiles.SplitCanvas(103, 61, 4, 3, 8):
+                row = addon.BuildAcquisitionPlan([1], np.ones((1, 3)), 0.0, 2.8, 50.0, np.array([tile.Border(103, 61)]))[0]
+                pixels = addon.GetRenderBorderPixels(bpy.context.scene, row)
+
+                self.assertEqual((pixels["x"], pixels["y"], pixels["x"] + pixels["width"], pixels["y"] + pixels["height"]),
+                                 tile.rendered)
+        finally:
+            render.resolution_x, render.resolution_y, render.resolution_percentage = saved
+
+
+class StitchImageTest(unittest.TestCase):
+
+    def test_stitches_tiles_into_canvas(self):
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest("needs Pillow")
+
+        width, height = 53, 31
+        canvas = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        tiles = render_tiles.SplitCanvas(width, height, 3, 2, 4)
+
+        with tempfile.TemporaryDirectory() as folder:
+            tilePaths = []
+            for tile in tiles:
+                x0, y0, x1, y1 = tile.rendered
+                path = os.path.join(folder, "tile-{0}.png".format(tile.tileId))
+                Image.fromarray(canvas[y0:y1, x0:x1]).save(path)
+                tilePaths.append(path)
+
+            outputPath = os.path.join(folder, "stitched.png")
+            render_tiles.StitchImage(tilePaths, tiles, width, height, outputPath)
+
+            with Image.open(outputPath) as image:
+                np.testing.assert_array_equal(np.asarray(image), canvas)
+
+
+class FileChecksumTest(unittest.TestCase):
+
+    def test_matches_add_on(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "data.bin")
+            data = np.random.default_rng(0).bytes(3000)
+            with open(path, 'wb') as file:
+                file.write(data)
+
+            expected = hashlib.sha256(data).hexdigest()
+            self.assertEqual(sffrti_io.FileChecksum(path, blockSize=1024), expected)
+            self.assertEqual(addon.FileChecksum(path), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Tests of writing light-invariant passes once per camera position
+"""
+
+import os
+import tempfile
+import unittest
+
+from standin import addon, bpy, BuildAcquisition
+
+
+class SharedPassTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.scene = BuildAcquisition(self.folder.name, numLights=3, numLevels=2)
+        self.frames = addon.GetAcquisitionPlan(self.scene)["frame"].tolist()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def SharedNodes(self):
+        return [node for node in self.scene.node_tree.nodes if node.get(addon.SHARED_PASS_KEY)]
+
+
+class SharedPassFrameHandlerTest(SharedPassTestCase):
+
+    def test_first_frame_of_every_camera_position_writes(self):
+        self.assertEqual([addon.GetSharedPassFrame(self.scene, frame) for frame in self.frames], [1, 1, 1, 4, 4, 4])
+
+    def test_mutes_file_outputs_only(self):
+        viewLayer = self.scene.view_layers['ViewLayer']
+
+        self.assertEqual(len(self.SharedNodes()), 2)
+
+        for frame in self.frames:
+            self.scene.frame_current = frame
+            addon.SharedPassFrameHandler(self.scene)
+
+            writesShared = frame in (1, 4)
+            self.assertEqual([node.mute for node in self.SharedNodes()], [not writesShared] * 2)
+            self.assertTrue(viewLayer.use_pass_z and viewLayer.use_pass_normal)
+
+            ownPaths = addon.GetOutputFilePaths(self.scene, frame, ownOnly=True)
+            self.assertEqual("Depth" in ownPaths and "Normal" in ownPaths, writesShared)
+
+            # Every frame still lists the shared files it uses
+            self.assertEqual(os.path.basename(addon.GetOutputFilePaths(self.scene, frame)["Depth"]),
+                             "Image{0:04d}.png".format(1 if frame < 4 else 4))
+
+    def test_sharing_disabled(self):
+        self.scene.file_tool.share_invariant_passes = False
+
+        for frame in self.frames:
+            self.scene.frame_current = frame
+            addon.SharedPassFrameHandler(self.scene)
+
+            self.assertEqual(addon.GetSharedPassFrame(self.scene, frame), frame)
+            self.assertFalse(any(node.mute for node in self.SharedNodes()))
+
+
+class MultilayerEXRTest(SharedPassTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.scene.file_tool.output_profile = "EXR"
+        self.assertEqual(bpy.ops.files.set_render(), {'FINISHED'})
+
+    def test_never_shares_passes(self):
+        viewLayer = self.scene.view_layers['ViewLayer']
+
+        self.assertTrue(self.scene.file_tool.share_invariant_passes)
+        self.assertFalse(addon.SharesInvariantPasses(self.scene))
+
+        for frame in self.frames:
+            self.scene.frame_current = frame
+            addon.SharedPassFrameHandler(self.scene)
+
+            self.assertEqual(addon.GetSharedPassFrame(self.scene, frame), frame)
+            self.assertTrue(viewLayer.use_pass_z and viewLayer.use_pass_normal)
+
+    def test_records_list_own_layers(self):
+        frame = self.frames[1]
+        record = addon.BuildManifestRecord(self.scene, frame, 1.0)
+        image = addon.GetOutputFilePaths(self.scene, frame)["image"]
+
+        self.assertEqual(record["layers"], {"Combined": image, "Depth": image, "Normal": image})
+
+
+if __name__ == "__main__":
+    unittest.main()
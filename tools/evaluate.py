@@ -0,0 +1,365 @@
+"""
+Scores reconstructed depth and normal maps against the ground truth Depth
+and Normal passes of a render.
+
+Every run is compared pixel by pixel, and the errors are also summarized
+over square tiles to show where a method fails. Runs are evaluated in
+parallel worker processes, and one summary row per run is written to a CSV
+report. A JSON report additionally holds the per-tile error grids.
+
+Metrics:
+    depth RMSE and mean absolute error over pixels with valid ground truth
+    completeness, the share of those pixels the run reconstructed at all,
+        and the share within --tolerance of the ground truth
+    best focus index accuracy, the share of pixels whose nearest focus level
+        matches the ground truth's, exactly or within one level
+    normal mean and median angular error in degrees, and the share of pixels
+        within --max-angle
+
+Metric ground truth depth comes from multilayer EXR renders or the
+synthetic defocus DepthRaw pass. The PNG Depth pass is normalized, so it
+needs --gt-depth-range to be mapped back to distances. The PNG Normal pass
+clips negative components, so use the EXR output profile for normal ground
+truth.
+
+Reconstructed depth is mapped to ground truth depth as scale * depth +
+offset. Depth maps from reconstruct_sff.py hold focus distances for a
+static camera, which need no mapping. For a moving camera they hold camera
+heights, so use --scale -1 --offset <camera height + focus distance> of
+the ground truth frame.
+
+Examples:
+    python evaluate.py /renders/scene runs/*/ --jobs 8
+    python evaluate.py --campaign campaign.csv --report /results
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from sffrti_io import (LEVEL_DECIMALS,
+                       RENDER_MANIFEST_NAME,
+                       GetFrameImagePath,
+                       PlaceOnCanvas,
+                       ReadImage,
+                       ReadRenderManifest,
+                       )
+
+
+# File names looked for when a run is given as a folder
+RUN_DEPTH_NAME = "SFF Depth.npy"
+RUN_NORMAL_NAME = "Normals.npy"
+
+REPORT_NAME = "Evaluation Report"
+
+# Cycles writes this depth for pixels that see the background
+BACKGROUND_DEPTH = 1e9
+
+# Columns of the CSV report, in order
+REPORT_COLUMNS = ("name", "pixels", "depth_rmse", "depth_mae", "completeness", "within_tolerance",
+                  "focus_index_accuracy", "focus_index_within_one",
+                  "normal_mean_angle", "normal_median_angle", "normal_within_angle")
+
+
+def LoadGroundTruth(folder, frame=None, depthRange=None):
+    """
+    Returns the ground truth depth and normal maps of one rendered frame,
+    along with the render's sorted focus levels. Maps that weren't rendered
+    are None.
+    """
+
+    records = ReadRenderManifest(os.path.join(folder, RENDER_MANIFEST_NAME))
+    if not records:
+        raise ValueError("No rendered frames in the manifest of {0}".format(folder))
+
+    record = records[frame if frame is not None else min(records)]
+    outputs = record["outputs"]
+    layers = record.get("layers") or {}
+
+    depth = None
+    if "Depth" in layers:
+        depth = ReadImage(GetFrameImagePath(record, "Depth"), "Depth")[..., 0]
+    elif "DepthRaw" in outputs:
+        depth = ReadImage(outputs["DepthRaw"])[..., 0]
+    elif "Depth" in outputs:
+        if depthRange is None:
+            raise ValueError("The Depth pass of {0} is normalized, pass --gt-depth-range to map it to distances".format(folder))
+        # The compositor maps the near end of the range to 0 and the far end to 1
+        depth = depthRange[0] + ReadImage(outputs["Depth"])[..., 0] * (depthRange[1] - depthRange[0])
+
+    normal = None
+    if "Normal" in layers:
+        normal = ReadImage(GetFrameImagePath(record, "Normal"), "Normal")[..., :3]
+    elif "Normal" in outputs:
+        normal = ReadImage(outputs["Normal"])[..., :3]
+
+    # Pixels outside a cropped render have no ground truth
+    roi = record.get("roi")
+    depth = None if depth is None else PlaceOnCanvas(depth, roi, np.nan)
+    normal = None if normal is None else PlaceOnCanvas(normal, roi, np.nan)
+
+    levels = np.unique(np.round([r["z_cam"] for r in records.values() if "z_cam" in r], LEVEL_DECIMALS))
+
+    return depth, normal, levels
+
+
+def TileMeans(values, valid, tileSize):
+    """
+    Returns the mean of the valid values within every tileSize x tileSize
+    tile as a (rows, columns) grid, with NaN for tiles without valid values
+    """
+
+    height, width = values.shape
+    rows, columns = -(-height // tileSize), -(-width // tileSize)
+
+    padded = np.zeros((rows * tileSize, columns * tileSize), dtype=np.float64)
+    counts = np.zeros_like(padded)
+    padded[:height, :width] = np.where(valid, values, 0)
+    counts[:height, :width] = valid
+
+    shape = (rows, tileSize, columns, tileSize)
+    sums = padded.reshape(shape).sum(axis=(1, 3))
+    numbers = counts.reshape(shape).sum(axis=(1, 3))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / numbers).astype(np.float32)
+
+
+def NearestLevel(depth, levels):
+    """
+    Returns the index of the focus level closest to every depth value
+    """
+
+    idx = np.clip(np.searchsorted(levels, depth), 1, len(levels) - 1)
+    return np.where(np.abs(depth - levels[idx - 1]) <= np.abs(depth - levels[idx]), idx - 1, idx)
+
+
+def EvaluateDepth(depth, truth, levels, scale, offset, tolerance, tileSize):
+    """
+    Returns the depth metrics of a reconstruction and its per-tile RMSE grid
+    """
+
+    if depth.shape != truth.shape:
+        raise ValueError("Depth map is {0}, but the ground truth is {1}".format(depth.shape, truth.shape))
+
+    valid = np.isfinite(truth) & (truth < BACKGROUND_DEPTH)
+    reconstructed = valid & np.isfinite(depth)
+
+    mapped = scale * depth.astype(np.float64) + offset
+    error = np.where(reconstructed, mapped - truth, 0)
+    squared = error * error
+
+    numValid = max(int(valid.sum()), 1)
+    numReconstructed = max(int(reconstructed.sum()), 1)
+
+    metrics = {
+        "pixels": int(valid.sum()),
+        "depth_rmse": float(np.sqrt(squared.sum() / numReconstructed)),
+        "depth_mae": float(np.abs(error).sum() / numReconstructed),
+        "completeness": float(reconstructed.sum() / numValid),
+        "within_tolerance": float((reconstructed & (np.abs(error) <= tolerance)).sum() / numValid),
+    }
+
+    if len(levels) > 1:
+        # Compare focus levels in the reconstruction's units, where the levels are defined
+        truthIdx = NearestLevel((truth - offset) / scale, levels)
+        depthIdx = NearestLevel(depth, levels)
+        difference = np.abs(truthIdx - depthIdx)[reconstructed]
+
+        metrics["focus_index_accuracy"] = float((difference == 0).sum() / numReconstructed)
+        metrics["focus_index_within_one"] = float((difference <= 1).sum() / numReconstructed)
+
+    tiles = np.sqrt(TileMeans(squared, reconstructed, tileSize))
+
+    return metrics, tiles
+
+
+def EvaluateNormals(normal, truth, maxAngle, tileSize):
+    """
+    Returns the angular error metrics of reconstructed normals and their
+    per-tile mean angle grid
+    """
+
+    if normal.shape[:2] != truth.shape[:2]:
+        raise ValueError("Normal map is {0}, but the ground truth is {1}".format(normal.shape[:2], truth.shape[:2]))
+
+    truthLength = np.linalg.norm(truth, axis=-1)
+    normalLength = np.linalg.norm(normal[..., :3], axis=-1)
+
+    # Background pixels have no normal
+    valid = truthLength > 0.5
+    reconstructed = valid & np.isfinite(normalLength) & (normalLength > 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = np.einsum("ijk,ijk->ij", normal[..., :3], truth) / (normalLength * truthLength)
+    angle = np.degrees(np.arccos(np.clip(np.nan_to_num(cosine), -1, 1)))
+
+    angles = angle[reconstructed]
+    numValid = max(int(valid.sum()), 1)
+
+    metrics = {
+        "normal_mean_angle": float(angles.mean()) if angles.size else float("nan"),
+        "normal_median_angle": float(np.median(angles)) if angles.size else float("nan"),
+        "normal_within_angle": float((angles <= maxAngle).sum() / numValid),
+    }
+
+    return metrics, TileMeans(angle, reconstructed, tileSize)
+
+
+# Ground truth loaded by this worker process, by folder and frame
+_groundTruthCache = {}
+
+def _EvaluateRun(run):
+    """
+    Evaluates one run of a campaign, returning its report entry
+    """
+
+    entry = {"name": run["name"], "tiles": {}}
+
+    try:
+        key = (run["ground_truth"], run["frame"])
+        if key not in _groundTruthCache:
+            _groundTruthCache.clear()
+            _groundTruthCache[key] = LoadGroundTruth(run["ground_truth"], run["frame"], run["gt_depth_range"])
+        truthDepth, truthNormal, levels = _groundTruthCache[key]
+
+        if run["depth"]:
+            if truthDepth is None:
+                raise ValueError("{0} has no depth ground truth".format(run["ground_truth"]))
+            depth = ReadImage(run["depth"])[..., 0]
+            metrics, tiles = EvaluateDepth(depth, truthDepth, levels, run["scale"], run["offset"], run["tolerance"], run["tile_size"])
+            entry.update(metrics)
+            entry["tiles"]["depth_rmse"] = tiles
+
+        if run["normal"]:
+            if truthNormal is None:
+                raise ValueError("{0} has no normal ground truth".format(run["ground_truth"]))
+            metrics, tiles = EvaluateNormals(ReadImage(run["normal"]), truthNormal, run["max_angle"], run["tile_size"])
+            entry.update(metrics)
+            entry["tiles"]["normal_angle"] = tiles
+
+    except (OSError, ValueError, KeyError) as error:
+        # A missing frame or output in the ground truth manifest only fails this run
+        entry["error"] = "{0}: {1}".format(type(error).__name__, error) if isinstance(error, KeyError) else str(error)
+
+    return entry
+
+
+def FindRunFiles(path):
+    """
+    Returns the depth and normal maps of a run given as a folder or as a
+    single depth map
+    """
+
+    if not os.path.isdir(path):
+        return path, None
+
+    depth = os.path.join(path, RUN_DEPTH_NAME)
+    normal = os.path.join(path, RUN_NORMAL_NAME)
+
+    return (depth if os.path.isfile(depth) else None), (normal if os.path.isfile(normal) else None)
+
+
+def ReadCampaign(filepath, defaults):
+    """
+    Reads the runs of a campaign CSV file. Every row needs a name, a
+    ground_truth render folder, and a depth and/or normal map, and may
+    override frame, scale, and offset.
+    """
+
+    runs = []
+
+    with open(filepath, 'r', newline="") as file:
+        for row in csv.DictReader(file):
+            run = dict(defaults, name=row["name"], ground_truth=row["ground_truth"],
+                       depth=row.get("depth") or None, normal=row.get("normal") or None)
+
+            for name in ("scale", "offset"):
+                if row.get(name):
+                    run[name] = float(row[name])
+            if row.get("frame"):
+                run["frame"] = int(row["frame"])
+
+            runs.append(run)
+
+    return runs
+
+
+def WriteReport(folder, entries):
+    """
+    Writes the CSV summary and the JSON report with per-tile grids
+    """
+
+    with open(os.path.join(folder, REPORT_NAME + ".csv"), 'w', newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=REPORT_COLUMNS + ("error",), extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(entries)
+
+    # Tiles are rounded to keep the report small, and tiles without valid pixels become null
+    report = [dict(entry, tiles={name: [[None if np.isnan(value) else value for value in row] for row in np.round(grid, 6).tolist()]
+                                 for name, grid in entry["tiles"].items()})
+              for entry in entries]
+
+    with open(os.path.join(folder, REPORT_NAME + ".json"), 'w', encoding="utf-8") as file:
+        json.dump(report, file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score reconstructed depth and normal maps against rendered ground truth.")
+    parser.add_argument("ground_truth", nargs="?", help="Render output folder holding the ground truth passes")
+    parser.add_argument("runs", nargs="*", help="Run folders holding '{0}' and/or '{1}', or depth maps".format(RUN_DEPTH_NAME, RUN_NORMAL_NAME))
+    parser.add_argument("--campaign", help="CSV file listing runs with name, ground_truth, depth, normal, and optional frame, scale, and offset columns")
+    parser.add_argument("--report", default=".", help="Folder to write the report to")
+    parser.add_argument("--frame", type=int, help="Frame whose passes are the ground truth (defaults to the first rendered frame)")
+    parser.add_argument("--gt-depth-range", type=float, nargs=2, metavar=("NEAR", "FAR"), help="Distances the normalized PNG Depth pass was mapped from")
+    parser.add_argument("--scale", type=float, default=1.0, help="Scale applied to reconstructed depth")
+    parser.add_argument("--offset", type=float, default=0.0, help="Offset added to reconstructed depth after scaling")
+    parser.add_argument("--tolerance", type=float, default=0.001, help="Largest depth error counted as correct")
+    parser.add_argument("--max-angle", type=float, default=5.0, help="Largest normal error in degrees counted as correct")
+    parser.add_argument("--tile-size", type=int, default=128, help="Size of the tiles errors are summarized over")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of runs evaluated at once")
+    args = parser.parse_args(argv)
+
+    defaults = {"frame": args.frame, "gt_depth_range": args.gt_depth_range, "scale": args.scale, "offset": args.offset,
+                "tolerance": args.tolerance, "max_angle": args.max_angle, "tile_size": args.tile_size}
+
+    if args.campaign:
+        runs = ReadCampaign(args.campaign, defaults)
+    elif args.ground_truth and args.runs:
+        runs = []
+        for path in args.runs:
+            depth, normal = FindRunFiles(path)
+            runs.append(dict(defaults, name=os.path.basename(os.path.normpath(path)), ground_truth=args.ground_truth, depth=depth, normal=normal))
+    else:
+        parser.error("Pass a ground truth folder and runs, or --campaign")
+
+    # Runs sharing ground truth are evaluated by the same worker in turn, so it's only loaded once
+    runs.sort(key=lambda run: (run["ground_truth"], run["frame"] or 0))
+    chunkSize = max(1, len(runs) // (4 * args.jobs))
+
+    entries = []
+    with multiprocessing.Pool(args.jobs) as pool:
+        for entry in pool.imap(_EvaluateRun, runs, chunksize=chunkSize):
+            entries.append(entry)
+            print("\r{0}/{1} runs".format(len(entries), len(runs)), end="", flush=True)
+    print()
+
+    os.makedirs(args.report, exist_ok=True)
+    WriteReport(args.report, entries)
+
+    failed = [entry for entry in entries if "error" in entry]
+    for entry in failed:
+        print("{0}: {1}".format(entry["name"], entry["error"]))
+
+    print("Report written to {0}".format(os.path.join(args.report, REPORT_NAME + ".csv")))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
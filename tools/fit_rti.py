@@ -0,0 +1,334 @@
+"""
+Fits PTM or HSH reflectance coefficients to the RTI frames of a render.
+
+Light directions come from the lamp positions stored with every frame in the
+render manifest, or from an .lp file indexed by the .lp entry number of every
+frame's light, so renders of a light subset pick their own lights out of the
+full .lp file. The pseudo-inverse of the basis
+matrix is computed once, so fitting a tile is a single matrix multiply of
+that pseudo-inverse with the tile's (lights, pixels) intensities. Tiles are
+fitted in parallel worker processes from an on-disk image stack.
+
+Coefficients are written as an (height, width, channels, terms) array next
+to a JSON file describing the basis and how to map stored values back to
+coefficients. By default they're quantized to 8 bits with a scale and bias
+per term, like the PTM file format.
+
+Example:
+    python fit_rti.py /renders --basis hsh --order 3 --color rgb --workers 8
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from sffrti_io import (LEVEL_DECIMALS,
+                       RENDER_MANIFEST_NAME,
+                       BuildImageStack,
+                       GetFrameImagePath,
+                       LoadPlan,
+                       ReadLPFile,
+                       ReadRenderManifest,
+                       )
+
+
+STACK_NAME = "RTI Stack.npy"
+COEFFICIENTS_NAME = "RTI Coefficients.npy"
+METADATA_NAME = "RTI Coefficients.json"
+RESIDUAL_NAME = "RTI Residual.npy"
+
+# Storage types of the coefficients, and the largest value of integer types
+COEFFICIENT_TYPES = {"uint8": 255, "float16": None, "float32": None}
+
+
+def PTMBasis(directions, order=None):
+    """
+    Returns the biquadratic polynomial texture map basis of unit light
+    directions as a (lights, 6) matrix
+    """
+
+    lu, lv = directions[:, 0], directions[:, 1]
+
+    return np.column_stack([lu * lu, lv * lv, lu * lv, lu, lv, np.ones_like(lu)])
+
+
+def HSHBasis(directions, order=3):
+    """
+    Returns the hemispherical harmonics basis of unit light directions up to
+    the given order (1 to 3) as a (lights, order**2) matrix
+    """
+
+    phi = np.arctan2(directions[:, 1], directions[:, 0])
+    cosTheta = np.clip(directions[:, 2], 0, 1)
+    root = np.sqrt(cosTheta - cosTheta ** 2)
+
+    terms = [
+        np.full_like(phi, 1 / math.sqrt(2 * math.pi)),
+        math.sqrt(6 / math.pi) * np.cos(phi) * root,
+        math.sqrt(3 / (2 * math.pi)) * (-1 + 2 * cosTheta),
+        math.sqrt(6 / math.pi) * np.sin(phi) * root,
+        math.sqrt(30 / math.pi) * np.cos(2 * phi) * (-cosTheta + cosTheta ** 2),
+        math.sqrt(30 / math.pi) * np.cos(phi) * (-1 + 2 * cosTheta) * root,
+        math.sqrt(5 / (2 * math.pi)) * (1 - 6 * cosTheta + 6 * cosTheta ** 2),
+        math.sqrt(30 / math.pi) * np.sin(phi) * (-1 + 2 * cosTheta) * root,
+        math.sqrt(30 / math.pi) * (-cosTheta + cosTheta ** 2) * np.sin(2 * phi),
+    ]
+
+    return np.column_stack(terms[:order ** 2])
+
+
+BASES = {"ptm": PTMBasis, "hsh": HSHBasis}
+
+
+def SelectLPPositions(lpPositions, lightNumbers):
+    """
+    Returns the .lp light positions of the frames with the given 1-based .lp
+    entry numbers. Frames from plans without light numbers (all 0) are
+    matched to the .lp file's lights in order, which needs every light.
+    """
+
+    lightNumbers = np.asarray(lightNumbers)
+
+    if (lightNumbers == 0).all():
+        if len(lightNumbers) != len(lpPositions):
+            raise ValueError("The .lp file holds {0} lights, but {1} frames were rendered".format(len(lpPositions), len(lightNumbers)))
+        return lpPositions
+
+    if lightNumbers.min() < 1 or lightNumbers.max() > len(lpPositions):
+        raise ValueError("Frames use lights 1 to {0}, but the .lp file holds {1} lights".format(lightNumbers.max(), len(lpPositions)))
+
+    return lpPositions[lightNumbers - 1]
+
+
+def LoadLightFrames(folder, level=0):
+    """
+    Returns the (image path, region of interest) pairs, lamp positions, and
+    .lp light numbers of the rendered frames of one focus level, ordered by
+    frame
+    """
+
+    records = ReadRenderManifest(os.path.join(folder, RENDER_MANIFEST_NAME))
+    if not records:
+        raise ValueError("No rendered frames in the manifest of {0}".format(folder))
+
+    # Older manifests don't hold the plan parameters, so look them up in the plan
+    names = ("z_cam", "x_lamp", "y_lamp", "z_lamp", "light")
+    if any(name not in record for record in records.values() for name in names):
+        plan = LoadPlan(folder)
+        rows = {int(row["frame"]): row for row in plan}
+        records = {frame: dict(record, **{name: rows[frame][name].item() for name in names})
+                   for frame, record in records.items() if frame in rows}
+
+    frames = sorted(records)
+    zValues = np.round([records[frame]["z_cam"] for frame in frames], LEVEL_DECIMALS)
+    levels = np.unique(zValues)
+    if not -len(levels) <= level < len(levels):
+        raise ValueError("Focus level {0} doesn't exist, the render has {1} levels".format(level, len(levels)))
+
+    levelFrames = [frame for frame, z in zip(frames, zValues) if z == levels[level]]
+
+    paths = [(GetFrameImagePath(records[frame]), records[frame].get("roi")) for frame in levelFrames]
+    positions = np.array([[records[frame][name] for name in names[1:4]] for frame in levelFrames])
+    lightNumbers = np.array([records[frame]["light"] for frame in levelFrames], dtype=np.int64)
+
+    return paths, positions, lightNumbers
+
+
+# Settings shared by every tile, set once per worker process
+_tileSettings = {}
+
+def _InitWorker(settings):
+    _tileSettings.update(settings)
+    _tileSettings["stack"] = np.load(settings["stackPath"], mmap_mode='r')
+
+
+def _FitTile(tile):
+    """
+    Fits the coefficients of every pixel of a tile with one matrix multiply
+    and returns their per-channel, per-term minimum and maximum
+    """
+
+    y0, y1, x0, x1 = tile
+    settings = _tileSettings
+    stack = settings["stack"]
+    inverse = settings["inverse"]
+
+    intensities = np.asarray(stack[:, y0:y1, x0:x1], dtype=np.float32)
+    numLights = intensities.shape[0]
+    if intensities.ndim == 3:
+        intensities = intensities[..., np.newaxis]
+    tileShape = intensities.shape[1:]
+
+    # (terms, lights) @ (lights, pixels * channels)
+    flat = intensities.reshape(numLights, -1)
+    coefficients = inverse @ flat
+
+    if settings["residualPath"] is not None:
+        error = settings["basis"] @ coefficients - flat
+        residual = np.load(settings["residualPath"], mmap_mode='r+')
+        residual[y0:y1, x0:x1] = np.sqrt(np.mean(error.reshape((numLights,) + tileShape) ** 2, axis=(0, 3)))
+        residual.flush()
+
+    # Store as (height, width, channels, terms) so every pixel's coefficients are contiguous
+    coefficients = np.moveaxis(coefficients.reshape((-1,) + tileShape), 0, -1)
+
+    output = np.load(settings["rawPath"], mmap_mode='r+')
+    output[y0:y1, x0:x1] = coefficients
+    output.flush()
+
+    return coefficients.min(axis=(0, 1)), coefficients.max(axis=(0, 1))
+
+
+def _QuantizeTile(tile):
+    """
+    Writes a tile of coefficients scaled and offset to the stored type
+    """
+
+    y0, y1, x0, x1 = tile
+    settings = _tileSettings
+
+    raw = np.load(settings["rawPath"], mmap_mode='r')
+    output = np.load(settings["outputPath"], mmap_mode='r+')
+
+    values = (raw[y0:y1, x0:x1] - settings["bias"]) / settings["scale"]
+    if settings["maxValue"] is not None:
+        values = np.clip(np.rint(values), 0, settings["maxValue"])
+    output[y0:y1, x0:x1] = values
+    output.flush()
+
+    return tile
+
+
+def FitCoefficients(args, stackPath, stackShape, basis):
+    """
+    Fits the coefficients of every pixel tile by tile with a pool of worker
+    processes, then converts them to the stored type. Returns the scale and
+    bias that map stored values back to coefficients.
+    """
+
+    height, width = stackShape[1:3]
+    channels = stackShape[3] if len(stackShape) == 4 else 1
+    numTerms = basis.shape[1]
+
+    # Solving with the pseudo-inverse once replaces a least squares solve for every pixel
+    inverse = np.linalg.pinv(basis).astype(np.float32)
+
+    outputPath = os.path.join(args.out, COEFFICIENTS_NAME)
+    rawPath = outputPath if args.dtype == "float32" else os.path.join(args.out, COEFFICIENTS_NAME + ".tmp.npy")
+    residualPath = os.path.join(args.out, RESIDUAL_NAME) if args.residual else None
+
+    shape = (height, width, channels, numTerms)
+    np.lib.format.open_memmap(rawPath, mode='w+', dtype=np.float32, shape=shape).flush()
+    if residualPath is not None:
+        np.lib.format.open_memmap(residualPath, mode='w+', dtype=np.float32, shape=(height, width)).flush()
+
+    settings = {"stackPath": stackPath, "rawPath": rawPath, "outputPath": outputPath, "residualPath": residualPath,
+                "inverse": inverse, "basis": basis.astype(np.float32)}
+
+    tiles = [(y, min(y + args.tile_size, height), x, min(x + args.tile_size, width))
+             for y in range(0, height, args.tile_size) for x in range(0, width, args.tile_size)]
+
+    low = np.full((channels, numTerms), np.inf, dtype=np.float32)
+    high = np.full((channels, numTerms), -np.inf, dtype=np.float32)
+
+    with multiprocessing.Pool(args.workers, initializer=_InitWorker, initargs=(settings,)) as pool:
+        for done, (tileLow, tileHigh) in enumerate(pool.imap_unordered(_FitTile, tiles), start=1):
+            low = np.minimum(low, tileLow)
+            high = np.maximum(high, tileHigh)
+            print("\rFit: {0}/{1} tiles".format(done, len(tiles)), end="", flush=True)
+    print()
+
+    if args.dtype == "float32":
+        return np.ones_like(low), np.zeros_like(low)
+
+    maxValue = COEFFICIENT_TYPES[args.dtype]
+    if maxValue is None:
+        # Float16 keeps the coefficients as they are
+        scale, bias = np.ones_like(low), np.zeros_like(low)
+    else:
+        scale, bias = np.maximum(high - low, np.finfo(np.float32).eps) / maxValue, low
+
+    np.lib.format.open_memmap(outputPath, mode='w+', dtype=np.dtype(args.dtype), shape=shape).flush()
+    settings.update(scale=scale, bias=bias, maxValue=maxValue)
+
+    with multiprocessing.Pool(args.workers, initializer=_InitWorker, initargs=(settings,)) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_QuantizeTile, tiles), start=1):
+            print("\rStore: {0}/{1} tiles".format(done, len(tiles)), end="", flush=True)
+    print()
+
+    os.remove(rawPath)
+
+    return scale, bias
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit PTM or HSH coefficients to the RTI frames of an SFF-RTI render.")
+    parser.add_argument("folder", help="Output folder holding the render manifest")
+    parser.add_argument("--out", help="Folder to write the coefficients to (defaults to the output folder)")
+    parser.add_argument("--basis", choices=sorted(BASES), default="ptm", help="Reflectance basis")
+    parser.add_argument("--order", type=int, choices=(1, 2, 3), default=3, help="Order of the HSH basis")
+    parser.add_argument("--color", choices=("luminance", "rgb"), default="luminance", help="Fit luminance only, or every RGB channel")
+    parser.add_argument("--level", type=int, default=0, help="Index of the focus level whose frames are fitted")
+    parser.add_argument("--lp", help="Take light directions from an .lp file instead of the manifest's lamp positions")
+    parser.add_argument("--dtype", choices=sorted(COEFFICIENT_TYPES), default="uint8", help="Type the coefficients are stored as")
+    parser.add_argument("--residual", action="store_true", help="Also write the RMS fit error of every pixel")
+    parser.add_argument("--tile-size", type=int, default=512, help="Size of the tiles processed by each worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args(argv)
+
+    args.out = args.out or args.folder
+    os.makedirs(args.out, exist_ok=True)
+
+    paths, positions, lightNumbers = LoadLightFrames(args.folder, args.level)
+
+    if args.lp:
+        try:
+            positions = SelectLPPositions(ReadLPFile(args.lp), lightNumbers)
+        except (OSError, ValueError) as ex:
+            print("Could not use the .lp file: {0}".format(ex))
+            return 1
+
+    directions = positions / np.linalg.norm(positions, axis=1, keepdims=True)
+    basis = BASES[args.basis](directions, args.order)
+
+    if len(paths) < basis.shape[1]:
+        print("At least {0} lights are needed to fit {1} terms.".format(basis.shape[1], basis.shape[1]))
+        return 1
+
+    stackPath = os.path.join(args.out, STACK_NAME)
+    stackShape = BuildImageStack(stackPath, [[path] for path in paths], args.workers, gray=args.color == "luminance")
+
+    try:
+        scale, bias = FitCoefficients(args, stackPath, stackShape, basis)
+    finally:
+        os.remove(stackPath)
+
+    metadata = {
+        "basis": args.basis,
+        "order": args.order if args.basis == "hsh" else 2,
+        "terms": basis.shape[1],
+        "color": args.color,
+        "dtype": args.dtype,
+        "shape": [stackShape[1], stackShape[2]],
+        # coefficient = stored value * scale + bias, per channel and term
+        "scale": scale.tolist(),
+        "bias": bias.tolist(),
+        "light_directions": directions.tolist(),
+        "condition_number": float(np.linalg.cond(basis)),
+    }
+
+    with open(os.path.join(args.out, METADATA_NAME), 'w', encoding="utf-8") as file:
+        json.dump(metadata, file, indent=1)
+
+    print("Coefficients written to {0}".format(os.path.join(args.out, COEFFICIENTS_NAME)))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
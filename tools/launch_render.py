@@ -0,0 +1,279 @@
+"""
+Renders a prepared SFF-RTI .blend file with several background Blender
+processes at once.
+
+Frames are handed out in chunks from a shared queue. When the queue is empty
+and a worker slot frees up, the unrendered tail of the busiest running shard
+is split off to the free slot. Workers render with placeholders and without
+overwriting, so the original shard skips the frames that were taken over.
+Every worker appends to its own render manifest, and the shard manifests
+are merged into the main manifest once all frames are done. Shard manifests
+left behind by an interrupted launcher are merged when it starts again.
+
+Example:
+    python launch_render.py scene.blend --output /renders --workers 8 --threads 8
+"""
+
+import argparse
+import collections
+import glob
+import math
+import os
+import subprocess
+import sys
+import time
+
+from sffrti_io import (RENDER_MANIFEST_NAME,
+                       FrameRangeArgument,
+                       LoadPlan,
+                       ReadRenderManifest,
+                       WriteRenderManifest,
+                       )
+
+
+# Run in each worker and cleanup process so that outputs are resolved against the --output folder
+OUTPUT_SETUP = "import bpy, BlenderSFFRTI; BlenderSFFRTI.SetOutputFolder(bpy.context.scene, {0!r}); "
+
+# Run in each worker before rendering so that workers never render the same frame twice
+WORKER_SETUP = OUTPUT_SETUP + "r = bpy.context.scene.render; r.use_overwrite = False; r.use_placeholder = True"
+
+# Run once before (re)starting workers to remove partial outputs of frames missing from the manifest
+CLEANUP_SETUP = OUTPUT_SETUP + "bpy.ops.files.resume_render()"
+
+
+class Shard:
+    """
+    A background Blender process rendering a list of frames
+    """
+
+    def __init__(self, shardId, frames, manifestPath, process):
+        self.shardId = shardId
+        self.frames = list(frames)
+        self.manifestPath = manifestPath
+        self.process = process
+
+    def RemainingFrames(self):
+        done = ReadFinishedFrames(self.manifestPath)
+        return [frame for frame in self.frames if frame not in done]
+
+
+def ReadFinishedFrames(manifestPath):
+    """
+    Returns the set of frames with a manifest record, counting the in-focus
+    renders of synthetic defocus as well as regular frames
+    """
+
+    return set(ReadRenderManifest(manifestPath)) | set(ReadRenderManifest(manifestPath, syntheticSource=True))
+
+
+def GetShardManifestPath(folder, shardId):
+    """
+    Returns the path of the manifest a shard appends its records to
+    """
+
+    return os.path.join(folder, "{0}.shard-{1}".format(RENDER_MANIFEST_NAME, shardId))
+
+
+def FindShardManifests(folder):
+    """
+    Returns the paths of all shard manifests in an output folder
+    """
+
+    return sorted(glob.glob(GetShardManifestPath(glob.escape(folder), "*")))
+
+
+def LaunchShard(args, shardId, frames):
+    """
+    Starts a background Blender process rendering the given frames
+    """
+
+    manifestPath = GetShardManifestPath(args.output, shardId)
+
+    env = dict(os.environ)
+    env["SFFRTI_MANIFEST_PATH"] = manifestPath
+
+    command = [args.blender, "-b", args.blend_file,
+               "--python-expr", WORKER_SETUP.format(os.path.abspath(args.output)),
+               "-t", str(args.threads),
+               "-f", FrameRangeArgument(frames)]
+
+    log = open(os.path.join(args.output, "shard-{0}.log".format(shardId)), 'w')
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+    print("Shard {0}: rendering {1} frames ({2})".format(shardId, len(frames), FrameRangeArgument(frames)))
+
+    return Shard(shardId, frames, manifestPath, process)
+
+
+def ChunkFrames(frames, chunkSize):
+    """
+    Splits a list of frames into consecutive chunks of at most chunkSize frames
+    """
+
+    return [frames[i:i + chunkSize] for i in range(0, len(frames), chunkSize)]
+
+
+def StealFrames(running, minFrames):
+    """
+    Splits off the second half of the unrendered frames of the shard with the
+    most work left. Returns None if no shard has enough work left to split.
+    """
+
+    best = None
+    bestRemaining = []
+    for shard in running:
+        remaining = shard.RemainingFrames()
+        if len(remaining) > len(bestRemaining):
+            best, bestRemaining = shard, remaining
+
+    if best is None or len(bestRemaining) < 2 * minFrames:
+        return None
+
+    half = len(bestRemaining) // 2
+    stolen = bestRemaining[half:]
+
+    # The original shard will skip the stolen frames once their placeholders exist
+    stolenSet = set(stolen)
+    best.frames = [frame for frame in best.frames if frame not in stolenSet]
+
+    return stolen
+
+
+def RemoveIncompleteOutputs(args):
+    """
+    Runs the add-on's resume operator once so that placeholders and partial
+    files of frames missing from the manifest don't get skipped by workers
+    """
+
+    command = [args.blender, "-b", args.blend_file,
+               "--python-expr", CLEANUP_SETUP.format(os.path.abspath(args.output))]
+
+    env = dict(os.environ)
+    env["SFFRTI_MANIFEST_PATH"] = os.path.abspath(os.path.join(args.output, RENDER_MANIFEST_NAME))
+
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=False)
+
+
+def MergeManifests(args, shardPaths):
+    """
+    Merges the main manifest and all shard manifests into the main manifest,
+    then removes the shard manifests. Returns the set of finished frames.
+    """
+
+    mainPath = os.path.join(args.output, RENDER_MANIFEST_NAME)
+
+    records = ReadRenderManifest(mainPath)
+    sourceRecords = ReadRenderManifest(mainPath, syntheticSource=True)
+    for path in shardPaths:
+        records.update(ReadRenderManifest(path))
+        sourceRecords.update(ReadRenderManifest(path, syntheticSource=True))
+
+    WriteRenderManifest(mainPath, records, sourceRecords)
+
+    for path in shardPaths:
+        if os.path.isfile(path):
+            os.remove(path)
+
+    return set(records) | set(sourceRecords)
+
+
+def RunShards(args, frames):
+    """
+    Renders all frames with at most args.workers processes at a time, retrying
+    frames missing from the manifests up to args.retries times
+    """
+
+    chunkSize = args.chunk_size or max(1, math.ceil(len(frames) / (args.workers * 4)))
+
+    shardPaths = []
+    shardId = 0
+
+    for attempt in range(args.retries + 1):
+        if attempt > 0 or os.path.isfile(os.path.join(args.output, RENDER_MANIFEST_NAME)):
+            RemoveIncompleteOutputs(args)
+
+        pending = collections.deque(ChunkFrames(frames, chunkSize))
+        running = []
+
+        while pending or running:
+            while pending and len(running) < args.workers:
+                shard = LaunchShard(args, shardId, pending.popleft())
+                shardPaths.append(shard.manifestPath)
+                running.append(shard)
+                shardId += 1
+
+            # Rebalance by splitting the busiest shard whenever a slot is idle
+            while not pending and len(running) < args.workers:
+                stolen = StealFrames(running, args.min_steal)
+                if stolen is None:
+                    break
+                shard = LaunchShard(args, shardId, stolen)
+                shardPaths.append(shard.manifestPath)
+                running.append(shard)
+                shardId += 1
+
+            time.sleep(args.poll_interval)
+
+            for shard in [shard for shard in running if shard.process.poll() is not None]:
+                running.remove(shard)
+                if shard.process.returncode != 0:
+                    print("Shard {0}: exited with code {1}".format(shard.shardId, shard.process.returncode))
+
+        done = MergeManifests(args, shardPaths)
+        shardPaths = []
+
+        frames = [frame for frame in frames if frame not in done]
+        if not frames:
+            return []
+
+        print("{0} frames missing from the manifest after attempt {1}".format(len(frames), attempt + 1))
+
+    return frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render an SFF-RTI acquisition with several background Blender processes.")
+    parser.add_argument("blend_file", help="Prepared .blend file to render")
+    parser.add_argument("--output", required=True, help="Output folder holding Image.npy/Image.csv and the render manifest")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable")
+    parser.add_argument("--workers", type=int, default=4, help="Number of Blender processes to run at once")
+    parser.add_argument("--threads", type=int, default=0, help="Render threads per process (0 lets Blender decide)")
+    parser.add_argument("--start", type=int, help="First frame to render (defaults to the acquisition plan)")
+    parser.add_argument("--end", type=int, help="Last frame to render (defaults to the acquisition plan)")
+    parser.add_argument("--chunk-size", type=int, default=0, help="Frames per queued chunk (0 picks four chunks per worker)")
+    parser.add_argument("--min-steal", type=int, default=2, help="Smallest number of frames split off a running shard")
+    parser.add_argument("--retries", type=int, default=1, help="Times to re-queue frames missing from the manifest")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks on running shards")
+    args = parser.parse_args(argv)
+
+    if args.start is not None and args.end is not None:
+        frames = list(range(args.start, args.end + 1))
+    else:
+        frames = sorted(int(frame) for frame in LoadPlan(args.output)["frame"])
+
+    # Shard manifests of an interrupted launch still hold the frames its workers finished
+    shardPaths = FindShardManifests(args.output)
+    if shardPaths:
+        MergeManifests(args, shardPaths)
+
+    # Only render frames that aren't already recorded as complete
+    done = ReadFinishedFrames(os.path.join(args.output, RENDER_MANIFEST_NAME))
+    frames = [frame for frame in frames if frame not in done]
+
+    if not frames:
+        print("All frames are already rendered.")
+        return 0
+
+    missing = RunShards(args, frames)
+
+    if missing:
+        print("Frames still missing: {0}".format(FrameRangeArgument(missing)))
+        return 1
+
+    print("All frames rendered.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
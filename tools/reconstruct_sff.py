@@ -0,0 +1,283 @@
+"""
+Reconstructs a depth map from a rendered SFF-RTI focus stack.
+
+Frames are grouped into focus levels on the render manifest's z_cam column
+and every level is converted to a grayscale float32 slice of an on-disk
+stack, so stacks larger than memory can be processed. A focus measure
+(modified Laplacian or Tenengrad) is then computed tile by tile in parallel
+worker processes, reading one focus level of one tile at a time. The level
+with the highest focus is refined to a sub-level position by fitting a
+Gaussian (or parabola) through it and its two neighbours.
+
+The depth map holds the interpolated z_cam value at best focus for every
+pixel. For a static camera this is the focus distance from the camera, and
+for a moving camera it's the camera height.
+
+Example:
+    python reconstruct_sff.py /renders --measure tenengrad --window 9 --workers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from sffrti_io import (LEVEL_DECIMALS,
+                       RENDER_MANIFEST_NAME,
+                       BuildImageStack,
+                       GetFrameImagePath,
+                       LoadPlan,
+                       ReadRenderManifest,
+                       )
+
+
+STACK_NAME = "SFF Stack.npy"
+DEPTH_NAME = "SFF Depth.npy"
+FOCUS_NAME = "SFF Focus.npy"
+
+
+def GroupFocusLevels(folder, light=None):
+    """
+    Returns the sorted z_cam value of every focus level and the image paths
+    of each level's frames. If light is given, only the frame with that index
+    among each level's frames is used.
+    """
+
+    records = ReadRenderManifest(os.path.join(folder, RENDER_MANIFEST_NAME))
+    if not records:
+        raise ValueError("No rendered frames in the manifest of {0}".format(folder))
+
+    # Older manifests don't hold the plan parameters, so look them up in the plan
+    if any("z_cam" not in record for record in records.values()):
+        plan = LoadPlan(folder)
+        zCam = dict(zip(plan["frame"].tolist(), plan["z_cam"].tolist()))
+        records = {frame: dict(record, z_cam=zCam[frame]) for frame, record in records.items() if frame in zCam}
+
+    frames = sorted(records)
+    zValues = np.round([records[frame]["z_cam"] for frame in frames], LEVEL_DECIMALS)
+    levels, inverse = np.unique(zValues, return_inverse=True)
+
+    levelPaths = [[] for _ in levels]
+    for frame, levelIdx in zip(frames, inverse.ravel().tolist()):
+        levelPaths[levelIdx].append(records[frame])
+
+    if light is not None:
+        levelPaths = [levelRecords[light:light + 1] for levelRecords in levelPaths]
+
+    return levels, levelPaths
+
+
+def BoxSum(image, size):
+    """
+    Sums every size x size window of an image with an integral image,
+    treating pixels outside the image as zero
+    """
+
+    pad = size // 2
+    integral = np.pad(image.astype(np.float64), ((pad + 1, pad), (pad + 1, pad))).cumsum(0).cumsum(1)
+
+    return (integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]).astype(np.float32)
+
+
+def ModifiedLaplacian(image, step=1):
+    """
+    Returns the modified Laplacian of an image, the sum of the absolute
+    second derivatives in x and y taken over the given pixel step
+    """
+
+    result = np.zeros_like(image)
+    center = image[step:-step, step:-step]
+
+    result[step:-step, step:-step] = (np.abs(2 * center - image[step:-step, :-2 * step] - image[step:-step, 2 * step:]) +
+                                      np.abs(2 * center - image[:-2 * step, step:-step] - image[2 * step:, step:-step]))
+
+    return result
+
+
+def Tenengrad(image, step=1):
+    """
+    Returns the squared Sobel gradient magnitude of an image, with the
+    Sobel taps the given pixel step apart
+    """
+
+    height, width = image.shape
+    result = np.zeros_like(image)
+
+    def Tap(dy, dx):
+        # The image shifted by (dy, dx) steps, over the pixels at least one step from the edges
+        return image[step * (1 + dy):height - step * (1 - dy), step * (1 + dx):width - step * (1 - dx)]
+
+    gx = (Tap(-1, 1) + 2 * Tap(0, 1) + Tap(1, 1)) - (Tap(-1, -1) + 2 * Tap(0, -1) + Tap(1, -1))
+    gy = (Tap(1, -1) + 2 * Tap(1, 0) + Tap(1, 1)) - (Tap(-1, -1) + 2 * Tap(-1, 0) + Tap(-1, 1))
+
+    result[step:-step, step:-step] = gx * gx + gy * gy
+
+    return result
+
+
+FOCUS_MEASURES = {"laplacian": ModifiedLaplacian, "tenengrad": Tenengrad}
+
+
+def InterpolatePeak(left, center, right, gaussian=True):
+    """
+    Returns the offset of the focus peak from the best level, from -0.5 to
+    0.5, by fitting a Gaussian or a parabola through three focus values
+    """
+
+    if gaussian:
+        tiny = np.finfo(np.float32).tiny
+        left, center, right = (np.log(np.maximum(values, tiny)) for values in (left, center, right))
+
+    curvature = left - 2 * center + right
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+
+    return np.clip(np.nan_to_num(offset), -0.5, 0.5)
+
+
+# Settings shared by every tile, set once per worker process
+_tileSettings = {}
+
+def _InitWorker(settings):
+    _tileSettings.update(settings)
+    _tileSettings["stack"] = np.load(settings["stackPath"], mmap_mode='r')
+
+
+def _ProcessTile(tile):
+    """
+    Finds the best focus level of every pixel of a tile by streaming over the
+    stack's levels, then writes the interpolated depth and peak focus
+    """
+
+    y0, y1, x0, x1 = tile
+    settings = _tileSettings
+    stack = settings["stack"]
+    numLevels, height, width = stack.shape
+
+    # Read a halo around the tile so that window sums at the tile's edges see their neighbours
+    halo = settings["window"] // 2 + settings["step"] + 1
+    hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, height)
+    hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, width)
+    crop = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+
+    measure = FOCUS_MEASURES[settings["measure"]]
+
+    shape = (y1 - y0, x1 - x0)
+    best = np.full(shape, -np.inf, dtype=np.float32)
+    bestIdx = np.zeros(shape, dtype=np.int32)
+    left = np.zeros(shape, dtype=np.float32)
+    right = np.zeros(shape, dtype=np.float32)
+    previous = None
+
+    for levelIdx in range(numLevels):
+        image = np.asarray(stack[levelIdx, hy0:hy1, hx0:hx1], dtype=np.float32)
+        focus = BoxSum(measure(image, settings["step"]), settings["window"])[crop]
+
+        if previous is not None:
+            # Pixels that peaked on the previous level now get their right neighbour
+            peakedBefore = bestIdx == levelIdx - 1
+            right[peakedBefore] = focus[peakedBefore]
+
+        better = focus > best
+        best[better] = focus[better]
+        bestIdx[better] = levelIdx
+        left[better] = previous[better] if previous is not None else 0
+
+        previous = focus
+
+    offset = InterpolatePeak(left, best, right, settings["interpolation"] == "gaussian")
+
+    # Levels at either end of the stack have only one neighbour
+    offset[(bestIdx == 0) | (bestIdx == numLevels - 1)] = 0
+
+    depth = np.load(settings["depthPath"], mmap_mode='r+')
+    focusMap = np.load(settings["focusPath"], mmap_mode='r+')
+
+    depth[y0:y1, x0:x1] = np.interp(bestIdx + offset, np.arange(numLevels), settings["levels"])
+    focusMap[y0:y1, x0:x1] = best
+
+    depth.flush()
+    focusMap.flush()
+
+    return tile
+
+
+def ReconstructDepth(args, levels, stackPath, height, width):
+    """
+    Computes the depth and peak focus maps tile by tile with a pool of worker processes
+    """
+
+    depthPath = os.path.join(args.out, DEPTH_NAME)
+    focusPath = os.path.join(args.out, FOCUS_NAME)
+
+    for path in (depthPath, focusPath):
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(height, width)).flush()
+
+    settings = {"stackPath": stackPath, "depthPath": depthPath, "focusPath": focusPath, "levels": levels,
+                "measure": args.measure, "window": args.window, "step": args.step, "interpolation": args.interpolation}
+
+    tiles = [(y, min(y + args.tile_size, height), x, min(x + args.tile_size, width))
+             for y in range(0, height, args.tile_size) for x in range(0, width, args.tile_size)]
+
+    with multiprocessing.Pool(args.workers, initializer=_InitWorker, initargs=(settings,)) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_ProcessTile, tiles), start=1):
+            print("\rDepth: {0}/{1} tiles".format(done, len(tiles)), end="", flush=True)
+    print()
+
+    return depthPath, focusPath
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconstruct a depth map from a rendered SFF-RTI focus stack.")
+    parser.add_argument("folder", help="Output folder holding the render manifest")
+    parser.add_argument("--out", help="Folder to write the depth and focus maps to (defaults to the output folder)")
+    parser.add_argument("--measure", choices=sorted(FOCUS_MEASURES), default="laplacian", help="Focus measure")
+    parser.add_argument("--window", type=int, default=9, help="Odd size of the window the focus measure is summed over")
+    parser.add_argument("--step", type=int, default=1, help="Pixel step of the focus measure")
+    parser.add_argument("--interpolation", choices=("gaussian", "parabolic"), default="gaussian", help="Fit used to find the focus peak between levels")
+    parser.add_argument("--light", type=int, help="Only use the frame with this index at every focus level, instead of averaging all lights")
+    parser.add_argument("--tile-size", type=int, default=256, help="Size of the tiles processed by each worker")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--keep-stack", action="store_true", help="Keep the grayscale stack on disk after reconstruction")
+    args = parser.parse_args(argv)
+
+    if args.window < 1 or args.window % 2 == 0:
+        parser.error("--window must be a positive odd number")
+
+    args.out = args.out or args.folder
+    os.makedirs(args.out, exist_ok=True)
+
+    levels, levelRecords = GroupFocusLevels(args.folder, args.light)
+
+    # Drop focus levels without any rendered frames
+    keep = [idx for idx, records in enumerate(levelRecords) if records]
+    if len(keep) < len(levels):
+        print("Skipping {0} focus levels without rendered frames".format(len(levels) - len(keep)))
+    levels = levels[keep]
+    levelPaths = [[(GetFrameImagePath(record), record.get("roi")) for record in levelRecords[idx]] for idx in keep]
+
+    if len(levels) < 2:
+        print("At least two focus levels are needed.")
+        return 1
+
+    stackPath = os.path.join(args.out, STACK_NAME)
+    stackShape = BuildImageStack(stackPath, levelPaths, args.workers)
+    height, width = stackShape[1:3]
+
+    try:
+        depthPath, focusPath = ReconstructDepth(args, levels, stackPath, height, width)
+    finally:
+        if not args.keep_stack:
+            os.remove(stackPath)
+
+    print("Depth map written to {0}".format(depthPath))
+    print("Peak focus written to {0}".format(focusPath))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""
+Renders very high resolution SFF-RTI frames as tiles in several background
+Blender processes and stitches them back together.
+
+Every frame is split into a grid of tiles. Each tile is rendered by its own
+Blender process using a cropped render border, grown by a few overlapping
+pixels so that denoising doesn't leave seams. A process only ever holds its
+tile in memory, so peak memory per process shrinks with the number of tiles.
+Processes render their tile for a chunk of frames at a time, writing to a
+private tile folder that mirrors the output folder. Once all tiles of a chunk
+are done, every image they wrote (beauty, Depth, Normal, and any other
+output) is stitched into the output folder under its usual file name, and
+the frames are added to the render manifest.
+
+Outputs have to be inside the output folder. Normalized depth from the
+automatic focus limits is mapped over the main object's depth range instead,
+so that all tiles share the same scale. The add-on must be enabled in the
+Blender installation that is used.
+
+Example:
+    python render_tiles.py scene.blend --output /renders --tiles 4x4 --workers 8
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from sffrti_io import (RENDER_MANIFEST_NAME,
+                       FileChecksum,
+                       FrameRangeArgument,
+                       LoadPlan,
+                       ReadRenderManifest,
+                       WriteRenderManifest,
+                       )
+
+
+# Folder inside the output folder holding the tiles of the chunk being rendered
+TILES_FOLDER = ".tiles"
+
+# Printed by QUERY_RESOLUTION so that it can be found among Blender's output
+RESOLUTION_TAG = "SFFRTI_RESOLUTION"
+
+QUERY_RESOLUTION = ("import bpy; r = bpy.context.scene.render; "
+                    "print('" + RESOLUTION_TAG + "', r.resolution_x * r.resolution_percentage // 100, r.resolution_y * r.resolution_percentage // 100)")
+
+# Run in each worker before rendering to crop the render to its tile and redirect outputs to the tile folder
+TILE_SETUP = "import bpy, BlenderSFFRTI; BlenderSFFRTI.PrepareTileRender(bpy.context.scene, {0!r}, {1!r})"
+
+
+class Tile:
+    """
+    A rectangle of the canvas in pixels, measured from the top left. The
+    rendered rectangle is grown by the overlap, the core is what's kept.
+    """
+
+    def __init__(self, tileId, core, rendered):
+        self.tileId = tileId
+        self.core = core
+        self.rendered = rendered
+
+    def Border(self, width, height):
+        """
+        Returns the render border of the rendered rectangle, a quarter pixel
+        in so that Blender's truncation to pixels lands on the same pixels
+        """
+
+        x0, y0, x1, y1 = self.rendered
+
+        # Render borders are measured from the bottom left
+        def Edge(pixel, size):
+            return 1.0 if pixel >= size else (pixel + 0.25) / size if pixel > 0 else 0.0
+
+        return (Edge(x0, width), Edge(x1, width), Edge(height - y1, height), Edge(height - y0, height))
+
+    def CropBox(self):
+        """
+        Returns the core of the tile within the rendered image, as a
+        (left, top, right, bottom) box
+        """
+
+        x0, y0, x1, y1 = self.core
+        rx0, ry0 = self.rendered[:2]
+
+        return (x0 - rx0, y0 - ry0, x1 - rx0, y1 - ry0)
+
+
+def SplitCanvas(width, height, tilesX, tilesY, overlap):
+    """
+    Splits a canvas into a grid of tiles with nearly equal sizes
+    """
+
+    xEdges = np.round(np.linspace(0, width, tilesX + 1)).astype(int).tolist()
+    yEdges = np.round(np.linspace(0, height, tilesY + 1)).astype(int).tolist()
+
+    tiles = []
+    for row in range(tilesY):
+        for col in range(tilesX):
+            core = (xEdges[col], yEdges[row], xEdges[col + 1], yEdges[row + 1])
+            rendered = (max(core[0] - overlap, 0), max(core[1] - overlap, 0),
+                        min(core[2] + overlap, width), min(core[3] + overlap, height))
+            tiles.append(Tile(len(tiles), core, rendered))
+
+    return tiles
+
+
+def QueryResolution(args):
+    """
+    Returns the rendered width and height of the .blend file's scene in pixels
+    """
+
+    command = [args.blender, "-b", args.blend_file, "--python-expr", QUERY_RESOLUTION]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, check=False)
+
+    for line in result.stdout.splitlines():
+        if line.startswith(RESOLUTION_TAG):
+            _, width, height = line.split()
+            return int(width), int(height)
+
+    raise RuntimeError("Couldn't read the render resolution of {0}:\n{1}".format(args.blend_file, result.stdout))
+
+
+def LaunchTile(args, tile, border, chunkFolder, frames):
+    """
+    Starts a background Blender process rendering one tile of the given frames
+    """
+
+    tileFolder = os.path.join(chunkFolder, "tile-{0}".format(tile.tileId))
+
+    env = dict(os.environ)
+    env["SFFRTI_MANIFEST_PATH"] = tileFolder + ".jsonl"
+
+    command = [args.blender, "-b", args.blend_file,
+               "--python-expr", TILE_SETUP.format(tileFolder, border),
+               "-t", str(args.threads),
+               "-f", FrameRangeArgument(frames)]
+
+    log = open(tileFolder + ".log", 'w')
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+    return process
+
+
+def RenderChunk(args, tiles, width, height, chunkFolder, frames):
+    """
+    Renders every tile of a chunk of frames with at most args.workers
+    processes at a time. Returns the ids of tiles whose process failed.
+    """
+
+    pending = list(tiles)
+    running = {}
+    failed = []
+    numDone = -1
+
+    while pending or running:
+        while pending and len(running) < args.workers:
+            tile = pending.pop(0)
+            running[tile.tileId] = LaunchTile(args, tile, tile.Border(width, height), chunkFolder, frames)
+
+        time.sleep(args.poll_interval)
+
+        for tileId, process in list(running.items()):
+            if process.poll() is None:
+                continue
+
+            del running[tileId]
+            if process.returncode != 0:
+                print("\nTile {0}: exited with code {1}".format(tileId, process.returncode))
+                failed.append(tileId)
+
+        if len(tiles) - len(pending) - len(running) != numDone:
+            numDone = len(tiles) - len(pending) - len(running)
+            print("\rFrames {0}: {1}/{2} tiles".format(FrameRangeArgument(frames), numDone, len(tiles)), end="", flush=True)
+    print()
+
+    return failed
+
+
+def StitchImage(tilePaths, tiles, width, height, outputPath):
+    """
+    Stitches the cores of a tile's images into one image of the full canvas,
+    keeping the tiles' pixel format
+
+    NOTE: Pillow reads 16-bit RGB PNG files as 8-bit, so use EXR for passes
+    that need more than 8 bits per color channel.
+    """
+
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("Stitching image tiles needs Pillow (pip install Pillow)")
+
+    canvas = None
+    for path, tile in zip(tilePaths, tiles):
+        with Image.open(path) as image:
+            if canvas is None:
+                canvas = Image.new(image.mode, (width, height))
+            canvas.paste(image.crop(tile.CropBox()), tile.core[:2])
+
+    canvas.save(outputPath)
+
+
+def StitchEXR(tilePaths, tiles, width, height, outputPath):
+    """
+    Stitches the cores of EXR tiles into one EXR of the full canvas, keeping
+    every channel, including all layers of multilayer files, at its pixel type.
+    The canvas is written one row of tiles at a time, so only a band of the
+    canvas is ever held in memory.
+    """
+
+    try:
+        import Imath
+        import OpenEXR
+    except ImportError:
+        raise ImportError("Stitching EXR tiles needs the OpenEXR package (pip install OpenEXR)")
+
+    dtypes = {Imath.PixelType.HALF: np.float16, Imath.PixelType.FLOAT: np.float32, Imath.PixelType.UINT: np.uint32}
+
+    # Tiles with the same core rows form one band of the canvas, written top to bottom
+    bands = sorted(set((tile.core[1], tile.core[3]) for tile in tiles))
+
+    header = None
+    output = None
+    try:
+        for bandTop, bandBottom in bands:
+            band = {}
+            for path, tile in zip(tilePaths, tiles):
+                if (tile.core[1], tile.core[3]) != (bandTop, bandBottom):
+                    continue
+
+                file = OpenEXR.InputFile(path)
+                try:
+                    tileHeader = file.header()
+                    window = tileHeader["dataWindow"]
+                    tileWidth = window.max.x - window.min.x + 1
+                    tileHeight = window.max.y - window.min.y + 1
+
+                    if header is None:
+                        header = tileHeader
+                        outputHeader = OpenEXR.Header(width, height)
+                        outputHeader["channels"] = header["channels"]
+                        outputHeader["compression"] = header["compression"]
+                        output = OpenEXR.OutputFile(outputPath, outputHeader)
+
+                    if not band:
+                        band = {name: np.zeros((bandBottom - bandTop, width), dtype=dtypes[channel.type.v])
+                                for name, channel in header["channels"].items()}
+
+                    left, top, right, bottom = tile.CropBox()
+                    x0, _, x1, _ = tile.core
+                    for name, channel in header["channels"].items():
+                        pixels = np.frombuffer(file.channel(name, channel.type), dtype=dtypes[channel.type.v]).reshape(tileHeight, tileWidth)
+                        band[name][:, x0:x1] = pixels[top:bottom, left:right]
+                finally:
+                    file.close()
+
+            output.writePixels({name: pixels.tobytes() for name, pixels in band.items()}, bandBottom - bandTop)
+    finally:
+        if output is not None:
+            output.close()
+
+
+def StitchChunk(args, tiles, width, height, chunkFolder, frames):
+    """
+    Stitches every file written by all tiles of a chunk into the output
+    folder and returns manifest records of the frames that every tile
+    completed
+    """
+
+    tileFolders = [os.path.join(chunkFolder, "tile-{0}".format(tile.tileId)) for tile in tiles]
+
+    for root, _, files in os.walk(tileFolders[0]):
+        for name in files:
+            relPath = os.path.relpath(os.path.join(root, name), tileFolders[0])
+            tilePaths = [os.path.join(folder, relPath) for folder in tileFolders]
+
+            # Outputs missing from a tile belong to a frame that didn't finish there
+            if not all(os.path.isfile(path) for path in tilePaths):
+                continue
+
+            outputPath = os.path.join(args.output, relPath)
+            os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+
+            if relPath.lower().endswith(".exr"):
+                StitchEXR(tilePaths, tiles, width, height, outputPath)
+            else:
+                StitchImage(tilePaths, tiles, width, height, outputPath)
+
+    tileRecords = [ReadRenderManifest(folder + ".jsonl") for folder in tileFolders]
+
+    def OutputPath(path):
+        return os.path.join(args.output, os.path.relpath(path, tileFolders[0]))
+
+    records = {}
+    for frame in frames:
+        if not all(frame in recordsOfTile for recordsOfTile in tileRecords):
+            continue
+
+        record = dict(tileRecords[0][frame])
+        record["outputs"] = {key: OutputPath(path) for key, path in record["outputs"].items()}
+        if record.get("layers"):
+            record["layers"] = {layer: OutputPath(path) for layer, path in record["layers"].items()}
+
+        outputs = record["outputs"]
+        record["bytes"] = {key: os.path.getsize(path) for key, path in outputs.items()}
+        record["sha256"] = {key: FileChecksum(path) for key, path in outputs.items()}
+
+        # Total render time of all tiles, they ran side by side
+        renderTimes = [recordsOfTile[frame].get("render_time") for recordsOfTile in tileRecords]
+        record["render_time"] = None if None in renderTimes else sum(renderTimes)
+        record["tiles"] = len(tiles)
+        record["completed"] = time.time()
+
+        records[frame] = record
+
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render SFF-RTI frames as tiles in several background Blender processes and stitch them.")
+    parser.add_argument("blend_file", help="Prepared .blend file to render")
+    parser.add_argument("--output", required=True, help="Output folder holding Image.npy/Image.csv and the render manifest")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable")
+    parser.add_argument("--tiles", default="2x2", help="Tile grid as <columns>x<rows>")
+    parser.add_argument("--overlap", type=int, default=16, help="Pixels rendered past each tile's edges and dropped when stitching")
+    parser.add_argument("--workers", type=int, default=4, help="Number of Blender processes to run at once")
+    parser.add_argument("--threads", type=int, default=0, help="Render threads per process (0 lets Blender decide)")
+    parser.add_argument("--chunk-size", type=int, default=1, help="Frames rendered by every tile process before stitching")
+    parser.add_argument("--start", type=int, help="First frame to render (defaults to the acquisition plan)")
+    parser.add_argument("--end", type=int, help="Last frame to render (defaults to the acquisition plan)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks on running tiles")
+    parser.add_argument("--keep-tiles", action="store_true", help="Keep the tile folders after stitching")
+    args = parser.parse_args(argv)
+
+    try:
+        tilesX, tilesY = (int(value) for value in args.tiles.lower().split("x"))
+    except ValueError:
+        parser.error("--tiles must look like 4x4")
+    if tilesX < 1 or tilesY < 1 or args.overlap < 0 or args.chunk_size < 1:
+        parser.error("--tiles, --overlap, and --chunk-size must be positive")
+
+    args.output = os.path.abspath(args.output)
+
+    if args.start is not None and args.end is not None:
+        frames = list(range(args.start, args.end + 1))
+    else:
+        frames = sorted(int(frame) for frame in LoadPlan(args.output)["frame"])
+
+    # Only render frames that aren't already recorded as complete
+    manifestPath = os.path.join(args.output, RENDER_MANIFEST_NAME)
+    done = ReadRenderManifest(manifestPath)
+    frames = [frame for frame in frames if frame not in done]
+
+    if not frames:
+        print("All frames are already rendered.")
+        return 0
+
+    width, height = QueryResolution(args)
+    tiles = SplitCanvas(width, height, tilesX, tilesY, args.overlap)
+
+    print("Rendering {0} frames of {1}x{2} pixels as {3} tiles".format(len(frames), width, height, len(tiles)))
+
+    missing = []
+    for chunkIdx in range(0, len(frames), args.chunk_size):
+        chunk = frames[chunkIdx:chunkIdx + args.chunk_size]
+        chunkFolder = os.path.join(args.output, TILES_FOLDER, "frames-{0}".format(FrameRangeArgument(chunk).replace(",", "_")))
+
+        # Leftovers of an interrupted run would be stitched with the new tiles
+        shutil.rmtree(chunkFolder, ignore_errors=True)
+        os.makedirs(chunkFolder)
+
+        failed = RenderChunk(args, tiles, width, height, chunkFolder, chunk)
+        if failed:
+            print("See {0} for the logs of failed tiles".format(chunkFolder))
+
+        records = StitchChunk(args, tiles, width, height, chunkFolder, chunk)
+
+        manifest = ReadRenderManifest(manifestPath)
+        manifest.update(records)
+        WriteRenderManifest(manifestPath, manifest, ReadRenderManifest(manifestPath, syntheticSource=True))
+
+        missing.extend(frame for frame in chunk if frame not in records)
+
+        if not args.keep_tiles and not failed:
+            shutil.rmtree(chunkFolder, ignore_errors=True)
+
+    if not args.keep_tiles:
+        # Only remove the tiles folder once nothing is left in it
+        try:
+            os.rmdir(os.path.join(args.output, TILES_FOLDER))
+        except OSError:
+            pass
+
+    if missing:
+        print("Frames still missing: {0}".format(FrameRangeArgument(missing)))
+        return 1
+
+    print("All frames rendered.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
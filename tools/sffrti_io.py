@@ -0,0 +1,347 @@
+"""
+Shared file helpers for the Blender SFF-RTI command line tools.
+
+These mirror the formats written by the add-on (Image.csv/Image.npy
+acquisition plans and the JSON lines render manifest) without depending on
+bpy, so the tools can run from a plain Python interpreter. Reading rendered
+images additionally needs Pillow for PNG files and the OpenEXR package for
+EXR files.
+"""
+
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+
+# Name of the manifest the add-on appends a record to for every finished frame
+RENDER_MANIFEST_NAME = "Render Manifest.jsonl"
+
+# Column layout of the acquisition plan, matching the add-on's ACQUISITION_PLAN_DTYPE
+ACQUISITION_PLAN_DTYPE = np.dtype([
+    ("frame", np.int32),
+    ("x_lamp", np.float64),
+    ("y_lamp", np.float64),
+    ("z_lamp", np.float64),
+    ("z_cam", np.float64),
+    ("aperture_fstop", np.float64),
+    ("lens", np.float64),
+    ("border_min_x", np.float64),
+    ("border_max_x", np.float64),
+    ("border_min_y", np.float64),
+    ("border_max_y", np.float64),
+    ("light", np.int32),
+])
+
+# Plan values of columns missing from plans written by older versions of the add-on
+ACQUISITION_PLAN_DEFAULTS = {"border_max_x": 1.0, "border_max_y": 1.0}
+
+# Decimal places z_cam values are rounded to when grouping frames into focus levels
+LEVEL_DECIMALS = 9
+
+
+def LoadPlan(folder):
+    """
+    Loads the acquisition plan from an output folder, preferring Image.npy
+    and falling back to parsing Image.csv
+    """
+
+    npyPath = os.path.join(folder, "Image.npy")
+    if os.path.isfile(npyPath):
+        table = np.load(npyPath)
+        frames = table["frame"]
+    else:
+        csvPath = os.path.join(folder, "Image.csv")
+        table = np.atleast_1d(np.genfromtxt(csvPath, delimiter=",", names=True, dtype=None, encoding="utf-8"))
+        frames = [int(name.rsplit("-", 1)[-1]) for name in table["image"]]
+
+    plan = np.zeros(len(table), dtype=ACQUISITION_PLAN_DTYPE)
+    plan["frame"] = frames
+    for name in ACQUISITION_PLAN_DTYPE.names[1:]:
+        plan[name] = table[name] if name in table.dtype.names else ACQUISITION_PLAN_DEFAULTS.get(name, 0)
+
+    return plan
+
+
+def ReadLPFile(filepath):
+    """
+    Reads a light positions (.lp) file into an (N, 3) array of X, Y, Z
+    light directions, checking the number of lights against the header like
+    the add-on's ReadLPFile. Row i holds the light numbered i + 1.
+    """
+
+    with open(filepath, 'r') as file:
+        header = file.readline().split()
+
+        try:
+            numLights = int(header[0])
+        except (IndexError, ValueError):
+            raise ValueError("first line must hold the number of lights")
+
+        if numLights < 1:
+            raise ValueError("header lists {0} lights".format(numLights))
+
+        rows = itertools.islice((line for line in file if line.strip()), numLights)
+        positions = np.loadtxt(rows, dtype=np.float64, usecols=(1, 2, 3), ndmin=2)
+
+    if positions.shape[0] != numLights:
+        raise ValueError("header lists {0} lights but {1} were found".format(numLights, positions.shape[0]))
+
+    return positions
+
+
+def ReadRenderManifest(filepath, syntheticSource=False):
+    """
+    Returns a dictionary of the latest manifest record for every completed
+    frame, skipping any truncated lines left by an interrupted render. With
+    syntheticSource, the in-focus renders of synthetic defocus are returned
+    instead of the acquisition's frames.
+    """
+
+    records = {}
+
+    if not os.path.isfile(filepath):
+        return records
+
+    with open(filepath, 'r', encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            # Invalidated frames have to be rendered again
+            if record.get("invalidated"):
+                records.pop(record["frame"], None)
+                continue
+
+            if record.get("synthetic_source", False) != syntheticSource:
+                continue
+
+            records[record["frame"]] = record
+
+    return records
+
+
+def WriteRenderManifest(filepath, records, sourceRecords=None):
+    """
+    Atomically replaces a manifest with the given records, sorted by frame,
+    optionally after the in-focus render records of synthetic defocus
+    """
+
+    tmpPath = filepath + ".tmp"
+
+    with open(tmpPath, 'w', encoding="utf-8") as file:
+        for recordSet in (sourceRecords or {}, records):
+            for frame in sorted(recordSet):
+                file.write(json.dumps(recordSet[frame]))
+                file.write("\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmpPath, filepath)
+
+
+def FileChecksum(filepath, blockSize=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's contents, like the add-on
+    records in the render manifest
+    """
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(blockSize), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def FrameRangeArgument(frames):
+    """
+    Compresses a list of frame numbers into Blender's `-f` argument syntax,
+    e.g. [1, 2, 3, 7] becomes "1..3,7"
+    """
+
+    frames = sorted(set(int(frame) for frame in frames))
+    parts = []
+
+    start = prev = frames[0]
+    for frame in frames[1:] + [None]:
+        if frame is not None and frame == prev + 1:
+            prev = frame
+            continue
+
+        parts.append(str(start) if start == prev else "{0}..{1}".format(start, prev))
+        start = prev = frame
+
+    return ",".join(parts)
+
+
+# Order channels are returned in, by the last part of their name
+CHANNEL_ORDER = "RGBAXYZV"
+
+def ReadEXR(filepath, layer="Combined"):
+    """
+    Reads the channels of one layer of an EXR file as a float32 array of
+    shape (height, width, channels). Single layer files return all channels.
+    """
+
+    try:
+        import Imath
+        import OpenEXR
+    except ImportError:
+        raise ImportError("Reading EXR files needs the OpenEXR package (pip install OpenEXR)")
+
+    file = OpenEXR.InputFile(filepath)
+    try:
+        header = file.header()
+        window = header["dataWindow"]
+        width = window.max.x - window.min.x + 1
+        height = window.max.y - window.min.y + 1
+
+        # Blender names multilayer channels "<view layer>.<pass>.<channel>"
+        names = list(header["channels"])
+        layerNames = [name for name in names if name.split(".")[-2:-1] == [layer]]
+        if layerNames:
+            names = layerNames
+        names.sort(key=lambda name: CHANNEL_ORDER.find(name.split(".")[-1]))
+
+        pixelType = Imath.PixelType(Imath.PixelType.FLOAT)
+        channels = [np.frombuffer(file.channel(name, pixelType), dtype=np.float32).reshape(height, width) for name in names]
+    finally:
+        file.close()
+
+    return np.stack(channels, axis=-1)
+
+
+def ReadImage(filepath, layer="Combined"):
+    """
+    Reads a rendered image as a float32 array of shape (height, width,
+    channels), scaling integer formats to the 0-1 range
+    """
+
+    extension = os.path.splitext(filepath)[1].lower()
+
+    if extension == ".exr":
+        return ReadEXR(filepath, layer)
+
+    if extension == ".npy":
+        image = np.load(filepath)
+        return (image if image.ndim == 3 else image[..., np.newaxis]).astype(np.float32)
+
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("Reading {0} files needs Pillow (pip install Pillow)".format(extension))
+
+    with Image.open(filepath) as file:
+        scale = 65535.0 if file.mode.startswith("I") else 255.0
+        image = np.asarray(file)
+
+    if image.ndim == 2:
+        image = image[..., np.newaxis]
+
+    return image.astype(np.float32) / scale
+
+
+def ToGray(image):
+    """
+    Returns the luminance of an RGB image, or the first channel of any other
+    image, as a 2D float32 array
+    """
+
+    if image.shape[-1] >= 3:
+        return image[..., :3] @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+    return image[..., 0]
+
+
+def GetFrameImagePath(record, layer="Combined"):
+    """
+    Returns the file holding a layer of a manifest record's frame, following
+    multilayer EXR layers that are shared with another frame
+    """
+
+    layers = record.get("layers")
+    if layers and layer in layers:
+        return layers[layer]
+
+    return record["outputs"]["image"]
+
+
+def PlaceOnCanvas(image, roi, fill=0.0):
+    """
+    Places an image cropped to a render border back on the full canvas
+    described by a manifest record's "roi", filling the rest with a constant.
+    Images without a region of interest are returned as they are.
+    """
+
+    if not roi:
+        return image
+
+    canvas = np.full((roi["canvas_height"], roi["canvas_width"]) + image.shape[2:], fill, dtype=image.dtype)
+    canvas[roi["y"]:roi["y"] + roi["height"], roi["x"]:roi["x"] + roi["width"]] = image
+
+    return canvas
+
+
+def ReadStackImage(entry):
+    """
+    Reads an image of a stack group, which is either a path or a pair of a
+    path and the region of interest it was cropped to
+    """
+
+    if isinstance(entry, tuple):
+        path, roi = entry
+        return PlaceOnCanvas(ReadImage(path), roi)
+
+    return ReadImage(entry)
+
+
+def _WriteStackSlice(task):
+    """
+    Averages a group of images into one slice of an image stack
+    """
+
+    stackPath, sliceIdx, paths, gray = task
+
+    total = None
+    for path in paths:
+        image = ReadStackImage(path)
+        image = ToGray(image) if gray else image[..., :3]
+        total = image if total is None else total + image
+
+    stack = np.load(stackPath, mmap_mode='r+')
+    stack[sliceIdx] = total / len(paths)
+    stack.flush()
+    del stack
+
+    return sliceIdx
+
+
+def BuildImageStack(stackPath, groups, workers, gray=True):
+    """
+    Writes a float32 stack with one slice per group of image paths to disk,
+    averaging the images of every group and decoding groups in parallel.
+    Cropped images are given as (path, roi) pairs and placed on the full
+    canvas. Slices are (height, width) grayscale or (height, width, 3) RGB
+    images. Returns the shape of the stack.
+    """
+
+    first = ReadStackImage(groups[0][0])
+    first = ToGray(first) if gray else first[..., :3]
+
+    stack = np.lib.format.open_memmap(stackPath, mode='w+', dtype=np.float32, shape=(len(groups),) + first.shape)
+    shape = stack.shape
+    del stack
+
+    tasks = [(stackPath, sliceIdx, paths, gray) for sliceIdx, paths in enumerate(groups)]
+    with multiprocessing.Pool(workers) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_WriteStackSlice, tasks), start=1):
+            print("\rStack: {0}/{1} images".format(done, len(tasks)), end="", flush=True)
+    print()
+
+    return shape